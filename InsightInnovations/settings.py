@@ -1,6 +1,6 @@
 # InsightInnovations/settings.py
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 import os  # Keep os imported
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -34,6 +34,154 @@ PAYSTACK_SECRET_KEY = config('PAYSTACK_SECRET_KEY', default='')
 ARKESEL_API_KEY = config('ARKESEL_API_KEY', default='')
 CURRENCY_CODE = config('CURRENCY_CODE', default='GHS')
 
+# ====================================================================
+# CHECKOUT
+# ====================================================================
+# Unverified checkouts for the same paper, email and phone number are reused
+# for this many seconds instead of opening a new Paystack session (0 disables).
+PENDING_CHECKOUT_REUSE_SECONDS = config('PENDING_CHECKOUT_REUSE_SECONDS', default=900, cast=int)
+
+# Payment status polling: how long a long-poll/SSE request may wait, how often it
+# re-reads the cached flag, and how long the verified and pending flags stay cached.
+# Saves refresh the flag in the cache, so with several workers use a shared cache
+# (see CACHES); otherwise other workers see a verification once pending expires.
+PAYMENT_STATUS_MAX_WAIT_SECONDS = config('PAYMENT_STATUS_MAX_WAIT_SECONDS', default=25, cast=int)
+PAYMENT_STATUS_POLL_INTERVAL = config('PAYMENT_STATUS_POLL_INTERVAL', default=1.0, cast=float)
+PAYMENT_STATUS_CACHE_SECONDS = config('PAYMENT_STATUS_CACHE_SECONDS', default=60 * 60, cast=int)
+PAYMENT_PENDING_STATUS_CACHE_SECONDS = config('PAYMENT_PENDING_STATUS_CACHE_SECONDS', default=3, cast=int)
+# payment_callback asks Paystack to verify an unverified reference at most this often
+PAYMENT_VERIFY_THROTTLE_SECONDS = config('PAYMENT_VERIFY_THROTTLE_SECONDS', default=15, cast=int)
+
+# ====================================================================
+# GATEWAY HTTP CLIENT (Paystack / Arkesel)
+# ====================================================================
+# Timeout (seconds) and pool size for the shared async client used by the
+# checkout, callback, webhook and SMS resend views.
+GATEWAY_TIMEOUT = config('GATEWAY_TIMEOUT', default=15, cast=float)
+GATEWAY_MAX_CONNECTIONS = config('GATEWAY_MAX_CONNECTIONS', default=100, cast=int)
+
+# ====================================================================
+# SMS DELIVERY
+# ====================================================================
+# Backend class path: shop.sms.ArkeselBackend, shop.sms.ConsoleBackend or
+# shop.sms.InMemoryBackend (tests).
+SMS_BACKEND = config('SMS_BACKEND', default='shop.sms.ArkeselBackend')
+SMS_SENDER_ID = config('SMS_SENDER_ID', default='Insight Innovations')
+# Attempts per send, with exponential backoff starting at SMS_RETRY_BACKOFF_SECONDS
+SMS_MAX_ATTEMPTS = config('SMS_MAX_ATTEMPTS', default=3, cast=int)
+SMS_RETRY_BACKOFF_SECONDS = config('SMS_RETRY_BACKOFF_SECONDS', default=0.5, cast=float)
+# At most this many messages per phone number per window (0 disables)
+SMS_THROTTLE_MAX_PER_WINDOW = config('SMS_THROTTLE_MAX_PER_WINDOW', default=5, cast=int)
+SMS_THROTTLE_WINDOW_SECONDS = config('SMS_THROTTLE_WINDOW_SECONDS', default=60 * 60, cast=int)
+# A repeated password SMS for the same payment inside this window is not re-sent
+SMS_DEDUPE_SECONDS = config('SMS_DEDUPE_SECONDS', default=60, cast=int)
+
+# ====================================================================
+# DOWNLOADS
+# ====================================================================
+# Lifetime of the signed download tokens minted for verified payments, and of
+# the SMS access link that unlocks them (resend_password_api sends a fresh one).
+DOWNLOAD_TOKEN_TTL_SECONDS = config('DOWNLOAD_TOKEN_TTL_SECONDS', default=24 * 60 * 60, cast=int)
+# Signed Cloudinary delivery URLs expire after this many seconds; each worker
+# caches up to MEDIA_URL_CACHE_SIZE of them (see shop/media_urls.py).
+MEDIA_URL_TTL_SECONDS = config('MEDIA_URL_TTL_SECONDS', default=10 * 60, cast=int)
+MEDIA_URL_CACHE_SIZE = config('MEDIA_URL_CACHE_SIZE', default=2048, cast=int)
+# How download_file delivers files: 'redirect' (signed storage URL), 'stream'
+# (local files with HTTP Range support), 'x-accel' (nginx X-Accel-Redirect) or
+# 'x-sendfile' (Apache/lighttpd). Non-local storage always redirects.
+DOWNLOAD_SERVE_MODE = config('DOWNLOAD_SERVE_MODE', default='redirect')
+# Internal nginx location that aliases MEDIA_ROOT (x-accel mode)
+DOWNLOAD_ACCEL_PREFIX = config('DOWNLOAD_ACCEL_PREFIX', default='/protected-media/')
+# Paid downloads allowed per payment within a sliding window (shop/quotas.py);
+# a limit of 0 turns that check off
+DOWNLOAD_QUOTA_WINDOW_SECONDS = config('DOWNLOAD_QUOTA_WINDOW_SECONDS', default=60 * 60, cast=int)
+DOWNLOAD_QUOTA_PER_PAYMENT = config('DOWNLOAD_QUOTA_PER_PAYMENT', default=30, cast=int)
+DOWNLOAD_QUOTA_PER_PAPER = config('DOWNLOAD_QUOTA_PER_PAPER', default=10, cast=int)
+DOWNLOAD_QUOTA_IPS_PER_PAYMENT = config('DOWNLOAD_QUOTA_IPS_PER_PAYMENT', default=5, cast=int)
+# Download history is buffered and written in batches (shop/download_log.py):
+# a flush runs every DOWNLOAD_LOG_BATCH_SIZE events or DOWNLOAD_LOG_FLUSH_SECONDS,
+# whichever comes first. Buffered events are kept on disk in DOWNLOAD_LOG_SPILL_DIR
+# until written, so it must survive restarts and be shared by all workers on a host.
+DOWNLOAD_LOG_BATCH_SIZE = config('DOWNLOAD_LOG_BATCH_SIZE', default=100, cast=int)
+DOWNLOAD_LOG_FLUSH_SECONDS = config('DOWNLOAD_LOG_FLUSH_SECONDS', default=5, cast=float)
+DOWNLOAD_LOG_SPILL_DIR = config('DOWNLOAD_LOG_SPILL_DIR', default=str(BASE_DIR / 'download_log'))
+# Download history older than DOWNLOAD_RETENTION_DAYS is moved by the
+# archive_downloads command into daily per-paper rollups (totals stay exact),
+# with the raw rows exported to gzipped JSONL under DOWNLOAD_ARCHIVE_DIR.
+DOWNLOAD_RETENTION_DAYS = config('DOWNLOAD_RETENTION_DAYS', default=90, cast=int)
+DOWNLOAD_ARCHIVE_DIR = config('DOWNLOAD_ARCHIVE_DIR', default=str(BASE_DIR / 'download_archive'))
+DOWNLOAD_ARCHIVE_BATCH_SIZE = config('DOWNLOAD_ARCHIVE_BATCH_SIZE', default=500, cast=int)
+
+# ====================================================================
+# RATE LIMITS
+# ====================================================================
+# Token buckets for public endpoints (shop/ratelimit.py): 'count/period' with
+# period s, m, h or d (e.g. '5/h', '10/15m'); empty or 0 turns a limit off.
+# Buckets and download quotas live in the cache, so they need a shared CACHES backend.
+RATE_LIMIT_TRACK_DOWNLOAD = config('RATE_LIMIT_TRACK_DOWNLOAD', default='30/m')
+# Each resend is a paid SMS: limit per client IP and per payment reference
+RATE_LIMIT_RESEND_PASSWORD_IP = config('RATE_LIMIT_RESEND_PASSWORD_IP', default='10/h')
+RATE_LIMIT_RESEND_PASSWORD = config('RATE_LIMIT_RESEND_PASSWORD', default='3/h')
+# Each submission sends two emails, one of them to the address given
+RATE_LIMIT_CONTACT_IP = config('RATE_LIMIT_CONTACT_IP', default='5/h')
+RATE_LIMIT_CONTACT_EMAIL = config('RATE_LIMIT_CONTACT_EMAIL', default='3/h')
+# Checkouts (single paper or bundle) per submitted phone number
+RATE_LIMIT_CHECKOUT_PHONE = config('RATE_LIMIT_CHECKOUT_PHONE', default='10/h')
+# Reverse proxies in front of the app (1 on Render). Client IPs for rate limits and
+# quotas are the X-Forwarded-For hop this far from the right; 0 uses REMOTE_ADDR.
+TRUSTED_PROXY_COUNT = config('TRUSTED_PROXY_COUNT', default=0, cast=int)
+
+# ====================================================================
+# BACKGROUND JOBS & PDF METADATA
+# ====================================================================
+# Threads in the shared background pool (shop/background.py)
+BACKGROUND_WORKERS = config('BACKGROUND_WORKERS', default=2, cast=int)
+# Uploads larger than this have their size/pages/checksum extracted in the
+# background instead of during the admin save
+PDF_METADATA_BACKGROUND_BYTES = config('PDF_METADATA_BACKGROUND_BYTES', default=8 * 1024 * 1024, cast=int)
+
+# ====================================================================
+# DIRECT UPLOADS
+# ====================================================================
+# Admin PDFs go from the browser straight to storage (shop/direct_upload.py).
+# Use 'shop.direct_upload.LocalDirectUpload' in development and tests.
+DIRECT_UPLOAD_BACKEND = config('DIRECT_UPLOAD_BACKEND', default='shop.direct_upload.CloudinaryDirectUpload')
+DIRECT_UPLOAD_TICKET_SECONDS = config('DIRECT_UPLOAD_TICKET_SECONDS', default=60 * 60, cast=int)
+# Largest file accepted by the local stand-in and by chunked uploads
+DIRECT_UPLOAD_MAX_BYTES = config('DIRECT_UPLOAD_MAX_BYTES', default=100 * 1024 * 1024, cast=int)
+# Large files are sent in resumable chunks of this size (shop/chunked_upload.py),
+# staged on local disk in CHUNKED_UPLOAD_DIR until the last chunk arrives
+CHUNKED_UPLOAD_CHUNK_BYTES = config('CHUNKED_UPLOAD_CHUNK_BYTES', default=5 * 1024 * 1024, cast=int)
+CHUNKED_UPLOAD_DIR = config('CHUNKED_UPLOAD_DIR', default=str(BASE_DIR / 'upload_chunks'))
+# Unused files are deleted in the background, this many per storage API call
+# (Cloudinary accepts up to 100), and given up on after this many failures
+# until the next sweep_media_orphans run
+STORAGE_DELETE_BATCH_SIZE = config('STORAGE_DELETE_BATCH_SIZE', default=100, cast=int)
+STORAGE_DELETE_MAX_ATTEMPTS = config('STORAGE_DELETE_MAX_ATTEMPTS', default=5, cast=int)
+
+# ====================================================================
+# PREVIEW IMAGES
+# ====================================================================
+# First-page previews are rendered in the background (shop/previews.py) by
+# PREVIEW_RENDERER: 'shop.previews.PyMuPDFRenderer' (pymupdf, installed from
+# requirements.txt) or 'shop.previews.PdftoppmRenderer' (needs the poppler-utils
+# system package). Pillow resizes and encodes them.
+PREVIEW_RENDERER = config('PREVIEW_RENDERER', default='shop.previews.PyMuPDFRenderer')
+PREVIEW_WIDTHS = config('PREVIEW_WIDTHS', default='320,640,1280', cast=Csv(int))
+# The first format is what cards use; the rest are fallbacks
+PREVIEW_FORMATS = config('PREVIEW_FORMATS', default='webp,jpeg', cast=Csv())
+PREVIEW_QUALITY = config('PREVIEW_QUALITY', default=80, cast=int)
+
+# ====================================================================
+# WATERMARKED DOWNLOADS
+# ====================================================================
+# Paid downloads are per-buyer copies stamped with the email and payment
+# reference (shop/watermark.py), made in WATERMARK_PROCESSES worker processes
+WATERMARK_ENABLED = config('WATERMARK_ENABLED', default=True, cast=bool)
+WATERMARK_PROCESSES = config('WATERMARK_PROCESSES', default=2, cast=int)
+# A copy still pending after this long is queued again (its job was lost)
+WATERMARK_PENDING_SECONDS = config('WATERMARK_PENDING_SECONDS', default=600, cast=int)
+
 # ====================================================================
 # EMAIL CONFIG (No change)
 # ====================================================================
@@ -98,12 +246,35 @@ TEMPLATES = [
 WSGI_APPLICATION = 'InsightInnovations.wsgi.application'
 
 # ====================================================================
-# DATABASE (No change)
+# DATABASE
 # ====================================================================
+# Download history and other high-write log tables go to their own database
+# (shop/routers.py) so logging never holds the lock payment writes need.
+# Migrate it with `python manage.py migrate --database=telemetry`; set
+# TELEMETRY_DATABASE=default to keep everything in one database.
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+    },
+    'telemetry': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': config('TELEMETRY_DB_NAME', default=str(BASE_DIR / 'telemetry.sqlite3')),
+    },
+}
+TELEMETRY_DATABASE = config('TELEMETRY_DATABASE', default='telemetry')
+DATABASE_ROUTERS = ['shop.routers.TelemetryRouter']
+
+# ====================================================================
+# CACHE
+# ====================================================================
+# Local memory by default. Use a shared backend (Redis, Memcached or the database
+# cache) when running several workers so cached state is seen by all of them;
+# rate limits and download quotas are per worker otherwise.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='insight-innovations'),
     }
 }
 
@@ -147,13 +318,26 @@ CLOUDINARY_STORAGE = {
     'API_KEY': config('CLOUDINARY_API_KEY'),
     'API_SECRET': config('CLOUDINARY_API_SECRET'),
 }
+# Key for Cloudinary token-based access (an account add-on). When set, signed
+# download URLs also expire after MEDIA_URL_TTL_SECONDS; see shop/cloudinary_media.py.
+CLOUDINARY_AUTH_TOKEN_KEY = config('CLOUDINARY_AUTH_TOKEN_KEY', default='')
 
 # ====================================================================
 # STORAGE CONFIGURATION - Cloudinary for media, Whitenoise for static
 # ====================================================================
+# Media goes to Cloudinary through a local disk cache (shop/storage.py), so
+# files read server-side are downloaded once and then served from disk.
+MEDIA_CACHE_DIR = config('MEDIA_CACHE_DIR', default=str(BASE_DIR / 'media_cache'))
+MEDIA_CACHE_MAX_BYTES = config('MEDIA_CACHE_MAX_BYTES', default=1024 * 1024 * 1024, cast=int)
+
 STORAGES = {
     "default": {
-        "BACKEND": "cloudinary_storage.storage.RawMediaCloudinaryStorage",  # For documents/PDFs
+        "BACKEND": "shop.storage.CachedMediaStorage",
+        "OPTIONS": {
+            "backend": "shop.cloudinary_media.AuthenticatedRawMediaStorage",  # PDFs, delivered by signed URL only
+            "location": MEDIA_CACHE_DIR,
+            "max_bytes": MEDIA_CACHE_MAX_BYTES,
+        },
     },
     "staticfiles": {
         "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage",
@@ -1,12 +1,20 @@
 # shop/admin.py
 
+from asgiref.sync import async_to_sync
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.db.models import Count
+from django.template.defaultfilters import filesizeformat
 from django.utils.html import format_html
 from django.urls import reverse
 from .models import (
     Classes, Term, Subject, QuestionPaper, 
-    Payment, DownloadHistory, FreeSample
+    Payment, PaymentItem, DownloadHistory, FreeSample, SmsMessage, MediaBlob,
+    StorageDeletion, WatermarkedCopy, UserAgent, DownloadRollup
 )
+from . import background, direct_upload, sms, storage_cleanup, watermark
+from .media_urls import resolve_media_url
 
 # --- 1. Admin setup for Hierarchy Models ---
 # ... (ClassesAdmin, TermAdmin, SubjectAdmin remain unchanged)
@@ -63,10 +71,77 @@ class SubjectAdmin(admin.ModelAdmin):
     view_papers_link.short_description = 'Papers Link'
 
 
+# --- Direct-to-storage uploads (shared by QuestionPaper and FreeSample) ---
+
+class DirectUploadAdminMixin:
+    """
+    Lets the change form take a PDF uploaded straight to storage by
+    shop/admin/direct_upload.js. The form receives a signed reference instead
+    of the file; size/pages/checksum are filled in by a background job.
+    """
+    direct_upload_field = None
+    
+    class Media:
+        js = ('shop/admin/direct_upload.js',)
+    
+    def get_form(self, request, obj=None, **kwargs):
+        form_class = super().get_form(request, obj, **kwargs)
+        field_name = self.direct_upload_field
+        model_label = self.model._meta.label_lower
+        reference_key = f"{field_name}_direct_upload"
+        
+        class DirectUploadForm(form_class):
+            def __init__(self, *args, **kw):
+                super().__init__(*args, **kw)
+                self.direct_upload_name = None
+                if field_name not in self.fields:
+                    return
+                self.fields[field_name].widget.attrs.update({
+                    'data-direct-upload-model': model_label,
+                    'data-direct-upload-reference': reference_key,
+                    'data-direct-upload-ticket-url': reverse('shop:direct_upload_ticket'),
+                    'data-direct-upload-complete-url': reverse('shop:direct_upload_complete'),
+                    'data-chunked-upload-url': reverse('shop:chunked_upload_start'),
+                    'data-chunked-upload-threshold': settings.CHUNKED_UPLOAD_CHUNK_BYTES,
+                })
+                if self.data.get(reference_key):
+                    # The file is already in storage; nothing is posted in the input
+                    self.fields[field_name].required = False
+            
+            def clean(self):
+                cleaned_data = super().clean()
+                reference = self.data.get(reference_key)
+                if reference:
+                    try:
+                        self.direct_upload_name = direct_upload.read_reference(reference, model_label, field_name)
+                    except direct_upload.DirectUploadError as e:
+                        self.add_error(field_name, str(e))
+                return cleaned_data
+        
+        return DirectUploadForm
+    
+    def save_model(self, request, obj, form, change):
+        name = getattr(form, 'direct_upload_name', None)
+        field_file = getattr(obj, self.direct_upload_field)
+        previous_name = field_file.name if field_file else None
+        if name:
+            setattr(obj, self.direct_upload_field, name)
+        super().save_model(request, obj, form, change)
+        
+        if name and name != previous_name:
+            if previous_name:
+                MediaBlob.release(previous_name)
+            background.submit(
+                direct_upload.finish_upload,
+                self.model._meta.label_lower, obj.pk, self.direct_upload_field, name
+            )
+
+
 # --- 2. Enhanced Admin setup for QuestionPaper (REVISED: Removed Preview) ---
 
 @admin.register(QuestionPaper)
-class QuestionPaperAdmin(admin.ModelAdmin):
+class QuestionPaperAdmin(DirectUploadAdminMixin, admin.ModelAdmin):
+    direct_upload_field = 'pdf_file'
     list_display = [
         'title', 'class_level', 'term', 'subject', 
         'price', 'is_paid', 'is_available', 
@@ -77,7 +152,7 @@ class QuestionPaperAdmin(admin.ModelAdmin):
     prepopulated_fields = {'slug': ('title',)}
     search_fields = ['title', 'description', 'password']
     readonly_fields = [
-        'views', 'file_size', 'created_at', 'updated_at', 
+        'views', 'file_size_bytes', 'checksum', 'created_at', 'updated_at', 
         'pdf_preview', 
         'file_info', 
         'download_count', 
@@ -103,7 +178,7 @@ class QuestionPaperAdmin(admin.ModelAdmin):
         }),
         ('Files', {
             # REMOVED: 'preview_image'
-            'fields': ('pdf_file', 'file_info', 'pdf_preview'), 
+            'fields': ('pdf_file', 'file_info', 'pdf_preview', 'checksum'), 
             'classes': ('wide',)
         }),
         ('Statistics', {
@@ -123,7 +198,7 @@ class QuestionPaperAdmin(admin.ModelAdmin):
         if obj.pdf_file:
             return format_html(
                 '<a href="{}" target="_blank" title="Download PDF">📥</a>',
-                obj.get_pdf_url()
+                obj.get_secure_pdf_url()
             )
         return "No PDF"
     pdf_download_link.short_description = 'PDF'
@@ -139,8 +214,8 @@ class QuestionPaperAdmin(admin.ModelAdmin):
                 </div>
             """,
                 obj.file_name,
-                obj.file_size or 'N/A', 
-                obj.get_pdf_url(),
+                filesizeformat(obj.file_size_bytes) if obj.file_size_bytes else 'N/A', 
+                obj.get_secure_pdf_url(),
                 "Open in new tab",
                 # REMOVED: self._get_preview_html(obj) condition
             )
@@ -162,11 +237,11 @@ class QuestionPaperAdmin(admin.ModelAdmin):
     file_info.short_description = 'File Storage Info'
     
     def download_count(self, obj):
-        return obj.downloads.count()
+        return obj.download_total
     download_count.short_description = 'Total Downloads'
     
     def last_download(self, obj):
-        last = obj.downloads.order_by('-downloaded_at').first()
+        last = DownloadHistory.objects.filter(paper_id=obj.pk).order_by('-downloaded_at').first()
         if last:
             return last.downloaded_at
         return "Never"
@@ -187,7 +262,13 @@ class QuestionPaperAdmin(admin.ModelAdmin):
 
 
 # --- 3. Enhanced Admin setup for Payment ---
-# ... (PaymentAdmin remains unchanged)
+
+class PaymentItemInline(admin.TabularInline):
+    model = PaymentItem
+    extra = 0
+    autocomplete_fields = ['question_paper']
+    readonly_fields = ['price']
+
 
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
@@ -197,15 +278,16 @@ class PaymentAdmin(admin.ModelAdmin):
         'date_created', 'download_link'
     ]
     list_filter = ['verified', 'date_created', 'payment_method']
-    search_fields = ['ref', 'email', 'phone_number', 'question_paper__title', 'transaction_id']
+    search_fields = ['ref', 'email', 'phone_number', 'question_paper__title', 'items__question_paper__title', 'transaction_id']
     list_editable = ['verified']
-    readonly_fields = ['ref', 'date_created', 'transaction_details', 'download_info']
+    inlines = [PaymentItemInline]
+    readonly_fields = ['ref', 'date_created', 'authorization_url', 'transaction_details', 'download_info']
     actions = ['mark_as_verified', 'mark_as_unverified']
     list_per_page = 25
     
     fieldsets = (
         ('Payment Information', {
-            'fields': ('ref', 'question_paper', 'amount_paid', 'payment_method', 'transaction_id')
+            'fields': ('ref', 'question_paper', 'amount_paid', 'payment_method', 'transaction_id', 'authorization_url')
         }),
         ('Customer Information', {
             'fields': ('email', 'phone_number')
@@ -229,6 +311,8 @@ class PaymentAdmin(admin.ModelAdmin):
     ref_short.admin_order_field = 'ref'
     
     def question_paper_link(self, obj):
+        if obj.is_bundle:
+            return f"Bundle ({obj.items.count()} papers)"
         url = reverse('admin:shop_questionpaper_change', args=[obj.question_paper.id])
         return format_html('<a href="{}">{}</a>', url, obj.question_paper.title)
     question_paper_link.short_description = 'Question Paper'
@@ -236,14 +320,14 @@ class PaymentAdmin(admin.ModelAdmin):
     def amount_display(self, obj):
         if obj.amount_paid:
             return f"GH₵{obj.amount_paid}"
-        return f"GH₵{obj.question_paper.price}"
+        return f"GH₵{obj.get_total_price()}"
     amount_display.short_description = 'Amount'
     
     def download_link(self, obj):
-        if obj.verified and obj.question_paper.pdf_file:
+        if obj.verified and not obj.is_bundle and obj.question_paper.pdf_file:
             return format_html(
                 '<a href="{}" target="_blank" title="Download">📥</a>',
-                obj.question_paper.get_pdf_url()
+                obj.question_paper.get_secure_pdf_url()
             )
         return "—"
     download_link.short_description = 'Download'
@@ -259,15 +343,16 @@ class PaymentAdmin(admin.ModelAdmin):
         """,
             obj.ref,
             obj.amount_in_pesewas(),
-            obj.question_paper.price,
+            obj.get_total_price(),
             f"GH₵{obj.amount_paid}" if obj.amount_paid else "Not recorded"
         )
     transaction_details.short_description = 'Transaction Details'
     
     def download_info(self, obj):
-        downloads = obj.downloads.count()
-        if downloads > 0:
-            last_download = obj.downloads.order_by('-downloaded_at').first()
+        downloads = DownloadHistory.objects.filter(payment_id=obj.pk)
+        count = downloads.count()
+        if count > 0:
+            last_download = downloads.order_by('-downloaded_at').first()
             return format_html("""
                 <div style="padding: 10px; background: #e8f4fd; border-radius: 5px;">
                     <strong>Total Downloads:</strong> {}<br>
@@ -275,7 +360,7 @@ class PaymentAdmin(admin.ModelAdmin):
                     <strong>By:</strong> {}
                 </div>
             """,
-                downloads,
+                count,
                 last_download.downloaded_at if last_download else "Never",
                 last_download.user_email if last_download else "—"
             )
@@ -284,39 +369,122 @@ class PaymentAdmin(admin.ModelAdmin):
     
     def mark_as_verified(self, request, queryset):
         updated = queryset.update(verified=True)
+        self._refresh_cached_status(queryset)
+        # queryset.update() also skips Payment.mark_as_verified's watermarking
+        for payment in queryset:
+            watermark.schedule(payment)
         self.message_user(request, f"{updated} payments marked as verified.")
     mark_as_verified.short_description = "Mark selected payments as verified"
     
     def mark_as_unverified(self, request, queryset):
         updated = queryset.update(verified=False)
+        self._refresh_cached_status(queryset)
         self.message_user(request, f"{updated} payments marked as unverified.")
     mark_as_unverified.short_description = "Mark selected payments as unverified"
     
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not PaymentItem:
+            return super().save_formset(request, form, formset, change)
+        # Price is read-only in the inline; items added here are charged the paper's current price
+        for item in formset.save(commit=False):
+            if item.price is None:
+                item.price = item.question_paper.price
+            item.save()
+        for item in formset.deleted_objects:
+            item.delete()
+    
+    def _refresh_cached_status(self, queryset):
+        # queryset.update() bypasses Payment.save(), so refresh the polled status here
+        for payment in queryset.only('ref', 'verified'):
+            payment.cache_status()
+    
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('question_paper')
+        return super().get_queryset(request).select_related('question_paper').prefetch_related('items')
 
 
 # --- 4. Admin setup for DownloadHistory ---
-# ... (DownloadHistoryAdmin remains unchanged)
+# Download history and rollups live in the telemetry database and hold plain
+# paper/payment ids (shop/routers.py), so paper filters and search look the
+# papers up first, and each changelist page loads its papers in one query.
+
+class TelemetryChangeList(ChangeList):
+    def get_results(self, request):
+        super().get_results(request)
+        self.result_list = self.model.attach_related(self.result_list)
+
+
+class PaperFieldFilter(admin.SimpleListFilter):
+    """Filter rows holding a ``paper_id`` by a foreign key on the paper."""
+    paper_field = None
+    related_model = None
+
+    def lookups(self, request, model_admin):
+        return [(obj.pk, str(obj)) for obj in self.related_model.objects.all()]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            paper_ids = QuestionPaper.objects.filter(**{self.paper_field: self.value()}).values_list('pk', flat=True)
+            return queryset.filter(paper_id__in=list(paper_ids))
+        return queryset
+
+
+class PaperClassFilter(PaperFieldFilter):
+    title = 'class'
+    parameter_name = 'class_level'
+    paper_field = 'class_level'
+    related_model = Classes
+
+
+class PaperSubjectFilter(PaperFieldFilter):
+    title = 'subject'
+    parameter_name = 'subject'
+    paper_field = 'subject'
+    related_model = Subject
+
+
+class TelemetryAdminMixin:
+    """Paper-title search and bulk-loaded papers for telemetry models."""
+
+    def get_changelist(self, request, **kwargs):
+        return TelemetryChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            paper_ids = list(QuestionPaper.objects.filter(title__icontains=search_term).values_list('pk', flat=True))
+            if paper_ids:
+                results = results | queryset.filter(paper_id__in=paper_ids)
+        return results, may_have_duplicates
+
+    def paper_link(self, obj):
+        if obj.paper is None:
+            return f"Deleted paper #{obj.paper_id}"
+        url = reverse('admin:shop_questionpaper_change', args=[obj.paper.id])
+        return format_html('<a href="{}">{}</a>', url, obj.paper.title)
+    paper_link.short_description = 'Question Paper'
+
 
 @admin.register(DownloadHistory)
-class DownloadHistoryAdmin(admin.ModelAdmin):
+class DownloadHistoryAdmin(TelemetryAdminMixin, admin.ModelAdmin):
     list_display = [
         'paper_link', 'user_email', 'downloaded_at', 
         'ip_address_short', 'payment_link', 'user_agent_short'
     ]
-    list_filter = ['downloaded_at', 'paper__class_level', 'paper__subject']
-    search_fields = ['user_email', 'paper__title', 'ip_address', 'user_agent']
-    readonly_fields = ['downloaded_at', 'all_info']
+    list_filter = [
+        'downloaded_at', PaperClassFilter, PaperSubjectFilter,
+        'user_agent__browser', 'user_agent__os', 'user_agent__device'
+    ]
+    search_fields = ['user_email', 'ip_address', 'user_agent__string']
+    readonly_fields = ['paper_link', 'payment_link', 'downloaded_at', 'user_agent', 'event_id', 'all_info']
     date_hierarchy = 'downloaded_at'
     list_per_page = 50
     
     fieldsets = (
         ('Download Information', {
-            'fields': ('paper', 'user_email', 'downloaded_at', 'ip_address', 'user_agent')
+            'fields': ('paper_link', 'user_email', 'downloaded_at', 'ip_address', 'user_agent', 'event_id')
         }),
         ('Payment Information', {
-            'fields': ('payment',),
+            'fields': ('payment_link',),
             'classes': ('collapse',)
         }),
         ('All Information', {
@@ -325,32 +493,15 @@ class DownloadHistoryAdmin(admin.ModelAdmin):
         }),
     )
     
-    def paper_link(self, obj):
-        url = reverse('admin:shop_questionpaper_change', args=[obj.paper.id])
-        return format_html('<a href="{}">{}</a>', url, obj.paper.title)
-    paper_link.short_description = 'Question Paper'
-    paper_link.admin_order_field = 'paper__title'
-    
     def ip_address_short(self, obj):
         return obj.ip_address[:15] + "..." if obj.ip_address and len(obj.ip_address) > 15 else obj.ip_address
     ip_address_short.short_description = 'IP Address'
     
     def user_agent_short(self, obj):
-        if obj.user_agent:
-            ua = obj.user_agent.lower()
-            if 'chrome' in ua:
-                return 'Chrome'
-            elif 'firefox' in ua:
-                return 'Firefox'
-            elif 'safari' in ua and 'chrome' not in ua:
-                return 'Safari'
-            elif 'edge' in ua:
-                return 'Edge'
-            elif 'opera' in ua:
-                return 'Opera'
-            return ua[:30] + "..."
-        return "Unknown"
+        # Parsed once when the user agent was first seen
+        return obj.user_agent.browser if obj.user_agent else "Unknown"
     user_agent_short.short_description = 'Browser'
+    user_agent_short.admin_order_field = 'user_agent__browser'
     
     def payment_link(self, obj):
         if obj.payment:
@@ -364,18 +515,19 @@ class DownloadHistoryAdmin(admin.ModelAdmin):
             <div style="padding: 10px; background: #f5f5f5; border-radius: 5px; font-family: monospace;">
                 <strong>User Agent:</strong><br>{}
             </div>
-        """, obj.user_agent if obj.user_agent else "Not available")
+        """, obj.user_agent.string if obj.user_agent else "Not available")
     all_info.short_description = 'Full User Agent'
     
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('paper', 'payment')
+        return super().get_queryset(request).select_related('user_agent')
 
 
 # --- 5. Admin setup for FreeSample ---
 # ... (FreeSampleAdmin remains unchanged)
 
 @admin.register(FreeSample)
-class FreeSampleAdmin(admin.ModelAdmin):
+class FreeSampleAdmin(DirectUploadAdminMixin, admin.ModelAdmin):
+    direct_upload_field = 'sample_pdf'
     list_display = [
         'question_paper_link', 'downloads', 'created_at', 
         'sample_preview', 'sample_download_link'
@@ -413,7 +565,7 @@ class FreeSampleAdmin(admin.ModelAdmin):
         if obj.sample_pdf:
             return format_html(
                 '<a href="{}" target="_blank" title="Download Sample">📥</a>',
-                obj.sample_pdf.url
+                resolve_media_url(obj.sample_pdf)
             )
         return "—"
     sample_download_link.short_description = 'Download'
@@ -427,7 +579,7 @@ class FreeSampleAdmin(admin.ModelAdmin):
                     <strong>URL:</strong> <a href="{}" target="_blank">Open in new tab</a><br>
                     <strong>Downloads:</strong> {} times
                 </div>
-            """, obj.sample_pdf.name, obj.sample_pdf.url, obj.downloads)
+            """, obj.sample_pdf.name, resolve_media_url(obj.sample_pdf), obj.downloads)
         return "No sample PDF uploaded"
     sample_info.short_description = 'Sample Information'
     
@@ -438,7 +590,7 @@ class FreeSampleAdmin(admin.ModelAdmin):
                     <strong>Sample PDF Link:</strong><br>
                     <a href="{}" target="_blank">{}</a>
                 </div>
-            """, obj.sample_pdf.url, obj.sample_pdf.url)
+            """, resolve_media_url(obj.sample_pdf), obj.sample_pdf.name)
         return "No sample available"
     sample_preview_field.short_description = 'Sample Link Preview'
     
@@ -446,7 +598,192 @@ class FreeSampleAdmin(admin.ModelAdmin):
         return super().get_queryset(request).select_related('question_paper')
 
 
+# --- 6. Admin setup for SmsMessage ---
+
+@admin.register(SmsMessage)
+class SmsMessageAdmin(admin.ModelAdmin):
+    list_display = [
+        'phone_number', 'status_badge', 'attempts', 'payment_link',
+        'backend_name', 'created_at', 'sent_at'
+    ]
+    list_filter = ['status', 'backend', 'created_at']
+    search_fields = ['phone_number', 'payment__ref', 'dedupe_key', 'error']
+    readonly_fields = [
+        'phone_number', 'body', 'payment', 'dedupe_key', 'status', 'backend',
+        'attempts', 'provider_response', 'error', 'created_at', 'sent_at'
+    ]
+    date_hierarchy = 'created_at'
+    list_per_page = 50
+    actions = ['retry_messages']
+    
+    fieldsets = (
+        ('Message', {
+            'fields': ('phone_number', 'body', 'payment', 'dedupe_key')
+        }),
+        ('Delivery', {
+            'fields': ('status', 'backend', 'attempts', 'created_at', 'sent_at')
+        }),
+        ('Provider Response', {
+            'fields': ('provider_response', 'error'),
+            'classes': ('collapse',)
+        }),
+    )
+    
+    def status_badge(self, obj):
+        colors = {
+            SmsMessage.STATUS_SENT: 'green',
+            SmsMessage.STATUS_FAILED: 'red',
+            SmsMessage.STATUS_THROTTLED: 'orange',
+        }
+        return format_html(
+            '<span style="color: {}; font-weight: bold;">{}</span>',
+            colors.get(obj.status, 'gray'), obj.get_status_display()
+        )
+    status_badge.short_description = 'Status'
+    status_badge.admin_order_field = 'status'
+    
+    def backend_name(self, obj):
+        return obj.backend.rsplit('.', 1)[-1]
+    backend_name.short_description = 'Backend'
+    
+    def payment_link(self, obj):
+        if obj.payment:
+            url = reverse('admin:shop_payment_change', args=[obj.payment.id])
+            return format_html('<a href="{}">#{}</a>', url, obj.payment.ref[:8])
+        return "—"
+    payment_link.short_description = 'Payment'
+    
+    def retry_messages(self, request, queryset):
+        messages = list(queryset.exclude(status=SmsMessage.STATUS_SENT))
+        async_to_sync(sms.adispatch)(messages)
+        sent = sum(1 for message in messages if message.status == SmsMessage.STATUS_SENT)
+        self.message_user(request, f"{sent} of {len(messages)} message(s) sent.")
+    retry_messages.short_description = "Retry selected unsent messages"
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('payment')
+
+
+# --- 7. Admin setup for MediaBlob ---
+
+@admin.register(MediaBlob)
+class MediaBlobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'size_display', 'refcount', 'checksum_short', 'created_at']
+    search_fields = ['name', 'checksum']
+    readonly_fields = ['checksum', 'name', 'size', 'refcount', 'created_at']
+    list_per_page = 50
+    
+    def size_display(self, obj):
+        return filesizeformat(obj.size)
+    size_display.short_description = 'Size'
+    size_display.admin_order_field = 'size'
+    
+    def checksum_short(self, obj):
+        return obj.checksum[:12]
+    checksum_short.short_description = 'SHA-256'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        # Blobs are removed by reference counting, never by hand
+        return False
+
+
+# --- 8. Admin setup for StorageDeletion ---
+
+@admin.register(StorageDeletion)
+class StorageDeletionAdmin(admin.ModelAdmin):
+    list_display = ['name', 'attempts', 'last_error', 'created_at']
+    list_filter = ['attempts']
+    search_fields = ['name', 'last_error']
+    readonly_fields = ['name', 'attempts', 'last_error', 'created_at']
+    actions = ['retry_deletions']
+    list_per_page = 50
+    
+    def retry_deletions(self, request, queryset):
+        queryset.update(attempts=0, last_error='')
+        background.submit(storage_cleanup.process_deletions)
+        self.message_user(request, "Deletions queued for another attempt.")
+    retry_deletions.short_description = "Retry deleting selected files"
+    
+    def has_add_permission(self, request):
+        return False
+
+
+# --- 9. Admin setup for WatermarkedCopy ---
+
+@admin.register(WatermarkedCopy)
+class WatermarkedCopyAdmin(admin.ModelAdmin):
+    list_display = ['paper', 'payment', 'status', 'pages', 'created_at', 'updated_at']
+    list_filter = ['status']
+    search_fields = ['payment__ref', 'payment__email', 'paper__title']
+    readonly_fields = ['payment', 'paper', 'status', 'file', 'source_checksum', 'pages', 'error', 'created_at', 'updated_at']
+    list_select_related = ['payment', 'paper']
+    actions = ['restamp']
+    list_per_page = 50
+    
+    def restamp(self, request, queryset):
+        copy_ids = list(queryset.values_list('pk', flat=True))
+        queryset.update(status=WatermarkedCopy.STATUS_PENDING, error='')
+        for copy_id in copy_ids:
+            watermark.submit(copy_id)
+        self.message_user(request, f"{len(copy_ids)} copies queued for stamping.")
+    restamp.short_description = "Stamp selected copies again"
+    
+    def has_add_permission(self, request):
+        return False
+
+
+# --- 10. Admin setup for UserAgent ---
+
+@admin.register(UserAgent)
+class UserAgentAdmin(admin.ModelAdmin):
+    list_display = ['browser', 'os', 'device', 'download_count', 'created_at', 'string_short']
+    list_filter = ['browser', 'os', 'device']
+    search_fields = ['string']
+    readonly_fields = ['digest', 'string', 'browser', 'os', 'device', 'created_at']
+    list_per_page = 50
+
+    def download_count(self, obj):
+        return obj.download_count
+    download_count.short_description = 'Downloads'
+    download_count.admin_order_field = 'download_count'
+
+    def string_short(self, obj):
+        return obj.string[:60] + "..." if len(obj.string) > 60 else obj.string
+    string_short.short_description = 'User Agent'
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(download_count=Count('downloads'))
+
+    def has_add_permission(self, request):
+        # Rows are created when downloads are logged
+        return False
+
+
+
+# --- 11. Admin setup for DownloadRollup ---
+
+@admin.register(DownloadRollup)
+class DownloadRollupAdmin(TelemetryAdminMixin, admin.ModelAdmin):
+    list_display = ['day', 'paper_link', 'downloads', 'paid_downloads']
+    list_filter = [PaperClassFilter, PaperSubjectFilter]
+    search_fields = ['day']
+    search_help_text = "Paper title or day (YYYY-MM-DD)."
+    readonly_fields = ['paper_link', 'day', 'downloads', 'paid_downloads']
+    fields = ['paper_link', 'day', 'downloads', 'paid_downloads']
+    date_hierarchy = 'day'
+    list_per_page = 50
+
+    def has_add_permission(self, request):
+        # Rows are written by the archive_downloads command
+        return False
+
 # Optional: Custom admin site header
 admin.site.site_header = 'InsightInnovations Administration'
 admin.site.site_title = 'InsightInnovations Admin Portal'
-admin.site.index_title = 'Welcome to InsightInnovations Admin'
\ No newline at end of file
+admin.site.index_title = 'Welcome to InsightInnovations Admin'
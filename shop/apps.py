@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class ShopConfig(AppConfig):
     name = 'shop'
+
+    def ready(self):
+        from .ratelimit import check_rates
+
+        check_rates()
@@ -0,0 +1,50 @@
+# shop/background.py
+
+"""
+A small shared thread pool for work that shouldn't hold up a request
+(PDF metadata extraction, previews, storage clean-up). Modules with their
+own executor (shop/watermark.py) hand jobs to it with ``submit_to``.
+
+Jobs run after the current transaction commits, close their database
+connection when done, and log failures instead of raising.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.BACKGROUND_WORKERS,
+            thread_name_prefix='shop-background',
+        )
+    return _executor
+
+
+def _run(fn, args, kwargs):
+    close_old_connections()
+    try:
+        return fn(*args, **kwargs)
+    except Exception:
+        logger.exception("Background job %s failed", getattr(fn, '__name__', fn))
+    finally:
+        close_old_connections()
+
+
+def submit(fn, *args, **kwargs):
+    """Run ``fn(*args, **kwargs)`` in the pool once the current transaction commits."""
+    transaction.on_commit(lambda: get_executor().submit(_run, fn, args, kwargs))
+
+
+def submit_to(get_pool, fn, *args, **kwargs):
+    """Like ``submit``, but on the executor returned by ``get_pool()``."""
+    transaction.on_commit(lambda: get_pool().submit(_run, fn, args, kwargs))
@@ -0,0 +1,103 @@
+# shop/chunked_upload.py
+
+"""
+Chunked, resumable admin uploads for large PDFs.
+
+The browser splits the file into ``chunk_size`` pieces and PUTs them in
+order, each with its SHA-256 in the ``X-Chunk-SHA256`` header. Every chunk
+is streamed from the request into a staging file on local disk (never held
+in memory, never buffered by Django's upload handlers) and hashed as it is
+written; a chunk whose hash doesn't match is cut off again, so the staging
+file only ever holds verified chunks. After an interruption the browser asks
+for the session's ``next_chunk`` and carries on from there.
+
+Once every chunk is in, ``assemble`` streams the staging file to the storage
+backend (Cloudinary's chunked upload API in production) and returns the same
+signed reference as a direct upload, so the admin form attaches it the same
+way (see shop/direct_upload.py).
+"""
+
+import hashlib
+import os
+
+from django.conf import settings
+
+from . import direct_upload
+from .direct_upload import DirectUploadError
+from .models import UploadSession
+
+READ_SIZE = 64 * 1024
+
+
+def start(model_label, field_name, filename, total_size):
+    """Open an upload session for a file of ``total_size`` bytes."""
+    direct_upload.upload_field(model_label, field_name)
+    if not filename.lower().endswith('.pdf'):
+        raise DirectUploadError("Only PDF files can be uploaded.")
+    if total_size <= 0 or total_size > settings.DIRECT_UPLOAD_MAX_BYTES:
+        raise DirectUploadError("The upload is empty or larger than DIRECT_UPLOAD_MAX_BYTES.")
+
+    os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+    session = UploadSession.objects.create(
+        model_label=model_label,
+        field_name=field_name,
+        filename=filename[:255],
+        total_size=total_size,
+        chunk_size=settings.CHUNKED_UPLOAD_CHUNK_BYTES,
+    )
+    open(session.staging_path, 'wb').close()
+    return session
+
+
+def write_chunk(session, index, checksum, stream):
+    """
+    Append chunk ``index`` from ``stream``, verifying it against ``checksum``
+    (hex SHA-256). Re-sending an already received chunk rewrites it and
+    everything after it.
+    """
+    if session.stored_name:
+        raise DirectUploadError("This upload has already been completed.")
+    if index < 0 or index >= session.chunk_count or index > session.received_chunks:
+        raise DirectUploadError(f"Expected chunk {session.received_chunks}, got {index}.")
+
+    expected_size = session.expected_chunk_size(index)
+    offset = index * session.chunk_size
+    hasher = hashlib.sha256()
+    written = 0
+    with open(session.staging_path, 'r+b') as staging:
+        staging.seek(offset)
+        staging.truncate()
+        while written < expected_size:
+            data = stream.read(min(READ_SIZE, expected_size - written))
+            if not data:
+                break
+            hasher.update(data)
+            staging.write(data)
+            written += len(data)
+
+        if written != expected_size or stream.read(1) or hasher.hexdigest() != (checksum or '').lower():
+            # Keep only the chunks verified so far
+            staging.truncate(offset)
+            session.received_chunks = index
+            session.save(update_fields=['received_chunks', 'updated_at'])
+            raise DirectUploadError(f"Chunk {index} was incomplete or failed its checksum.")
+
+    session.received_chunks = index + 1
+    session.save(update_fields=['received_chunks', 'updated_at'])
+
+
+def assemble(session):
+    """Send the assembled file to storage and return a signed upload reference."""
+    if not session.stored_name:
+        if not session.is_complete or os.path.getsize(session.staging_path) != session.total_size:
+            raise DirectUploadError(f"Upload incomplete: next chunk is {session.received_chunks}.")
+
+        field = direct_upload.upload_field(session.model_label, session.field_name)
+        key = f"{field.upload_to}{session.pk.hex}.pdf"
+        session.stored_name = direct_upload.get_backend().store_file(
+            direct_upload.backend_storage(field), key, session.staging_path
+        )
+        session.save(update_fields=['stored_name', 'updated_at'])
+        os.remove(session.staging_path)
+
+    return direct_upload.make_reference(session.model_label, session.field_name, session.stored_name)
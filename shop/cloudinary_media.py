@@ -0,0 +1,93 @@
+# shop/cloudinary_media.py
+
+"""
+Cloudinary storage for paid media.
+
+Files are uploaded with delivery type ``authenticated``: the CDN serves them
+only through URLs signed with the API secret, so a guessed or shared public
+URL gets nothing. URLs are built locally (no Admin API call) and point at
+res.cloudinary.com, so downloads are cached and served by the CDN.
+
+A plain signed URL does not expire. With Cloudinary's token-based access
+enabled, set CLOUDINARY_AUTH_TOKEN_KEY and ``signed_url(name, expires_at)``
+adds an expiring token as well. Files uploaded before this storage was
+configured are ``upload``-type; ``manage.py protect_media`` converts them.
+"""
+
+import os
+
+import cloudinary.uploader
+from cloudinary.utils import cloudinary_url
+from cloudinary_storage.storage import RawMediaCloudinaryStorage
+from django.conf import settings
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class AuthenticatedRawMediaStorage(RawMediaCloudinaryStorage):
+    # Read by shop.direct_upload and shop.storage_cleanup when calling the Cloudinary API
+    DELIVERY_TYPE = 'authenticated'
+
+    def _upload(self, name, content):
+        # Stored under exactly ``name``, without Cloudinary's random suffix: every
+        # name saved here is already unique (content hashes, UUIDs), and callers
+        # such as shop.previews rely on exists(name) to reuse identical files.
+        # An existing file is kept rather than overwritten.
+        options = {
+            'use_filename': True,
+            'unique_filename': False,
+            'overwrite': False,
+            'resource_type': self.RESOURCE_TYPE,
+            'type': self.DELIVERY_TYPE,
+            'tags': self.TAG,
+        }
+        folder = os.path.dirname(name)
+        if folder:
+            options['folder'] = folder
+        return cloudinary.uploader.upload(content, **options)
+
+    def _get_url(self, name):
+        # Also used by the base class for server-side reads (_open, exists, size)
+        return self.signed_url(name)
+
+    def signed_url(self, name, expires_at=None):
+        """Signed CDN URL for ``name``; expiring at ``expires_at`` when token access is configured."""
+        options = {
+            'resource_type': self.RESOURCE_TYPE,
+            'type': self.DELIVERY_TYPE,
+            'sign_url': True,
+            'secure': True,
+        }
+        if expires_at is not None and settings.CLOUDINARY_AUTH_TOKEN_KEY:
+            options['auth_token'] = {'key': settings.CLOUDINARY_AUTH_TOKEN_KEY, 'expiration': int(expires_at)}
+        return cloudinary_url(self._prepend_prefix(name), **options)[0]
+
+    def delete(self, name):
+        response = cloudinary.uploader.destroy(
+            name, invalidate=True, resource_type=self.RESOURCE_TYPE, type=self.DELIVERY_TYPE
+        )
+        return response['result'] == 'ok'
+
+
+def protect_uploaded(storage, folder, page_size=500):
+    """
+    Convert the public ``upload``-type files under ``folder`` to ``storage``'s
+    delivery type, keeping their public ids. Yields each converted name.
+    """
+    import cloudinary.api
+
+    prefix = storage._prepend_prefix(folder)
+    while True:
+        # Converted files leave the 'upload' listing, so each page starts from the top
+        result = cloudinary.api.resources(
+            type='upload', resource_type=storage.RESOURCE_TYPE, prefix=prefix, max_results=min(page_size, 500)
+        )
+        if not result['resources']:
+            return
+        for item in result['resources']:
+            cloudinary.uploader.rename(
+                item['public_id'], item['public_id'],
+                resource_type=storage.RESOURCE_TYPE, type='upload', to_type=storage.DELIVERY_TYPE,
+                overwrite=True, invalidate=True,
+            )
+            yield item['public_id']
@@ -0,0 +1,275 @@
+# shop/direct_upload.py
+
+"""
+Direct-to-storage admin uploads.
+
+Instead of posting a PDF through the admin form (and a sync worker), the
+browser:
+
+1. asks for an upload ticket (``shop:direct_upload_ticket``),
+2. sends the file straight to the storage provider using the signed
+   parameters in the ticket,
+3. reports back (``shop:direct_upload_complete``), which checks the object
+   exists and returns a signed upload reference,
+4. submits the admin form with that reference in place of the file.
+
+``finish_upload`` then runs in the background: it reads the object once
+(through the local media cache), records size/pages/checksum, and folds
+duplicates into an existing MediaBlob.
+
+DIRECT_UPLOAD_BACKEND selects the provider: ``CloudinaryDirectUpload`` in
+production, ``LocalDirectUpload`` (a stand-in endpoint on this site that
+writes to the storage backend) for development and tests.
+"""
+
+import os
+import time
+import uuid
+
+from django.apps import apps
+from django.conf import settings
+from django.core import signing
+from django.core.files import File
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+from . import pdf_metadata, previews
+
+TICKET_SALT = 'shop.direct-upload-ticket'
+REFERENCE_SALT = 'shop.direct-upload-reference'
+
+# Models and file fields that accept direct uploads
+UPLOAD_FIELDS = {
+    'shop.questionpaper': 'pdf_file',
+    'shop.freesample': 'sample_pdf',
+}
+
+
+class DirectUploadError(Exception):
+    pass
+
+
+def upload_field(model_label, field_name):
+    """The model FileField for a direct upload, if uploads to it are allowed."""
+    if UPLOAD_FIELDS.get(model_label) != field_name:
+        raise DirectUploadError("Direct uploads are not enabled for this field.")
+    return apps.get_model(model_label)._meta.get_field(field_name)
+
+
+def backend_storage(field):
+    # Uploads land in the real backend, not the caching wrapper
+    return getattr(field.storage, 'backend', field.storage)
+
+
+# ====================================================================
+# TICKETS & REFERENCES
+# ====================================================================
+
+def issue_ticket(model_label, field_name, filename):
+    """Return the signed ticket plus the provider-specific upload instructions."""
+    field = upload_field(model_label, field_name)
+    if not filename.lower().endswith('.pdf'):
+        raise DirectUploadError("Only PDF files can be uploaded.")
+
+    key = f"{field.upload_to}{uuid.uuid4().hex}.pdf"
+    ticket = signing.dumps({
+        'm': model_label,
+        'f': field_name,
+        'k': key,
+        'x': int(time.time()) + settings.DIRECT_UPLOAD_TICKET_SECONDS,
+    }, salt=TICKET_SALT)
+    return {
+        'ticket': ticket,
+        'upload': get_backend().upload_instructions(ticket, backend_storage(field), key),
+    }
+
+
+def read_ticket(ticket):
+    try:
+        data = signing.loads(ticket, salt=TICKET_SALT)
+    except signing.BadSignature:
+        raise DirectUploadError("Invalid upload ticket.")
+    if data['x'] < time.time():
+        raise DirectUploadError("Upload ticket has expired.")
+    return data
+
+
+def complete_upload(ticket, result):
+    """Verify the uploaded object for ``ticket`` and return a signed reference to it."""
+    data = read_ticket(ticket)
+    field = upload_field(data['m'], data['f'])
+    name = get_backend().verify(backend_storage(field), data['k'], result or {})
+    return make_reference(data['m'], data['f'], name)
+
+
+def make_reference(model_label, field_name, name):
+    """Signed reference to a stored object, submitted with the admin form."""
+    return signing.dumps({'m': model_label, 'f': field_name, 'n': name}, salt=REFERENCE_SALT)
+
+
+def read_reference(reference, model_label, field_name):
+    """Stored name from an upload reference issued for this model field."""
+    try:
+        data = signing.loads(reference, salt=REFERENCE_SALT, max_age=settings.DIRECT_UPLOAD_TICKET_SECONDS * 2)
+    except signing.BadSignature:
+        raise DirectUploadError("Invalid or expired upload reference.")
+    if data['m'] != model_label or data['f'] != field_name:
+        raise DirectUploadError("Upload reference is for a different field.")
+    return data['n']
+
+
+# ====================================================================
+# BACKENDS
+# ====================================================================
+
+def _delivery_type(storage):
+    # 'authenticated' for shop.cloudinary_media storage, Cloudinary's public 'upload' otherwise
+    return getattr(storage, 'DELIVERY_TYPE', 'upload')
+
+
+class CloudinaryDirectUpload:
+    """Signed browser uploads to Cloudinary's upload API."""
+
+    def upload_instructions(self, ticket, storage, key):
+        import cloudinary
+        from cloudinary.utils import api_sign_request
+
+        config = cloudinary.config()
+        public_id = storage._prepend_prefix(key)
+        params = {
+            'public_id': public_id,
+            'tags': storage.TAG,
+            'timestamp': int(time.time()),
+            'type': _delivery_type(storage),
+        }
+        params['signature'] = api_sign_request(params, config.api_secret)
+        params['api_key'] = config.api_key
+        return {
+            'method': 'POST',
+            'url': f"https://api.cloudinary.com/v1_1/{config.cloud_name}/{storage.RESOURCE_TYPE}/upload",
+            'fields': params,
+            'file_field': 'file',
+        }
+
+    def verify(self, storage, key, result):
+        import cloudinary.api
+
+        public_id = storage._prepend_prefix(key)
+        if result.get('public_id') != public_id:
+            raise DirectUploadError("Upload result does not match the ticket.")
+        try:
+            cloudinary.api.resource(public_id, resource_type=storage.RESOURCE_TYPE, type=_delivery_type(storage))
+        except cloudinary.api.NotFound:
+            raise DirectUploadError("The uploaded file was not found in storage.")
+        return public_id
+
+    def store_file(self, storage, key, path):
+        """Upload a local file (an assembled chunked upload) in provider-sized parts."""
+        import cloudinary.uploader
+
+        result = cloudinary.uploader.upload_large(
+            path,
+            public_id=storage._prepend_prefix(key),
+            resource_type=storage.RESOURCE_TYPE,
+            type=_delivery_type(storage),
+            tags=storage.TAG,
+        )
+        return result['public_id']
+
+
+class LocalDirectUpload:
+    """
+    Development/test stand-in: the browser PUTs the file to
+    ``shop:direct_upload_local``, which writes it to the storage backend.
+    """
+
+    def upload_instructions(self, ticket, storage, key):
+        return {
+            'method': 'PUT',
+            'url': reverse('shop:direct_upload_local', args=[ticket]),
+            'fields': {},
+            'file_field': None,
+        }
+
+    def receive(self, ticket, stream):
+        """Store the request body for ``ticket``. Called by the stand-in endpoint."""
+        data = read_ticket(ticket)
+        storage = backend_storage(upload_field(data['m'], data['f']))
+        if storage.exists(data['k']):
+            raise DirectUploadError("This ticket has already been used.")
+        try:
+            stored = storage.save(data['k'], File(_LimitedReader(stream), name=os.path.basename(data['k'])))
+        except DirectUploadError:
+            if storage.exists(data['k']):
+                storage.delete(data['k'])
+            raise
+        if stored != data['k']:
+            storage.delete(stored)
+            raise DirectUploadError("Could not store the upload under its ticket key.")
+
+    def verify(self, storage, key, result):
+        if not storage.exists(key):
+            raise DirectUploadError("The uploaded file was not found in storage.")
+        return key
+
+    def store_file(self, storage, key, path):
+        with open(path, 'rb') as f:
+            return storage.save(key, File(f, name=os.path.basename(key)))
+
+
+class _LimitedReader:
+    """File-like wrapper that stops reading past DIRECT_UPLOAD_MAX_BYTES."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.remaining = settings.DIRECT_UPLOAD_MAX_BYTES
+
+    def read(self, size=-1):
+        chunk = self.stream.read(size if size and size > 0 else 64 * 1024)
+        self.remaining -= len(chunk)
+        if self.remaining < 0:
+            raise DirectUploadError("The upload is larger than DIRECT_UPLOAD_MAX_BYTES.")
+        return chunk
+
+
+def get_backend():
+    return import_string(settings.DIRECT_UPLOAD_BACKEND)()
+
+
+# ====================================================================
+# AFTER THE FORM IS SAVED
+# ====================================================================
+
+def finish_upload(model_label, pk, field_name, name):
+    """
+    Background job for a freshly attached direct upload: scan it, reuse an
+    identical existing blob if there is one, and record its metadata.
+    """
+    from .models import MediaBlob
+
+    model = apps.get_model(model_label)
+    field = model._meta.get_field(field_name)
+    storage = field.storage
+
+    with storage.open(name, 'rb') as f:
+        metadata = pdf_metadata.scan_file(f)
+
+    blob, created = MediaBlob.objects.get_or_create(
+        checksum=metadata.checksum,
+        defaults={'name': name, 'size': metadata.size},
+    )
+    if not created and blob.name != name:
+        # Same content is already stored: point the row at it and drop the copy
+        model.objects.filter(pk=pk, **{field_name: name}).update(**{field_name: blob.name})
+        backend_storage(field).delete(name)
+        if hasattr(storage, 'evict'):
+            storage.evict(name)
+    MediaBlob.acquire(blob.name)
+
+    instance = model.objects.filter(pk=pk).first()
+    if instance is not None and hasattr(instance, 'apply_metadata'):
+        instance.apply_metadata(metadata)
+        model.objects.filter(pk=pk).update(
+            file_size_bytes=instance.file_size_bytes, pages=instance.pages, checksum=instance.checksum
+        )
+        previews.render_previews(pk)
@@ -0,0 +1,120 @@
+# shop/download_archive.py
+
+"""
+Retention for DownloadHistory.
+
+The table keeps the last DOWNLOAD_RETENTION_DAYS days of downloads. Older
+rows are moved out by ``archive_batch``, a few hundred at a time so no
+single write holds the database for long:
+
+1. The batch is appended to a gzipped JSONL file per day under
+   DOWNLOAD_ARCHIVE_DIR (``2025/03/downloads-2025-03-14.jsonl.gz``, one JSON
+   object per row) and fsynced.
+2. One transaction (in the telemetry database, which holds both tables)
+   adds the batch's per-paper daily counts to DownloadRollup and deletes
+   the rows, so ``DownloadHistory.total`` stays exact whenever it is read.
+
+A crash between the two steps leaves the rows in the table, and the next run
+appends them again; readers of the archive should drop repeated ``id``s.
+Each append is its own gzip member, which ``gzip.open`` reads back as one
+stream.
+"""
+
+import gzip
+import json
+import os
+from collections import Counter
+from datetime import datetime, time as dt_time, timedelta
+
+from django.conf import settings
+from django.db import models, router, transaction
+from django.utils import timezone
+
+
+def cutoff(days=None):
+    """Start of the first day still kept in the table (local time)."""
+    days = settings.DOWNLOAD_RETENTION_DAYS if days is None else days
+    first_day = timezone.localdate() - timedelta(days=days)
+    return timezone.make_aware(datetime.combine(first_day, dt_time.min))
+
+
+def archive_path(day):
+    return os.path.join(
+        settings.DOWNLOAD_ARCHIVE_DIR, f"{day:%Y}", f"{day:%m}", f"downloads-{day.isoformat()}.jsonl.gz"
+    )
+
+
+def _row(download):
+    return {
+        'id': download.pk,
+        'event_id': download.event_id.hex if download.event_id else None,
+        'paper_id': download.paper_id,
+        'payment_id': download.payment_id,
+        'user_email': download.user_email,
+        'ip_address': download.ip_address,
+        'user_agent': download.user_agent.string if download.user_agent else '',
+        'downloaded_at': download.downloaded_at.isoformat(),
+    }
+
+
+def _export(by_day):
+    for day, rows in by_day.items():
+        path = archive_path(day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'ab') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as f:
+                f.write(''.join(json.dumps(row) + '\n' for row in rows).encode())
+            raw.flush()
+            os.fsync(raw.fileno())
+
+
+def _roll_up(counts):
+    """Add ``{(paper_id, day): (downloads, paid_downloads)}`` to DownloadRollup."""
+    from .models import DownloadRollup
+
+    existing = {
+        (rollup.paper_id, rollup.day): rollup.pk
+        for rollup in DownloadRollup.objects.filter(
+            paper_id__in={paper_id for paper_id, _ in counts},
+            day__in={day for _, day in counts},
+        ).only('pk', 'paper_id', 'day')
+    }
+    new = []
+    for key, (downloads, paid) in counts.items():
+        if key in existing:
+            DownloadRollup.objects.filter(pk=existing[key]).update(
+                downloads=models.F('downloads') + downloads,
+                paid_downloads=models.F('paid_downloads') + paid,
+            )
+        else:
+            new.append(DownloadRollup(paper_id=key[0], day=key[1], downloads=downloads, paid_downloads=paid))
+    DownloadRollup.objects.bulk_create(new)
+
+
+def archive_batch(before, batch_size=None):
+    """Archive, roll up and delete up to ``batch_size`` rows older than ``before``. Returns rows moved."""
+    from .models import DownloadHistory
+
+    batch_size = batch_size or settings.DOWNLOAD_ARCHIVE_BATCH_SIZE
+    downloads = list(
+        DownloadHistory.objects.filter(downloaded_at__lt=before)
+        .select_related('user_agent').order_by('downloaded_at', 'pk')[:batch_size]
+    )
+    if not downloads:
+        return 0
+
+    by_day = {}
+    totals = Counter()
+    paid = Counter()
+    for download in downloads:
+        day = timezone.localdate(download.downloaded_at)
+        by_day.setdefault(day, []).append(_row(download))
+        totals[(download.paper_id, day)] += 1
+        if download.payment_id is not None:
+            paid[(download.paper_id, day)] += 1
+
+    _export(by_day)
+    with transaction.atomic(using=router.db_for_write(DownloadHistory)):
+        _roll_up({key: (count, paid[key]) for key, count in totals.items()})
+        DownloadHistory.objects.filter(pk__in=[download.pk for download in downloads]).delete()
+    return len(downloads)
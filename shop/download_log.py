@@ -0,0 +1,248 @@
+# shop/download_log.py
+
+"""
+Write-behind logging of downloads.
+
+``DownloadHistory.log_download`` no longer writes to the database. It calls
+``record``, which appends the event to an in-process buffer and to this
+process's spill file (one JSON line per event, in DOWNLOAD_LOG_SPILL_DIR),
+and returns. The buffer is flushed on the background pool when it reaches
+DOWNLOAD_LOG_BATCH_SIZE events, and by a timer thread every
+DOWNLOAD_LOG_FLUSH_SECONDS. A flush writes the rows with one
+``bulk_create`` in the telemetry database, then bumps the FreeSample
+download counters in the main one.
+
+The spill file is what makes buffered events durable. It is named after the
+process's PID plus a random token, so a restarted process that is handed
+the same PID never appends to (and then deletes) a dead one's file. On
+flush, the file is renamed aside and the events read back from it are
+written; it is deleted only after the transaction commits, so a crash at
+any point leaves the events on disk. ``recover`` (run when a process starts
+logging, by every flush and by the flush_download_log command) loads spill
+files left behind by failed flushes and by processes that are no longer
+running.
+Each event carries a UUID (DownloadHistory.event_id), so an event that was
+committed just before a crash is never inserted twice (a crash between the
+two databases' writes can leave a free sample's counter one batch short).
+"""
+
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.db import close_old_connections, models, router, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import background
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_buffer = []
+_spill_file = None
+_timer = None
+_timer_wake = threading.Event()
+
+
+# Told apart from an earlier process that had the same PID (e.g. before a restart)
+_process_token = uuid.uuid4().hex[:12]
+
+
+def _spill_path():
+    return os.path.join(settings.DOWNLOAD_LOG_SPILL_DIR, f"downloads-{os.getpid()}-{_process_token}.jsonl")
+
+
+def _pid_of(path):
+    try:
+        return int(os.path.basename(path).split('-')[1].split('.')[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# ====================================================================
+# RECORDING
+# ====================================================================
+
+def record(paper_id, payment_id=None, email=None, ip_address=None, user_agent=''):
+    """Buffer one download event. Never touches the database."""
+    global _spill_file
+    event = {
+        'event_id': uuid.uuid4().hex,
+        'paper_id': paper_id,
+        'payment_id': payment_id,
+        'user_email': email,
+        'ip_address': ip_address,
+        'user_agent': user_agent or '',
+        'downloaded_at': timezone.now().isoformat(),
+    }
+    line = json.dumps(event) + '\n'
+    with _lock:
+        if _spill_file is None:
+            os.makedirs(settings.DOWNLOAD_LOG_SPILL_DIR, exist_ok=True)
+            _spill_file = open(_spill_path(), 'a', encoding='utf-8')
+        _spill_file.write(line)
+        _spill_file.flush()
+        _buffer.append(event)
+        pending = len(_buffer)
+    _start_timer()
+    if pending >= settings.DOWNLOAD_LOG_BATCH_SIZE:
+        background.submit(flush)
+
+
+def _take_batch():
+    """Swap out the buffer and move its spill file aside; returns ``(events, path)``."""
+    global _spill_file
+    with _lock:
+        if not _buffer:
+            return [], None
+        events = _buffer[:]
+        _buffer.clear()
+        _spill_file.close()
+        _spill_file = None
+        path = f"{_spill_path()}.{uuid.uuid4().hex[:8]}.flushing"
+        os.replace(_spill_path(), path)
+    return events, path
+
+
+# ====================================================================
+# FLUSHING
+# ====================================================================
+
+def write_events(events):
+    """Insert events not already stored in one transaction, then bump FreeSample counters."""
+    from .models import DownloadHistory, FreeSample, UserAgent
+
+    if not events:
+        return 0
+    with transaction.atomic(using=router.db_for_write(DownloadHistory)):
+        ids = [uuid.UUID(event['event_id']) for event in events]
+        stored = {
+            event_id.hex for event_id in
+            DownloadHistory.objects.filter(event_id__in=ids).values_list('event_id', flat=True)
+        }
+        new = [event for event in events if event['event_id'] not in stored]
+        user_agent_ids = UserAgent.ids_for(event['user_agent'] for event in new)
+        DownloadHistory.objects.bulk_create([
+            DownloadHistory(
+                event_id=uuid.UUID(event['event_id']),
+                paper_id=event['paper_id'],
+                payment_id=event['payment_id'],
+                user_email=event['user_email'],
+                ip_address=event['ip_address'],
+                user_agent_id=user_agent_ids.get(event['user_agent']),
+                downloaded_at=parse_datetime(event['downloaded_at']),
+            )
+            for event in new
+        ], batch_size=500)
+
+    # Free downloads count towards the paper's free sample, if it has one
+    free = Counter(event['paper_id'] for event in new if event['payment_id'] is None)
+    for paper_id, count in free.items():
+        FreeSample.objects.filter(question_paper_id=paper_id).update(downloads=models.F('downloads') + count)
+    return len(new)
+
+
+def _read_spill(path):
+    events = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                # A line cut short by a crash mid-write
+                logger.warning("Skipping unreadable download event in %s", path)
+    return events
+
+
+def recover():
+    """Load spill files left behind by failed flushes and by processes that are no longer running."""
+    written = 0
+    for path in sorted(glob.glob(os.path.join(settings.DOWNLOAD_LOG_SPILL_DIR, 'downloads-*'))):
+        pid = _pid_of(path)
+        if pid is None or path == _spill_path():
+            continue
+        # This process's own leftovers are from a failed flush (flushes don't overlap)
+        if pid != os.getpid() and _is_running(pid):
+            continue
+        written += write_events(_read_spill(path))
+        os.remove(path)
+    return written
+
+
+def flush():
+    """Write buffered events (and any recovered ones) to the database. Returns rows written."""
+    with _flush_lock:
+        events, path = _take_batch()
+        written = 0
+        if events:
+            try:
+                # The file is the record: it may hold events the buffer lost track of
+                written = write_events(_read_spill(path))
+            except Exception:
+                # The events stay on disk for recover() to pick up
+                logger.exception("Could not write %d download events; kept in %s", len(events), path)
+                return 0
+            os.remove(path)
+        try:
+            written += recover()
+        except Exception:
+            logger.exception("Could not recover spilled download events")
+        return written
+
+
+def pending_count():
+    return len(_buffer)
+
+
+# ====================================================================
+# TIMER
+# ====================================================================
+
+def _run_timer():
+    # Pick up what earlier processes left behind as soon as this one starts logging
+    try:
+        with _flush_lock:
+            recover()
+    except Exception:
+        logger.exception("Could not recover spilled download events")
+    finally:
+        close_old_connections()
+    while True:
+        _timer_wake.wait(settings.DOWNLOAD_LOG_FLUSH_SECONDS)
+        _timer_wake.clear()
+        close_old_connections()
+        try:
+            flush()
+        except Exception:
+            logger.exception("Download log flush failed")
+        finally:
+            close_old_connections()
+
+
+def _start_timer():
+    global _timer
+    if _timer is not None:
+        return
+    with _lock:
+        if _timer is None:
+            _timer = threading.Thread(target=_run_timer, name='shop-download-log', daemon=True)
+            _timer.start()
+            atexit.register(flush)
@@ -0,0 +1,238 @@
+# shop/file_serving.py
+
+"""
+Serving files that live on local disk (MEDIA_ROOT in development and on
+self-hosted installs).
+
+DOWNLOAD_SERVE_MODE picks how download_file delivers a paper:
+
+- ``redirect``   - redirect to a signed storage URL (default; Cloudinary)
+- ``stream``     - stream from disk with HTTP Range / If-Range support so
+                   interrupted mobile downloads can resume
+- ``x-accel``    - hand the transfer to nginx via X-Accel-Redirect
+- ``x-sendfile`` - hand the transfer to Apache/lighttpd via X-Sendfile
+
+In the offload modes the worker only sends headers; the proxy reads the
+file and handles Range itself. In ``stream`` mode full-file responses use
+FileResponse (sendfile via wsgi.file_wrapper where the server supports it)
+and partial responses are sliced from a memory map instead of read() calls.
+Storages without a local path (Cloudinary) always fall back to ``redirect``.
+
+Under ASGI, Django buffers a streaming response built on a plain iterator
+in full before sending it, so ``response_iterator`` turns chunk generators
+into async iterators there, reading each chunk in a worker thread. There
+is no sendfile under ASGI either: full files go through the same chunk
+reader, and large installs should prefer an offload mode.
+"""
+
+import mimetypes
+import mmap
+import os
+import re
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+SERVE_MODES = ('redirect', 'stream', 'x-accel', 'x-sendfile')
+
+STREAM_CHUNK_SIZE = 256 * 1024
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def local_path(field_file):
+    """Filesystem path of a FieldFile, or None if its storage isn't local."""
+    try:
+        return field_file.path
+    except (NotImplementedError, AttributeError, ValueError):
+        return None
+
+
+def stream_etag(field_file, mode=None):
+    """
+    The ETag a ``stream`` mode response for ``field_file`` carries, or None
+    when it won't be streamed (other modes, remote storage, missing file).
+    Only streamed responses honour Range, so only they can be resumed.
+    """
+    if (mode or settings.DOWNLOAD_SERVE_MODE) != 'stream':
+        return None
+    path = local_path(field_file)
+    if path is None:
+        return None
+    try:
+        return _validators(os.stat(path))[0]
+    except FileNotFoundError:
+        return None
+
+
+def is_resumed_request(request, etag):
+    """
+    True for a Range request continuing the download identified by ``etag``:
+    a range starting past byte 0, made conditional with ``If-Range: <etag>``.
+    """
+    match = _RANGE_RE.match(request.headers.get('Range', '').strip())
+    if not match or not match.group(1) or int(match.group(1)) == 0:
+        return False
+    return etag is not None and request.headers.get('If-Range') == etag
+
+
+def parse_range(header, size):
+    """
+    Parse a single-range ``Range`` header against a file of ``size`` bytes.
+
+    Returns ``(start, end)`` (inclusive), ``None`` when the header should be
+    ignored (absent, malformed or multi-range: serve the whole file), or
+    ``False`` when the range can't be satisfied.
+    """
+    match = _RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or (last and end < start):
+        return False
+    return start, min(end, size - 1)
+
+
+def _validators(stat):
+    etag = quote_etag(f"{int(stat.st_mtime):x}-{stat.st_size:x}")
+    return etag, http_date(stat.st_mtime)
+
+
+def _if_range_matches(request, etag, mtime):
+    """A Range is honoured only if If-Range (when sent) still matches the file."""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        # Strong comparison: weak validators never match
+        return if_range == etag
+    since = parse_http_date_safe(if_range)
+    return since is not None and int(mtime) <= since
+
+
+def _mmap_chunks(path, start, end):
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        position = start
+        while position <= end:
+            stop = min(position + STREAM_CHUNK_SIZE, end + 1)
+            yield mapped[position:stop]
+            position = stop
+
+
+def _file_chunks(path):
+    with open(path, 'rb') as f:
+        while chunk := f.read(STREAM_CHUNK_SIZE):
+            yield chunk
+
+
+_DONE = object()
+
+
+async def _iterate_in_thread(chunks):
+    # Chunks come from blocking reads, so each one is produced off the event loop
+    step = sync_to_async(next, thread_sensitive=False)
+    try:
+        while (chunk := await step(chunks, _DONE)) is not _DONE:
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close, thread_sensitive=False)()
+
+
+def response_iterator(request, chunks):
+    """
+    Content for a StreamingHttpResponse that the server will really stream:
+    the generator itself under WSGI, an async iterator over it under ASGI.
+    """
+    if isinstance(request, ASGIRequest):
+        return _iterate_in_thread(chunks)
+    return chunks
+
+
+def set_download_headers(response, filename, content_type):
+    response['Content-Type'] = content_type
+    response['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(filename)}"
+
+
+def stream_file(request, path, filename):
+    """Serve ``path`` with Range/If-Range support."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise Http404("The requested paper file was not found.")
+    size = stat.st_size
+    etag, last_modified = _validators(stat)
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    byte_range = None
+    if size and _if_range_matches(request, etag, stat.st_mtime):
+        byte_range = parse_range(request.headers.get('Range'), size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{size}"
+    elif byte_range is None:
+        if isinstance(request, ASGIRequest):
+            response = StreamingHttpResponse(response_iterator(request, _file_chunks(path)))
+            set_download_headers(response, filename, content_type)
+            response['Content-Length'] = str(size)
+        else:
+            response = FileResponse(open(path, 'rb'), as_attachment=True, filename=filename)
+            response['Content-Type'] = content_type
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(response_iterator(request, _mmap_chunks(path, start, end)), status=206)
+        set_download_headers(response, filename, content_type)
+        response['Content-Range'] = f"bytes {start}-{end}/{size}"
+        response['Content-Length'] = str(end - start + 1)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    return response
+
+
+def offload_file(field_file, path, filename, mode):
+    """Let the front proxy send the file (X-Accel-Redirect or X-Sendfile)."""
+    response = HttpResponse()
+    set_download_headers(response, filename, mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+    if mode == 'x-accel':
+        prefix = settings.DOWNLOAD_ACCEL_PREFIX.rstrip('/')
+        response['X-Accel-Redirect'] = f"{prefix}/{quote(field_file.name)}"
+    else:
+        response['X-Sendfile'] = path
+    return response
+
+
+def serve_field_file(request, field_file, filename, mode=None):
+    """
+    Serve a FieldFile in the configured DOWNLOAD_SERVE_MODE. Returns None when
+    the caller should redirect instead (redirect mode or non-local storage).
+    """
+    mode = mode or settings.DOWNLOAD_SERVE_MODE
+    if mode not in SERVE_MODES:
+        raise ImproperlyConfigured(f"DOWNLOAD_SERVE_MODE must be one of {', '.join(SERVE_MODES)}, not {mode!r}.")
+    if mode == 'redirect':
+        return None
+    path = local_path(field_file)
+    if path is None:
+        return None
+    if mode == 'stream':
+        return stream_file(request, path, filename)
+    return offload_file(field_file, path, filename, mode)
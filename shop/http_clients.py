@@ -0,0 +1,38 @@
+# shop/http_clients.py
+
+"""
+Shared, pooled HTTP clients for the payment and SMS gateways.
+
+Async views get one httpx.AsyncClient per event loop; under an ASGI server
+that is one per worker, so connections to Paystack and Arkesel stay open
+between requests and many gateway calls can be in flight at once.
+"""
+
+import asyncio
+import weakref
+
+import httpx
+from django.conf import settings
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """
+    Return the pooled httpx.AsyncClient for the running event loop.
+
+    Clients are keyed by loop because a client cannot be shared across loops
+    (e.g. when async views run under WSGI, each request gets its own loop).
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=settings.GATEWAY_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=settings.GATEWAY_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.GATEWAY_MAX_CONNECTIONS,
+            ),
+        )
+        _async_clients[loop] = client
+    return client
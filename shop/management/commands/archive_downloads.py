@@ -0,0 +1,57 @@
+# shop/management/commands/archive_downloads.py
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shop import download_archive
+from shop.models import DownloadHistory
+
+
+class Command(BaseCommand):
+    help = (
+        "Move download history older than DOWNLOAD_RETENTION_DAYS into daily per-paper "
+        "rollups, exporting the raw rows to gzipped JSONL in DOWNLOAD_ARCHIVE_DIR first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.DOWNLOAD_RETENTION_DAYS,
+            help="Days of history to keep in the table (default: DOWNLOAD_RETENTION_DAYS)."
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.DOWNLOAD_ARCHIVE_BATCH_SIZE,
+            help="Rows moved per transaction (default: DOWNLOAD_ARCHIVE_BATCH_SIZE)."
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0.2,
+            help="Seconds to sleep between batches so site writes get through (default: 0.2)."
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Only report how many rows would be archived."
+        )
+
+    def handle(self, *args, **options):
+        before = download_archive.cutoff(options['days'])
+        if options['dry_run']:
+            count = DownloadHistory.objects.filter(downloaded_at__lt=before).count()
+            self.stdout.write(self.style.WARNING(f"Dry run: {count} download(s) before {before:%Y-%m-%d} would be archived."))
+            return
+
+        moved = 0
+        while True:
+            batch = download_archive.archive_batch(before, options['batch_size'])
+            if not batch:
+                break
+            moved += batch
+            self.stdout.write(f"  archived {moved} download(s) so far")
+            time.sleep(options['pause'])
+
+        if moved:
+            self.stdout.write(self.style.SUCCESS(
+                f"Archived {moved} download(s) before {before:%Y-%m-%d} to {settings.DOWNLOAD_ARCHIVE_DIR}."
+            ))
+        else:
+            self.stdout.write("No downloads to archive.")
@@ -0,0 +1,120 @@
+# shop/management/commands/benchmark_watermark.py
+
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import previews, watermark
+from shop.models import QuestionPaper
+
+
+def make_sample_pdf(path, pages):
+    """Write an A4 PDF of ``pages`` pages, each with a page of text on it."""
+    from pypdf import PageObject, PdfWriter
+    from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject('/Type'): NameObject('/Font'),
+        NameObject('/Subtype'): NameObject('/Type1'),
+        NameObject('/BaseFont'): NameObject('/Times-Roman'),
+    }))
+    lines = b''.join(
+        b'(%d. Answer all the questions in this section in the spaces provided.) Tj T* ' % line
+        for line in range(1, 51)
+    )
+    for number in range(pages):
+        page = PageObject.create_blank_page(width=595, height=842)
+        page[NameObject('/Resources')] = DictionaryObject({
+            NameObject('/Font'): DictionaryObject({NameObject('/F1'): font}),
+        })
+        content = DecodedStreamObject()
+        content.set_data(b'BT /F1 11 Tf 14 TL 56 780 Td (Page %d) Tj T* ' % (number + 1) + lines + b'ET')
+        page[NameObject('/Contents')] = writer._add_object(content)
+        writer.add_page(page)
+    with open(path, 'wb') as f:
+        writer.write(f)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure watermarking throughput: stamp a PDF repeatedly in a process pool "
+        "and report pages per second overall and per core."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--paper', type=int,
+            help="Benchmark with this paper's PDF (default: a generated text PDF)."
+        )
+        parser.add_argument(
+            '--file',
+            help="Benchmark with a local PDF file instead."
+        )
+        parser.add_argument(
+            '--password', default='',
+            help="Password of an encrypted --file (--paper uses the paper's)."
+        )
+        parser.add_argument(
+            '--pages', type=int, default=20,
+            help="Pages in the generated PDF (default: 20)."
+        )
+        parser.add_argument(
+            '--processes', type=int, default=settings.WATERMARK_PROCESSES,
+            help="Worker processes (default: WATERMARK_PROCESSES)."
+        )
+        parser.add_argument(
+            '--jobs', type=int,
+            help="Copies to stamp (default: 4 per process)."
+        )
+
+    def handle(self, *args, **options):
+        processes = max(options['processes'], 1)
+        jobs = options['jobs'] or processes * 4
+
+        password = options['password']
+        with ExitStack() as stack:
+            directory = stack.enter_context(tempfile.TemporaryDirectory())
+            if options['file']:
+                source = options['file']
+            elif options['paper']:
+                paper = QuestionPaper.objects.filter(pk=options['paper']).exclude(pdf_file='').first()
+                if paper is None:
+                    raise CommandError(f"Paper {options['paper']} doesn't exist or has no PDF.")
+                source = stack.enter_context(previews.local_copy(paper.pdf_file))
+                password = paper.password
+            else:
+                source = os.path.join(directory, 'sample.pdf')
+                make_sample_pdf(source, options['pages'])
+
+            text = watermark.footer_text('buyer@example.com', 'BENCHMARK01')
+            with ProcessPoolExecutor(
+                max_workers=processes, mp_context=multiprocessing.get_context('spawn')
+            ) as pool:
+                # Start every worker before timing so start-up isn't counted
+                list(pool.map(time.sleep, [0.2] * processes))
+
+                started = time.perf_counter()
+                results = list(pool.map(
+                    watermark.stamp_pdf,
+                    [source] * jobs,
+                    [os.path.join(directory, f"out-{job}.pdf") for job in range(jobs)],
+                    [text] * jobs,
+                    [password] * jobs,
+                ))
+                elapsed = time.perf_counter() - started
+
+        pages = sum(result[0] for result in results)
+        cpu_seconds = sum(result[1] for result in results)
+        self.stdout.write(f"Stamped {jobs} copies of {results[0][0]} page(s) with {processes} process(es).")
+        self.stdout.write(f"Wall time:        {elapsed:.2f}s")
+        self.stdout.write(f"Throughput:       {pages / elapsed:.1f} pages/s")
+        self.stdout.write(self.style.SUCCESS(
+            f"Per core:         {pages / cpu_seconds if cpu_seconds else 0:.1f} pages/s (CPU time)"
+        ))
@@ -0,0 +1,39 @@
+# shop/management/commands/extract_pdf_metadata.py
+
+from django.core.management.base import BaseCommand
+
+from shop import pdf_metadata
+from shop.models import QuestionPaper
+
+
+class Command(BaseCommand):
+    help = "Fill in byte size, page count and checksum for papers uploaded before extraction existed."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help="Re-scan every paper, not just those missing metadata."
+        )
+
+    def handle(self, *args, **options):
+        papers = QuestionPaper.objects.exclude(pdf_file='')
+        if not options['all']:
+            papers = papers.filter(checksum='')
+
+        updated = 0
+        for paper in papers.only('pk', 'pdf_file', 'pages').iterator():
+            try:
+                # Reads go through the local media cache, so each file is fetched once
+                with paper.pdf_file.open('rb') as f:
+                    metadata = pdf_metadata.scan_file(f)
+            except Exception as e:
+                self.stdout.write(self.style.WARNING(f"Skipping {paper.pdf_file.name}: {e}"))
+                continue
+
+            paper.apply_metadata(metadata)
+            QuestionPaper.objects.filter(pk=paper.pk).update(
+                file_size_bytes=paper.file_size_bytes, pages=paper.pages, checksum=paper.checksum
+            )
+            updated += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Updated metadata for {updated} paper(s)."))
@@ -0,0 +1,19 @@
+# shop/management/commands/flush_download_log.py
+
+from django.core.management.base import BaseCommand
+
+from shop import download_log
+
+
+class Command(BaseCommand):
+    help = (
+        "Write download events left in DOWNLOAD_LOG_SPILL_DIR by stopped or crashed "
+        "workers to the download history."
+    )
+
+    def handle(self, *args, **options):
+        written = download_log.recover()
+        if written:
+            self.stdout.write(self.style.SUCCESS(f"Wrote {written} download event(s)."))
+        else:
+            self.stdout.write("No download events to write.")
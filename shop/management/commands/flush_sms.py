@@ -0,0 +1,64 @@
+# shop/management/commands/flush_sms.py
+
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from shop import sms
+from shop.models import SmsMessage
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-send failed SMS messages, and pending ones left behind by a crashed "
+        "worker, in provider batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-age-hours', type=int, default=24,
+            help="Ignore messages older than this (default: 24)."
+        )
+        parser.add_argument(
+            '--stale-minutes', type=int, default=10,
+            help="Treat pending messages older than this as abandoned (default: 10). "
+                 "Younger ones may still be mid-send and are left alone."
+        )
+        parser.add_argument(
+            '--limit', type=int, default=500,
+            help="Most messages to send in one run (default: 500)."
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        cutoff = now - timedelta(hours=options['max_age_hours'])
+        stale = now - timedelta(minutes=options['stale_minutes'])
+        # A later resend may already have delivered the same password
+        delivered_keys = SmsMessage.objects.filter(
+            status=SmsMessage.STATUS_SENT, created_at__gte=cutoff
+        ).exclude(dedupe_key='').values('dedupe_key')
+        delivered_later = SmsMessage.objects.filter(
+            payment=OuterRef('payment'), status=SmsMessage.STATUS_SENT, created_at__gt=OuterRef('created_at')
+        )
+
+        messages = list(
+            SmsMessage.objects.filter(
+                Q(status=SmsMessage.STATUS_FAILED) | Q(status=SmsMessage.STATUS_PENDING, created_at__lt=stale),
+                created_at__gte=cutoff,
+            ).exclude(dedupe_key__in=delivered_keys)
+            .exclude(Q(payment__isnull=False) & Exists(delivered_later))
+            .order_by('created_at')[:options['limit']]
+        )
+        if not messages:
+            self.stdout.write("No messages to send.")
+            return
+
+        async_to_sync(sms.adispatch)(messages)
+
+        sent = sum(1 for message in messages if message.status == SmsMessage.STATUS_SENT)
+        self.stdout.write(self.style.SUCCESS(f"Sent {sent} of {len(messages)} message(s)."))
+        if sent < len(messages):
+            self.stdout.write(self.style.WARNING(f"{len(messages) - sent} message(s) still failing."))
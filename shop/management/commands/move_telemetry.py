@@ -0,0 +1,94 @@
+# shop/management/commands/move_telemetry.py
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models.expressions import RawSQL
+
+from shop.models import DownloadHistory, DownloadRollup, UserAgent
+
+# Referenced tables first when copying; deleted in reverse
+MODELS = [UserAgent, DownloadHistory, DownloadRollup]
+
+
+class Command(BaseCommand):
+    help = (
+        "Move download history, user agents and rollups written before the telemetry "
+        "database existed from the main database into it. Safe to run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Rows copied per transaction (default: 1000)."
+        )
+
+    def handle(self, *args, **options):
+        target = settings.TELEMETRY_DATABASE
+        if target == DEFAULT_DB_ALIAS:
+            self.stdout.write("TELEMETRY_DATABASE is 'default'; nothing to move.")
+            return
+        source_tables = set(connections[DEFAULT_DB_ALIAS].introspection.table_names())
+        models = [model for model in MODELS if model._meta.db_table in source_tables]
+        if not models:
+            self.stdout.write("The main database has no telemetry tables; nothing to move.")
+            return
+        target_tables = set(connections[target].introspection.table_names())
+        if any(model._meta.db_table not in target_tables for model in MODELS):
+            raise CommandError(f"Run 'python manage.py migrate --database={target}' first.")
+
+        for model in models:
+            copied = self._copy(model, target, options['batch_size'])
+            self.stdout.write(f"  {model._meta.verbose_name_plural}: copied {copied}")
+
+        # Only once everything is copied, so user agents outlive the rows using them.
+        # Plain SQL: the old tables may predate the current model fields.
+        connection = connections[DEFAULT_DB_ALIAS]
+        with transaction.atomic(using=DEFAULT_DB_ALIAS), connection.cursor() as cursor:
+            for model in reversed(models):
+                cursor.execute(f"DELETE FROM {connection.ops.quote_name(model._meta.db_table)}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved telemetry to '{target}'. The emptied tables in the main database can be dropped."
+        ))
+
+    def _columns(self, model):
+        connection = connections[DEFAULT_DB_ALIAS]
+        with connection.cursor() as cursor:
+            return {
+                column.name
+                for column in connection.introspection.get_table_description(cursor, model._meta.db_table)
+            }
+
+    def _copy(self, model, target, batch_size):
+        """
+        Copy ``model``'s rows in whatever schema the main database has them.
+        Migrations for the telemetry models don't run there once the router is
+        on, so an upgraded site's tables are left as they were: fields added
+        since are left empty, and download history from before user agents were
+        interned has the raw string, which is interned now.
+        """
+        columns = self._columns(model)
+        fields = [field.attname for field in model._meta.concrete_fields if field.column in columns]
+        queryset = model.objects.using(DEFAULT_DB_ALIAS).order_by('pk')
+        legacy_agents = model is DownloadHistory and 'user_agent_id' not in columns and 'user_agent' in columns
+        if legacy_agents:
+            queryset = queryset.annotate(agent_string=RawSQL(
+                f"{connections[DEFAULT_DB_ALIAS].ops.quote_name(model._meta.db_table)}.user_agent", ()
+            ))
+            fields.append('agent_string')
+
+        copied = 0
+        last_pk = 0
+        while True:
+            rows = list(queryset.filter(pk__gt=last_pk).values(*fields)[:batch_size])
+            if not rows:
+                return copied
+            with transaction.atomic(using=target):
+                if legacy_agents:
+                    agent_ids = UserAgent.ids_for(row['agent_string'] for row in rows)
+                    for row in rows:
+                        row['user_agent_id'] = agent_ids.get(row.pop('agent_string'))
+                # Rows copied by an earlier, interrupted run are skipped
+                model.objects.using(target).bulk_create([model(**row) for row in rows], ignore_conflicts=True)
+            copied += len(rows)
+            last_pk = rows[-1][model._meta.pk.attname]
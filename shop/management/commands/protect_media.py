@@ -0,0 +1,35 @@
+# shop/management/commands/protect_media.py
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import storage_cleanup
+from shop.cloudinary_media import AuthenticatedRawMediaStorage, protect_uploaded
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert media uploaded to Cloudinary as public 'upload' files into "
+        "'authenticated' files that are only served through signed URLs. Safe to run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--page-size', type=int, default=500,
+            help="Files listed per storage API call (default: 500)."
+        )
+
+    def handle(self, *args, **options):
+        storage = getattr(default_storage, 'backend', default_storage)
+        if not isinstance(storage, AuthenticatedRawMediaStorage):
+            raise CommandError("The media storage backend is not shop.cloudinary_media.AuthenticatedRawMediaStorage.")
+
+        total = 0
+        for folder in storage_cleanup.media_folders():
+            converted = 0
+            for name in protect_uploaded(storage, folder, options['page_size']):
+                converted += 1
+                self.stdout.write(f"  protected: {name}")
+            self.stdout.write(f"{folder}: {converted} file(s)")
+            total += converted
+        self.stdout.write(self.style.SUCCESS(f"Protected {total} file(s)."))
@@ -0,0 +1,21 @@
+# shop/management/commands/purge_upload_sessions.py
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from shop.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = "Delete chunked upload sessions (and their staging files) that have gone quiet."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours', type=int, default=48,
+            help="Discard sessions not touched for this many hours (default: 48)."
+        )
+
+    def handle(self, *args, **options):
+        count = UploadSession.discard_stale(timedelta(hours=options['hours']))
+        self.stdout.write(self.style.SUCCESS(f"Discarded {count} upload session(s)."))
@@ -0,0 +1,42 @@
+# shop/management/commands/render_previews.py
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import previews
+from shop.models import PreviewImage, QuestionPaper
+
+
+class Command(BaseCommand):
+    help = "Render first-page preview images for papers that don't have them yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help="Re-render every paper's previews, not just missing ones."
+        )
+
+    def handle(self, *args, **options):
+        renderer = previews.get_renderer()
+        if not renderer.available():
+            raise CommandError(f"PREVIEW_RENDERER {settings.PREVIEW_RENDERER} needs {renderer.requirement}.")
+
+        papers = QuestionPaper.objects.exclude(pdf_file='').exclude(checksum='')
+        if not options['all']:
+            papers = papers.exclude(
+                checksum__in=PreviewImage.objects.values('source_checksum')
+            )
+
+        rendered = set()
+        for paper in papers.only('pk', 'checksum').iterator():
+            # Papers sharing a file share previews
+            if paper.checksum in rendered:
+                continue
+            try:
+                previews.render_previews(paper.pk, force=options['all'])
+            except Exception as e:
+                self.stdout.write(self.style.WARNING(f"Skipping paper {paper.pk}: {e}"))
+                continue
+            rendered.add(paper.checksum)
+
+        self.stdout.write(self.style.SUCCESS(f"Rendered previews for {len(rendered)} file(s)."))
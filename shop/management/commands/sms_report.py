@@ -0,0 +1,30 @@
+# shop/management/commands/sms_report.py
+
+from django.core.management.base import BaseCommand
+
+from shop import sms
+
+
+class Command(BaseCommand):
+    help = "Show SMS throughput, failure rate and the most common errors."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours', type=int, default=24,
+            help="Reporting window in hours (default: 24)."
+        )
+
+    def handle(self, *args, **options):
+        stats = sms.get_stats(hours=options['hours'])
+
+        self.stdout.write(f"SMS in the last {stats['hours']}h: {stats['total']}")
+        for status, total in sorted(stats['by_status'].items()):
+            self.stdout.write(f"  {status:<10} {total}")
+        self.stdout.write(f"Throughput:    {stats['sent_per_hour']:.1f} sent/hour")
+        self.stdout.write(f"Failure rate:  {stats['failure_rate']:.1%}")
+        self.stdout.write(f"Avg attempts:  {stats['avg_attempts']:.2f}")
+
+        if stats['top_errors']:
+            self.stdout.write("Top errors:")
+            for row in stats['top_errors']:
+                self.stdout.write(f"  {row['total']:>5}  {row['error'][:100]}")
@@ -0,0 +1,56 @@
+# shop/management/commands/sweep_media_orphans.py
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from shop import storage_cleanup
+from shop.models import StorageDeletion
+
+
+class Command(BaseCommand):
+    help = (
+        "Page through stored files under the upload and preview folders, queue the "
+        "ones nothing in the database references for deletion, then drain the queue."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--page-size', type=int, default=500,
+            help="Files listed per storage API call (default: 500)."
+        )
+        parser.add_argument(
+            '--min-age-hours', type=int, default=24,
+            help="Leave files younger than this alone; they may be uploads not yet saved (default: 24)."
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Only report orphans; don't queue or delete anything."
+        )
+
+    def handle(self, *args, **options):
+        scanned = 0
+        orphaned = 0
+        for folder, page_count, orphans in storage_cleanup.find_orphans(
+            page_size=options['page_size'],
+            min_age=timedelta(hours=options['min_age_hours']),
+        ):
+            scanned += page_count
+            orphaned += len(orphans)
+            for name in orphans:
+                self.stdout.write(f"  orphan: {name}")
+            if orphans and not options['dry_run']:
+                StorageDeletion.objects.bulk_create(
+                    [StorageDeletion(name=name) for name in orphans], ignore_conflicts=True
+                )
+            self.stdout.write(f"{folder}: scanned {scanned} file(s), {orphaned} orphan(s) so far")
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f"Dry run: {orphaned} orphan(s) of {scanned} file(s) not queued."))
+            return
+
+        deleted = storage_cleanup.process_deletions(retry_failed=True)
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} file(s); {orphaned} orphan(s) found in {scanned} file(s)."))
+        remaining = StorageDeletion.objects.count()
+        if remaining:
+            self.stdout.write(self.style.WARNING(f"{remaining} deletion(s) still queued; see Storage Deletions in the admin."))
@@ -0,0 +1,166 @@
+# shop/management/commands/verify_media.py
+
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shop.models import FreeSample, MediaBlob, QuestionPaper
+
+# (label, model, file field) for every kind of stored PDF that gets audited
+TARGETS = (
+    ('paper', QuestionPaper, 'pdf_file'),
+    ('sample', FreeSample, 'sample_pdf'),
+)
+
+
+def stored_size(storage, name):
+    """Size of ``name`` in storage, or None if it doesn't exist."""
+    try:
+        return storage.size(name)
+    except OSError:
+        return None
+
+
+def stored_checksum(storage, name):
+    hasher = hashlib.sha256()
+    with storage.open(name, 'rb') as f:
+        for chunk in f.chunks():
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def check_file(storage, name, expected_size, expected_checksum):
+    """Return a problem description for ``name``, or None if it's intact."""
+    try:
+        size = stored_size(storage, name)
+        if size is None:
+            return "missing"
+        if expected_size and size != expected_size:
+            return f"size {size} bytes, expected {expected_size}"
+        if expected_checksum and stored_checksum(storage, name) != expected_checksum:
+            return "checksum mismatch"
+    except Exception as e:
+        return f"error: {e}"
+    return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Check that every paper and sample PDF exists in storage with the expected "
+        "size (and SHA-256 with --checksums), using a pool of concurrent workers. "
+        "Progress is checkpointed after each batch so an interrupted run resumes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=16,
+            help="Concurrent storage requests (default: 16)."
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help="Rows checked between checkpoints (default: 500)."
+        )
+        parser.add_argument(
+            '--checksums', action='store_true',
+            help="Also download each file and compare its SHA-256 with the stored checksum (slow)."
+        )
+        parser.add_argument(
+            '--checkpoint', default=str(settings.BASE_DIR / 'verify_media.checkpoint.json'),
+            help="Progress file; an existing one is resumed from."
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help="Ignore any existing checkpoint and start from the beginning."
+        )
+        parser.add_argument(
+            '--mark-unavailable', action='store_true',
+            help="Set is_available=False on papers whose PDF is missing or damaged."
+        )
+
+    def handle(self, *args, **options):
+        self.checkpoint_path = options['checkpoint']
+        state = {'last_pk': {}, 'checked': 0, 'problems': []}
+        if not options['restart'] and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                state = json.load(f)
+            self.stdout.write(f"Resuming: {state['checked']} checked, {len(state['problems'])} problem(s) so far.")
+            for problem in state['problems']:
+                self.report(problem)
+            if options['mark_unavailable']:
+                self.mark_unavailable([problem['pk'] for problem in state['problems'] if problem['model'] == 'paper'])
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            for label, model, field_name in TARGETS:
+                storage = model._meta.get_field(field_name).storage
+                # Check the storage backend itself, not the local cache in front of it
+                storage = getattr(storage, 'backend', storage)
+                self.verify_model(pool, storage, state, label, model, field_name, options)
+
+        problems = state['problems']
+        if problems:
+            self.stdout.write(self.style.WARNING(f"{len(problems)} problem(s) in {state['checked']} file(s) checked."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"All {state['checked']} file(s) OK."))
+        # Finished: the next run starts from the beginning
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def verify_model(self, pool, storage, state, label, model, field_name, options):
+        rows = model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+        fields = ['pk', field_name] + (['file_size_bytes', 'checksum'] if model is QuestionPaper else [])
+        last_pk = state['last_pk'].get(label, 0)
+
+        while True:
+            batch = list(rows.filter(pk__gt=last_pk).order_by('pk').values(*fields)[:options['batch_size']])
+            if not batch:
+                break
+
+            # Papers sharing a blob only need their file checked once
+            names = {row[field_name] for row in batch}
+            blobs = {blob.name: blob for blob in MediaBlob.objects.filter(name__in=names)}
+            expected = {}
+            for row in batch:
+                blob = blobs.get(row[field_name])
+                expected[row[field_name]] = (
+                    row.get('file_size_bytes') or (blob.size if blob else None),
+                    (row.get('checksum') or (blob.checksum if blob else '')) if options['checksums'] else '',
+                )
+            results = dict(zip(expected, pool.map(
+                lambda name: check_file(storage, name, *expected[name]), expected
+            )))
+
+            broken_pks = []
+            for row in batch:
+                problem = results[row[field_name]]
+                if problem:
+                    broken_pks.append(row['pk'])
+                    problem = {'model': label, 'pk': row['pk'], 'name': row[field_name], 'problem': problem}
+                    state['problems'].append(problem)
+                    self.report(problem)
+            if options['mark_unavailable'] and model is QuestionPaper:
+                self.mark_unavailable(broken_pks)
+
+            last_pk = batch[-1]['pk']
+            state['last_pk'][label] = last_pk
+            state['checked'] += len(batch)
+            self.save_checkpoint(state)
+            self.stdout.write(f"{label}s: checked up to id {last_pk} ({state['checked']} total)")
+
+    def mark_unavailable(self, paper_pks):
+        if paper_pks:
+            QuestionPaper.objects.filter(pk__in=paper_pks).update(is_available=False)
+
+    def report(self, problem):
+        self.stdout.write(self.style.ERROR(
+            f"{problem['model']} {problem['pk']}: {problem['name']}: {problem['problem']}"
+        ))
+
+    def save_checkpoint(self, state):
+        temp_path = f"{self.checkpoint_path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.checkpoint_path)
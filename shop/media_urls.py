@@ -0,0 +1,100 @@
+# shop/media_urls.py
+
+"""
+Signed, expiring delivery URLs for uploaded media, cached per file.
+
+Storages that can sign (``signed_url(name, expires_at)``, see
+shop/cloudinary_media.py) get a signed CDN URL, expiring after
+MEDIA_URL_TTL_SECONDS where the provider supports it; other storages (local
+development) fall back to ``storage.url()``. Resolved URLs are kept in a
+small in-process LRU and only reused while at least half of their lifetime
+remains, so a cached URL never reaches the browser about to expire. Expired
+entries are evicted first when the cache is full.
+
+Templates should link to views such as ``shop:download_file``, which call
+``resolve_media_url()`` and redirect, rather than embedding storage URLs.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class MediaUrlCache:
+    """Thread-safe LRU of ``key -> (url, expires_at)`` with TTL-aware eviction."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, min_remaining):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            url, expires_at = entry
+            if expires_at - time.time() < min_remaining:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return url
+
+    def set(self, key, url, expires_at):
+        with self._lock:
+            self._entries[key] = (url, expires_at)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        # Drop everything already expired, then least recently used entries
+        now = time.time()
+        for key in [key for key, (_, expires_at) in self._entries.items() if expires_at <= now]:
+            del self._entries[key]
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+url_cache = MediaUrlCache(settings.MEDIA_URL_CACHE_SIZE)
+
+
+def _build_url(storage, name, expires_at):
+    signed_url = getattr(storage, 'signed_url', None)
+    if signed_url is not None:
+        return signed_url(name, expires_at)
+    # Storages without signing support (e.g. local FileSystemStorage)
+    return storage.url(name)
+
+
+def resolve_media_url(field_file):
+    """Return a signed, expiring URL for a FieldFile, or None if it has no file."""
+    if not field_file:
+        return None
+
+    storage = field_file.storage
+    # Wrapping storages expose the real backend as ``backend``
+    storage = getattr(storage, 'backend', storage)
+    name = field_file.name
+    ttl = settings.MEDIA_URL_TTL_SECONDS
+    key = (type(storage).__name__, name)
+
+    url = url_cache.get(key, min_remaining=ttl / 2)
+    if url is None:
+        expires_at = time.time() + ttl
+        url = _build_url(storage, name, expires_at)
+        url_cache.set(key, url, expires_at)
+    return url
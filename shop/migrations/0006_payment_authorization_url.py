@@ -0,0 +1,22 @@
+# Generated by Django 6.0 on 2026-10-19 03:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0005_freesample_alter_downloadhistory_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='authorization_url',
+            field=models.URLField(blank=True, help_text='Paystack checkout URL for this payment', max_length=500),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['question_paper', 'phone_number', 'verified'], name='shop_paymen_questio_86802e_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 6.0 on 2026-10-19 03:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0006_payment_authorization_url'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='question_paper',
+            field=models.ForeignKey(blank=True, help_text='Single-paper purchase. Left empty for bundles, which list their papers as items.', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='payments', to='shop.questionpaper'),
+        ),
+        migrations.CreateModel(
+            name='PaymentItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price', models.DecimalField(decimal_places=2, help_text='Paper price at checkout', max_digits=10)),
+                ('payment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='shop.payment')),
+                ('question_paper', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='payment_items', to='shop.questionpaper')),
+            ],
+            options={
+                'ordering': ('question_paper__subject__name', 'question_paper__title'),
+                'unique_together': {('payment', 'question_paper')},
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 6.0 on 2026-10-19 03:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0007_payment_bundles'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SmsMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phone_number', models.CharField(max_length=20)),
+                ('body', models.TextField()),
+                ('dedupe_key', models.CharField(blank=True, db_index=True, help_text='Messages sharing a key are only sent once per dedupe window (e.g. password resends)', max_length=100)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed'), ('throttled', 'Throttled')], default='pending', max_length=10)),
+                ('backend', models.CharField(blank=True, max_length=100)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('provider_response', models.TextField(blank=True)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sms_messages', to='shop.payment')),
+            ],
+            options={
+                'verbose_name': 'SMS Message',
+                'verbose_name_plural': 'SMS Messages',
+                'ordering': ('-created_at',),
+                'indexes': [models.Index(fields=['status', 'created_at'], name='shop_smsmes_status_90732b_idx')],
+            },
+        ),
+    ]
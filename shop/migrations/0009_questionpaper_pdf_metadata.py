@@ -0,0 +1,32 @@
+# Generated by Django 6.0 on 2026-10-19 03:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_smsmessage'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='questionpaper',
+            name='file_size',
+        ),
+        migrations.AddField(
+            model_name='questionpaper',
+            name='checksum',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='SHA-256 of the PDF', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='questionpaper',
+            name='file_size_bytes',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='questionpaper',
+            name='pages',
+            field=models.IntegerField(default=1, help_text='Number of pages (detected from the PDF on upload)'),
+        ),
+    ]
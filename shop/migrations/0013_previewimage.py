@@ -0,0 +1,32 @@
+# Generated by Django 6.0 on 2026-10-19 04:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_storagedeletion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PreviewImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_checksum', models.CharField(db_index=True, help_text='SHA-256 of the PDF', max_length=64)),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('image_format', models.CharField(max_length=10)),
+                ('name', models.CharField(help_text='Storage name (content hash of the image)', max_length=500)),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Preview Image',
+                'verbose_name_plural': 'Preview Images',
+                'ordering': ('source_checksum', 'image_format', 'width'),
+                'constraints': [models.UniqueConstraint(fields=('source_checksum', 'width', 'image_format'), name='unique_preview_size')],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0 on 2026-10-19 04:13
+
+import django.db.models.deletion
+import shop.watermark
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0013_previewimage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WatermarkedCopy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('file', models.FileField(blank=True, max_length=500, storage=shop.watermark.storage, upload_to='watermarked/')),
+                ('source_checksum', models.CharField(blank=True, help_text='SHA-256 of the PDF that was stamped', max_length=64)),
+                ('pages', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('paper', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='watermarked_copies', to='shop.questionpaper')),
+                ('payment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='watermarked_copies', to='shop.payment')),
+            ],
+            options={
+                'verbose_name': 'Watermarked Copy',
+                'verbose_name_plural': 'Watermarked Copies',
+                'ordering': ('-created_at',),
+                'constraints': [models.UniqueConstraint(fields=('payment', 'paper'), name='unique_watermarked_copy')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-19 04:22
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0014_watermarkedcopy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadhistory',
+            name='event_id',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='downloadhistory',
+            name='downloaded_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
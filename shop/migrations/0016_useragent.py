@@ -0,0 +1,71 @@
+# Generated by Django 6.0 on 2026-10-19 04:25
+
+import hashlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from shop import useragents
+
+
+def intern_user_agents(apps, schema_editor):
+    DownloadHistory = apps.get_model('shop', 'DownloadHistory')
+    UserAgent = apps.get_model('shop', 'UserAgent')
+    strings = DownloadHistory.objects.exclude(user_agent='').order_by().values_list('user_agent', flat=True).distinct()
+    for string in strings.iterator():
+        parsed = useragents.parse(string)
+        agent = UserAgent.objects.create(
+            digest=hashlib.sha256(string.encode('utf-8', 'surrogatepass')).hexdigest(),
+            string=string,
+            browser=parsed.browser,
+            os=parsed.os,
+            device=parsed.device,
+        )
+        DownloadHistory.objects.filter(user_agent=string).update(agent=agent)
+
+
+def restore_user_agents(apps, schema_editor):
+    DownloadHistory = apps.get_model('shop', 'DownloadHistory')
+    UserAgent = apps.get_model('shop', 'UserAgent')
+    for agent in UserAgent.objects.iterator():
+        DownloadHistory.objects.filter(agent=agent).update(user_agent=agent.string)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0015_downloadhistory_event_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserAgent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(editable=False, max_length=64, unique=True)),
+                ('string', models.TextField(editable=False)),
+                ('browser', models.CharField(db_index=True, max_length=40)),
+                ('os', models.CharField(db_index=True, max_length=40, verbose_name='OS')),
+                ('device', models.CharField(choices=[('desktop', 'Desktop'), ('mobile', 'Mobile'), ('tablet', 'Tablet'), ('bot', 'Bot'), ('unknown', 'Unknown')], db_index=True, max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'User Agent',
+            },
+        ),
+        migrations.AddField(
+            model_name='downloadhistory',
+            name='agent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='downloads', to='shop.useragent'),
+        ),
+        migrations.RunPython(intern_user_agents, restore_user_agents, hints={'model_name': 'downloadhistory'}),
+        migrations.RemoveField(
+            model_name='downloadhistory',
+            name='user_agent',
+        ),
+        migrations.RenameField(
+            model_name='downloadhistory',
+            old_name='agent',
+            new_name='user_agent',
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-19 04:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0016_useragent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DownloadRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('downloads', models.PositiveIntegerField(default=0)),
+                ('paid_downloads', models.PositiveIntegerField(default=0)),
+                ('paper', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='download_rollups', to='shop.questionpaper')),
+            ],
+            options={
+                'ordering': ('-day',),
+                'unique_together': {('paper', 'day')},
+            },
+        ),
+    ]
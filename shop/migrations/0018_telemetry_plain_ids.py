@@ -0,0 +1,60 @@
+# Generated by Django 6.0 on 2026-10-19 04:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0017_downloadrollup'),
+    ]
+
+    # Download history moves to the telemetry database (shop/routers.py): foreign
+    # keys to papers and payments become plain id columns with the same names
+    operations = [
+        migrations.AlterField(
+            model_name='downloadhistory',
+            name='paper',
+            field=models.BigIntegerField(db_column='paper_id', db_index=True, verbose_name='paper'),
+        ),
+        migrations.RenameField(
+            model_name='downloadhistory',
+            old_name='paper',
+            new_name='paper_id',
+        ),
+        migrations.AlterField(
+            model_name='downloadhistory',
+            name='paper_id',
+            field=models.BigIntegerField(db_index=True, verbose_name='paper'),
+        ),
+        migrations.AlterField(
+            model_name='downloadhistory',
+            name='payment',
+            field=models.BigIntegerField(blank=True, db_column='payment_id', db_index=True, null=True, verbose_name='payment'),
+        ),
+        migrations.RenameField(
+            model_name='downloadhistory',
+            old_name='payment',
+            new_name='payment_id',
+        ),
+        migrations.AlterField(
+            model_name='downloadhistory',
+            name='payment_id',
+            field=models.BigIntegerField(blank=True, db_index=True, null=True, verbose_name='payment'),
+        ),
+        migrations.AlterField(
+            model_name='downloadrollup',
+            name='paper',
+            field=models.BigIntegerField(db_column='paper_id', db_index=True, verbose_name='paper'),
+        ),
+        migrations.RenameField(
+            model_name='downloadrollup',
+            old_name='paper',
+            new_name='paper_id',
+        ),
+        migrations.AlterField(
+            model_name='downloadrollup',
+            name='paper_id',
+            field=models.BigIntegerField(db_index=True, verbose_name='paper'),
+        ),
+    ]
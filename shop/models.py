@@ -1,11 +1,26 @@
 # shop/models.py
 
-from django.db import models
+from datetime import timedelta
+from decimal import Decimal
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.text import slugify
 import uuid
 
+from . import background, download_log, pdf_metadata, previews, useragents, watermark
+from .media_urls import resolve_media_url
+from .quotas import client_ip
+from .tokens import make_access_token, make_archive_token, make_download_token
+
 # --- 1. Class (Grade) Model ---
 class Classes(models.Model):
     name = models.CharField(max_length=100, help_text="e.g., JHS 1, Basic 7")
@@ -112,9 +127,10 @@ class QuestionPaper(models.Model):
     is_paid = models.BooleanField(default=True, help_text="Is this a paid paper or a free sample?")
     is_available = models.BooleanField(default=True, help_text="Is this paper available for purchase?")
     
-    # File information
-    file_size = models.CharField(max_length=20, blank=True, editable=False)
-    pages = models.IntegerField(default=1, help_text="Number of pages")
+    # File information (extracted from the PDF on upload, see shop/pdf_metadata.py)
+    file_size_bytes = models.PositiveBigIntegerField(null=True, blank=True, editable=False)
+    pages = models.IntegerField(default=1, help_text="Number of pages (detected from the PDF on upload)")
+    checksum = models.CharField(max_length=64, blank=True, editable=False, db_index=True, help_text="SHA-256 of the PDF")
     
     # Metadata
     created_at = models.DateTimeField(auto_now_add=True)
@@ -134,18 +150,6 @@ class QuestionPaper(models.Model):
     def __str__(self):
         return f"{self.class_level.name} - {self.term.name} - {self.subject.name} ({self.title})"
 
-    # --- START CRITICAL FIX: Delete file when model is deleted ---
-    def delete(self, *args, **kwargs):
-        """
-        Deletes the associated PDF file from storage before deleting 
-        the database record, preventing orphan files on the disk.
-        """
-        if self.pdf_file:
-            self.pdf_file.delete(save=False)
-        
-        super().delete(*args, **kwargs)
-    # --- END CRITICAL FIX ---
-
     def save(self, *args, **kwargs):
         # Auto-generate slug if not provided. We avoid comparing to a new uuid() (always different).
         if not self.slug:
@@ -161,20 +165,34 @@ class QuestionPaper(models.Model):
         if not self.password and self.is_paid:
             self.password = f"INSIGHT_{uuid.uuid4().hex[:8].upper()}"
         
-        # Update file size 
-        if self.pdf_file and not self.file_size:
-            try:
-                size_bytes = self.pdf_file.size
-                if size_bytes < 1024:
-                    self.file_size = f"{size_bytes} B"
-                elif size_bytes < 1024 * 1024:
-                    self.file_size = f"{size_bytes / 1024:.1f} KB"
-                else:
-                    self.file_size = f"{size_bytes / (1024 * 1024):.1f} MB"
-            except Exception:
-                pass
+        # Extract size, page count and checksum from a new upload before it is
+        # sent to storage; large uploads are scanned in the background instead.
+        new_upload = bool(self.pdf_file) and not self.pdf_file._committed
+        previous_name = _stored_file_name(self, 'pdf_file') if new_upload else None
+        background_scan_path = None
+        if new_upload:
+            upload = self.pdf_file.file
+            if upload.size > settings.PDF_METADATA_BACKGROUND_BYTES and hasattr(upload, 'temporary_file_path'):
+                background_scan_path = pdf_metadata.link_for_background_scan(upload.temporary_file_path())
+            else:
+                self.apply_metadata(pdf_metadata.scan_file(upload))
+                # Lets the content-addressed storage skip hashing the upload again
+                upload.sha256 = self.checksum
         
         super().save(*args, **kwargs)
+        
+        if new_upload:
+            MediaBlob.swap(previous_name, self.pdf_file.name)
+        if background_scan_path:
+            background.submit(extract_paper_metadata, self.pk, background_scan_path)
+        elif new_upload:
+            background.submit(previews.render_previews, self.pk)
+
+    def apply_metadata(self, metadata):
+        self.file_size_bytes = metadata.size
+        self.checksum = metadata.checksum
+        if metadata.pages:
+            self.pages = metadata.pages
 
     def get_absolute_url(self):
         return reverse(
@@ -182,6 +200,11 @@ class QuestionPaper(models.Model):
             args=[self.class_level.slug, self.term.slug, self.subject.slug, self.slug]
         )
 
+    @cached_property
+    def download_total(self):
+        """Downloads ever, including archived ones."""
+        return DownloadHistory.total(paper_id=self.pk)
+
     def increment_views(self):
         self.views += 1
         self.save(update_fields=['views'])
@@ -189,27 +212,26 @@ class QuestionPaper(models.Model):
     def get_display_title(self):
         return self.title
     
-    # Storage related methods (Updated for local storage)
+    # Storage related methods: signed, expiring URLs cached by shop.media_urls
     def get_pdf_url(self):
-        if self.pdf_file:
-            return self.pdf_file.url
-        return None
+        return resolve_media_url(self.pdf_file)
     
     def get_secure_pdf_url(self):
         return self.get_pdf_url()
     
-    def get_preview_image_url(self):
-        # Method stub removed for consistency
-        return None
+    # Preview images are rendered in the background by shop.previews; these
+    # only look up URLs (None until the previews exist)
+    def get_preview_image_url(self, width=640, image_format='jpeg'):
+        return previews.preview_url(self.checksum, width, image_format)
     
     def generate_thumbnail(self, width=300, height=400):
-        # Method stub removed for consistency
-        return None
+        return previews.preview_url(self.checksum, width, settings.PREVIEW_FORMATS[0])
     
     @property
     def file_name(self):
-        if self.pdf_file:
-            return self.pdf_file.name.split('/')[-1]
+        # Stored names are content hashes, so name downloads after the paper
+        if self.pdf_file and self.slug:
+            return f"{self.slug}.pdf"
         return "question_paper.pdf"
     
     @property
@@ -217,11 +239,34 @@ class QuestionPaper(models.Model):
         return self.price == 0 or not self.is_paid
 
 
+def _stored_file_name(instance, field_name):
+    """The file name currently saved in the database for ``instance.<field_name>``."""
+    if instance.pk is None:
+        return None
+    return type(instance).objects.filter(pk=instance.pk).values_list(field_name, flat=True).first()
+
+
+def extract_paper_metadata(paper_id, path):
+    """Background job: scan a local copy of an upload and store its metadata."""
+    try:
+        metadata = pdf_metadata.scan_path(path)
+    finally:
+        os.remove(path)
+    fields = {'file_size_bytes': metadata.size, 'checksum': metadata.checksum}
+    if metadata.pages:
+        fields['pages'] = metadata.pages
+    QuestionPaper.objects.filter(pk=paper_id).update(**fields)
+    previews.render_previews(paper_id)
+
 # --- 5. Payment Model (Restored Fields) ---
 class Payment(models.Model):
     # Core fields
     ref = models.CharField(max_length=20, unique=True)
-    question_paper = models.ForeignKey(QuestionPaper, related_name='payments', on_delete=models.PROTECT)
+    question_paper = models.ForeignKey(
+        QuestionPaper, related_name='payments', on_delete=models.PROTECT,
+        null=True, blank=True,
+        help_text="Single-paper purchase. Left empty for bundles, which list their papers as items."
+    )
     email = models.EmailField()
     phone_number = models.CharField(max_length=20, blank=True)
     
@@ -229,6 +274,7 @@ class Payment(models.Model):
     amount_paid = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     payment_method = models.CharField(max_length=50, default='paystack')
     transaction_id = models.CharField(max_length=100, blank=True)
+    authorization_url = models.URLField(max_length=500, blank=True, help_text="Paystack checkout URL for this payment")
     
     # Status
     verified = models.BooleanField(default=False)
@@ -237,18 +283,157 @@ class Payment(models.Model):
     date_created = models.DateTimeField(auto_now_add=True)
     
     # Methods (to support admin functions)
+    @property
+    def is_bundle(self):
+        return self.question_paper_id is None
+
+    def get_papers(self):
+        """Return every paper this payment grants access to (one for single purchases)."""
+        if self.question_paper_id:
+            return [self.question_paper]
+        return [item.question_paper for item in self.items.select_related('question_paper')]
+
+    def includes_paper(self, paper):
+        if self.question_paper_id:
+            return self.question_paper_id == paper.pk
+        return self.items.filter(question_paper=paper).exists()
+
+    def get_download_url(self, paper=None):
+        """
+        Download link for ``paper`` (defaults to the purchased paper). Verified
+        payments get a signed, expiring token; anything else falls through to
+        the purchase page.
+        """
+        paper = paper or self.question_paper
+        url = reverse('shop:download_file', args=[paper.slug])
+        if self.verified:
+            url += f"?token={make_download_token(paper, self)}"
+        return url
+
+    def get_downloads(self):
+        """A {'paper', 'url'} entry for every paper this payment covers."""
+        return [{'paper': paper, 'url': self.get_download_url(paper)} for paper in self.get_papers()]
+
+    def get_archive_url(self):
+        """Link to a ZIP of every paper this payment covers, or None until it is verified."""
+        if not self.verified:
+            return None
+        url = reverse('shop:download_purchase_zip', args=[self.ref])
+        return f"{url}?token={make_archive_token(self)}"
+
+    def get_access_url(self):
+        """
+        Status page link that unlocks this payment's downloads on any device.
+        Sent to the buyer by SMS; None until the payment is verified.
+        """
+        if not self.verified:
+            return None
+        url = reverse('shop:payment_status', args=[self.ref])
+        return f"{url}?key={make_access_token(self)}"
+
+    def get_total_price(self):
+        if self.question_paper_id:
+            return self.question_paper.price
+        return sum((item.price for item in self.items.all()), Decimal('0'))
+
     def amount_in_pesewas(self):
-        # Placeholder based on admin code referencing it
-        # Assuming price from paper if amount_paid is null
-        price = self.amount_paid if self.amount_paid is not None else self.question_paper.price
+        # Assuming price from paper (or bundle items) if amount_paid is null
+        price = self.amount_paid if self.amount_paid is not None else self.get_total_price()
         return int(price * 100) if price is not None else 0
 
+    def get_password_message(self, access_url=''):
+        """
+        Compose the fulfilment SMS, listing every password for bundles in one
+        message, followed by ``access_url`` (see get_access_url) when given.
+        """
+        papers = self.get_papers()
+        if len(papers) == 1:
+            paper = papers[0]
+            message = f"Your password for {paper.title} is: {paper.password}."
+        else:
+            passwords = "; ".join(f"{paper.title}: {paper.password}" for paper in papers)
+            message = f"Your passwords - {passwords}."
+        if access_url:
+            message += f" Download: {access_url}"
+        return f"{message} Thank you for your purchase from Insight Innovations!"
+
     def save(self, *args, **kwargs):
         # Ensure a unique reference is generated when creating a payment
         if not self.ref:
             # Use a short upper-case hex string for references
             self.ref = uuid.uuid4().hex[:12].upper()
         super().save(*args, **kwargs)
+        self.cache_status()
+
+    # Cached status (read by the polling endpoint without touching the DB).
+    # Only 'verified' is kept for long; 'pending' expires within seconds so a
+    # worker that missed the save (e.g. a per-process LocMemCache) catches up.
+    @staticmethod
+    def status_cache_key(ref):
+        return f"payment-status:{ref}"
+
+    @staticmethod
+    def _status_cache_timeout(status):
+        if status == 'verified':
+            return settings.PAYMENT_STATUS_CACHE_SECONDS
+        return settings.PAYMENT_PENDING_STATUS_CACHE_SECONDS
+
+    def cache_status(self):
+        status = 'verified' if self.verified else 'pending'
+        cache.set(self.status_cache_key(self.ref), status, self._status_cache_timeout(status))
+
+    @classmethod
+    async def aget_cached_status(cls, ref):
+        """
+        Return 'verified', 'pending' or 'missing' for a reference, reading the DB
+        only on a cache miss. Unknown references are cached as briefly as pending ones.
+        """
+        key = cls.status_cache_key(ref)
+        status = await cache.aget(key)
+        if status is None:
+            verified = await cls.objects.filter(ref=ref).values_list('verified', flat=True).afirst()
+            if verified is None:
+                status = 'missing'
+            else:
+                status = 'verified' if verified else 'pending'
+            await cache.aset(key, status, cls._status_cache_timeout(status))
+        return status
+
+    @classmethod
+    def _pending_checkouts(cls, email, phone_number):
+        """Unverified checkouts for this customer still inside the reuse window."""
+        window = settings.PENDING_CHECKOUT_REUSE_SECONDS
+        if window <= 0:
+            return cls.objects.none()
+        return cls.objects.filter(
+            email__iexact=email,
+            phone_number=phone_number,
+            verified=False,
+            date_created__gte=timezone.now() - timedelta(seconds=window),
+        ).exclude(authorization_url='').order_by('-date_created')
+
+    @classmethod
+    def find_pending_checkout(cls, paper, email, phone_number):
+        """
+        Return a recent unverified checkout for the same paper and customer,
+        so a retried POST can reuse its Paystack session instead of opening a new one.
+        """
+        return cls._pending_checkouts(email, phone_number).filter(question_paper=paper).first()
+
+    @classmethod
+    def find_pending_bundle_checkout(cls, papers, email, phone_number):
+        """
+        Bundle counterpart of ``find_pending_checkout``: a recent unverified
+        bundle for the same customer covering exactly the same papers.
+        """
+        wanted = {paper.pk for paper in papers}
+        candidates = cls._pending_checkouts(email, phone_number).filter(
+            question_paper__isnull=True, items__question_paper__in=wanted,
+        ).distinct().prefetch_related('items')
+        for payment in candidates:
+            if {item.question_paper_id for item in payment.items.all()} == wanted:
+                return payment
+        return None
 
     def mark_as_verified(self, transaction_id=None, amount=None):
         """Mark this payment as verified and store transaction details."""
@@ -262,68 +447,202 @@ class Payment(models.Model):
             except Exception:
                 pass
         self.save()
+        # Start stamping the buyer's copies now rather than on first download
+        watermark.schedule(self)
 
     def __str__(self):
         return f"Payment #{self.ref} - {self.email}"
     
     class Meta:
         ordering = ('-date_created',)
+        indexes = [
+            models.Index(fields=['question_paper', 'phone_number', 'verified']),
+        ]
+
+
+# --- 5b. Payment line items (bundle checkouts) ---
+class PaymentItem(models.Model):
+    payment = models.ForeignKey(Payment, related_name='items', on_delete=models.CASCADE)
+    question_paper = models.ForeignKey(QuestionPaper, related_name='payment_items', on_delete=models.PROTECT)
+    price = models.DecimalField(max_digits=10, decimal_places=2, help_text="Paper price at checkout")
+
+    class Meta:
+        unique_together = ('payment', 'question_paper')
+        ordering = ('question_paper__subject__name', 'question_paper__title')
+
+    def __str__(self):
+        return f"{self.question_paper.title} ({self.payment.ref})"
 
 
 # --- 6. Paper Download History (Restored Fields) ---
 class DownloadHistory(models.Model):
-    # Core fields
-    paper = models.ForeignKey(QuestionPaper, related_name='downloads', on_delete=models.CASCADE)
-    payment = models.ForeignKey(Payment, related_name='downloads', on_delete=models.SET_NULL, null=True, blank=True)
+    # Core fields. This table lives in the telemetry database (shop/routers.py),
+    # so papers and payments are plain ids; the receivers at the end of this
+    # module stand in for CASCADE and SET_NULL.
+    paper_id = models.BigIntegerField('paper', db_index=True)
+    payment_id = models.BigIntegerField('payment', null=True, blank=True, db_index=True)
     user_email = models.EmailField(blank=True, null=True)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
-    user_agent = models.TextField(blank=True)
+    # Interned: each distinct User-Agent string is stored (and parsed) once
+    user_agent = models.ForeignKey(
+        'UserAgent', related_name='downloads', on_delete=models.PROTECT, null=True, blank=True
+    )
     
     # Metadata
-    downloaded_at = models.DateTimeField(auto_now_add=True)
+    # Set when the event is recorded, not when the batch holding it is written
+    downloaded_at = models.DateTimeField(default=timezone.now, editable=False)
+    event_id = models.UUIDField(null=True, blank=True, unique=True, editable=False)
 
     @classmethod
-    def log_download(cls, paper, email=None, request=None, payment=None):
-        """Create a DownloadHistory record from supplied info."""
+    def log_download(cls, paper, email=None, request=None, payment=None, payment_id=None):
+        """
+        Record a download from supplied info. Pass ``payment_id`` instead of
+        ``payment`` when only the id is known (e.g. from a download token).
+
+        The row (and the free sample's download count) is written later in a
+        batch by shop.download_log, so this never waits on the database.
+        """
+        if payment is not None:
+            payment_id = payment.pk
         ip = None
         ua = None
         if request is not None:
-            # Try common headers for client IP
-            xff = request.META.get('HTTP_X_FORWARDED_FOR')
-            if xff:
-                ip = xff.split(',')[0].strip()
-            else:
-                ip = request.META.get('REMOTE_ADDR')
+            ip = client_ip(request)
             ua = request.META.get('HTTP_USER_AGENT', '')
 
-        dh = cls.objects.create(
-            paper=paper,
-            payment=payment,
-            user_email=email,
-            ip_address=ip,
-            user_agent=ua or ''
-        )
+        download_log.record(paper.pk, payment_id=payment_id, email=email, ip_address=ip, user_agent=ua)
 
-        # If this paper has a FreeSample object and this was a free download, increment counter
-        try:
-            if payment is None and hasattr(paper, 'free_sample') and paper.free_sample is not None:
-                fs = paper.free_sample
-                fs.downloads = (fs.downloads or 0) + 1
-                fs.save()
-        except Exception:
-            # best-effort; don't fail the download logging for sample increment errors
-            pass
+    @classmethod
+    def total(cls, **filters):
+        """
+        Downloads ever (optionally ``paper_id=...``): the rows still in this table
+        plus those archived into DownloadRollup.
+        """
+        live = cls.objects.filter(**filters).count()
+        archived = DownloadRollup.objects.filter(**filters).aggregate(total=models.Sum('downloads'))['total']
+        return live + (archived or 0)
 
-        return dh
+    @cached_property
+    def paper(self):
+        return QuestionPaper.objects.filter(pk=self.paper_id).first()
+
+    @cached_property
+    def payment(self):
+        if self.payment_id is None:
+            return None
+        return Payment.objects.filter(pk=self.payment_id).first()
+
+    @classmethod
+    def attach_related(cls, downloads):
+        """Load the papers and payments of ``downloads`` with one query each, not one per row."""
+        downloads = list(downloads)
+        papers = QuestionPaper.objects.in_bulk({download.paper_id for download in downloads})
+        payments = Payment.objects.in_bulk({download.payment_id for download in downloads} - {None})
+        for download in downloads:
+            download.__dict__['paper'] = papers.get(download.paper_id)
+            download.__dict__['payment'] = payments.get(download.payment_id)
+        return downloads
 
     def __str__(self):
-        return f"Download of {self.paper.title} by {self.user_email or 'Anonymous'}"
+        title = self.paper.title if self.paper else f"paper #{self.paper_id}"
+        return f"Download of {title} by {self.user_email or 'Anonymous'}"
     
     class Meta:
         verbose_name_plural = 'Download Histories'
         ordering = ('-downloaded_at',)
 
 
+# --- 6b. Interned User Agents ---
+class UserAgent(models.Model):
+    """
+    One distinct User-Agent string, with its browser family, OS and device
+    class parsed once when it is first seen (shop/useragents.py). Looked up
+    by a SHA-256 digest so the unique index stays small however long the
+    strings are.
+    """
+    DEVICE_CHOICES = [
+        (useragents.DEVICE_DESKTOP, 'Desktop'),
+        (useragents.DEVICE_MOBILE, 'Mobile'),
+        (useragents.DEVICE_TABLET, 'Tablet'),
+        (useragents.DEVICE_BOT, 'Bot'),
+        (useragents.DEVICE_UNKNOWN, 'Unknown'),
+    ]
+
+    digest = models.CharField(max_length=64, unique=True, editable=False)
+    string = models.TextField(editable=False)
+    browser = models.CharField(max_length=40, db_index=True)
+    os = models.CharField('OS', max_length=40, db_index=True)
+    device = models.CharField(max_length=10, choices=DEVICE_CHOICES, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @staticmethod
+    def digest_of(string):
+        return hashlib.sha256(string.encode('utf-8', 'surrogatepass')).hexdigest()
+
+    @classmethod
+    def ids_for(cls, strings):
+        """
+        Map each distinct non-empty string in ``strings`` to its row id,
+        creating rows for strings not seen before. Two queries at most when
+        some are new, one otherwise.
+        """
+        by_digest = {cls.digest_of(string): string for string in set(strings) if string}
+        if not by_digest:
+            return {}
+        ids = dict(cls.objects.filter(digest__in=by_digest).values_list('digest', 'id'))
+        missing = [digest for digest in by_digest if digest not in ids]
+        if missing:
+            # Another worker may be interning the same strings; its rows win
+            cls.objects.bulk_create([
+                cls(digest=digest, string=by_digest[digest], **useragents.parse(by_digest[digest])._asdict())
+                for digest in missing
+            ], ignore_conflicts=True)
+            ids.update(cls.objects.filter(digest__in=missing).values_list('digest', 'id'))
+        return {by_digest[digest]: pk for digest, pk in ids.items()}
+
+    def __str__(self):
+        return f"{self.browser} on {self.os} ({self.get_device_display()})"
+
+    class Meta:
+        verbose_name = 'User Agent'
+
+
+# --- 6c. Daily Download Rollups ---
+class DownloadRollup(models.Model):
+    """
+    Downloads of a paper on one day, for history older than
+    DOWNLOAD_RETENTION_DAYS. The archive_downloads command adds rows here in
+    the same transaction that deletes them from DownloadHistory (the raw rows
+    go to compressed JSONL first, see shop/download_archive.py).
+    """
+    # Plain id: rollups live in the telemetry database with DownloadHistory
+    paper_id = models.BigIntegerField('paper', db_index=True)
+    day = models.DateField()
+    downloads = models.PositiveIntegerField(default=0)
+    paid_downloads = models.PositiveIntegerField(default=0)
+
+    @cached_property
+    def paper(self):
+        return QuestionPaper.objects.filter(pk=self.paper_id).first()
+
+    @classmethod
+    def attach_related(cls, rollups):
+        """Load the papers of ``rollups`` with one query."""
+        rollups = list(rollups)
+        papers = QuestionPaper.objects.in_bulk({rollup.paper_id for rollup in rollups})
+        for rollup in rollups:
+            rollup.__dict__['paper'] = papers.get(rollup.paper_id)
+        return rollups
+
+    def __str__(self):
+        title = self.paper.title if self.paper else f"paper #{self.paper_id}"
+        return f"{title} on {self.day}: {self.downloads}"
+
+    class Meta:
+        unique_together = ('paper_id', 'day')
+        ordering = ('-day',)
+
+
 # --- 7. FREE SAMPLE Model (Restored Fields) ---
 class FreeSample(models.Model):
     # Core fields
@@ -338,17 +657,368 @@ class FreeSample(models.Model):
     def __str__(self):
         return f"Free Sample for {self.question_paper.title}"
 
-    # --- START CRITICAL FIX: Delete file when model is deleted ---
-    def delete(self, *args, **kwargs):
+    def save(self, *args, **kwargs):
+        new_upload = bool(self.sample_pdf) and not self.sample_pdf._committed
+        previous_name = _stored_file_name(self, 'sample_pdf') if new_upload else None
+        super().save(*args, **kwargs)
+        if new_upload:
+            MediaBlob.swap(previous_name, self.sample_pdf.name)
+
+    class Meta:
+        ordering = ('-created_at',)
+
+# --- 8. SMS Message Log ---
+class SmsMessage(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_THROTTLED = 'throttled'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+        (STATUS_THROTTLED, 'Throttled'),
+    ]
+
+    # Core fields
+    phone_number = models.CharField(max_length=20)
+    body = models.TextField()
+    payment = models.ForeignKey(Payment, related_name='sms_messages', on_delete=models.SET_NULL, null=True, blank=True)
+    dedupe_key = models.CharField(
+        max_length=100, blank=True, db_index=True,
+        help_text="Messages sharing a key are only sent once per dedupe window (e.g. password resends)"
+    )
+
+    # Delivery tracking
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    backend = models.CharField(max_length=100, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    provider_response = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+
+    # Metadata
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"SMS to {self.phone_number} ({self.get_status_display()})"
+
+    @classmethod
+    def find_recent_duplicate(cls, dedupe_key):
+        """Return the last message sent with this key inside SMS_DEDUPE_SECONDS, if any."""
+        window = settings.SMS_DEDUPE_SECONDS
+        if not dedupe_key or window <= 0:
+            return None
+        return cls.objects.filter(
+            dedupe_key=dedupe_key,
+            status=cls.STATUS_SENT,
+            sent_at__gte=timezone.now() - timedelta(seconds=window),
+        ).order_by('-sent_at').first()
+
+    class Meta:
+        verbose_name = 'SMS Message'
+        verbose_name_plural = 'SMS Messages'
+        ordering = ('-created_at',)
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+
+
+# --- 9. Stored Media Blobs (content-addressed uploads) ---
+class MediaBlob(models.Model):
+    """
+    One stored file, keyed by the SHA-256 of its content. Identical uploads
+    share a blob (see CachedMediaStorage._save); ``refcount`` counts the
+    papers and samples pointing at it, and the file is deleted from storage
+    when the last one lets go.
+    """
+    checksum = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=500, unique=True, help_text="Storage name of the file")
+    size = models.PositiveBigIntegerField(default=0)
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount} reference{'s' if self.refcount != 1 else ''})"
+
+    @classmethod
+    def acquire(cls, name):
+        cls.objects.filter(name=name).update(refcount=models.F('refcount') + 1)
+
+    @classmethod
+    def release(cls, name):
         """
-        Deletes the associated sample PDF file from storage before deleting 
-        the database record.
+        Drop one reference to ``name``. When it was the last one (or the file
+        predates blob tracking) the file is queued for deletion.
         """
-        if self.sample_pdf:
-            self.sample_pdf.delete(save=False)
-        
-        super().delete(*args, **kwargs)
-    # --- END CRITICAL FIX ---
-    
+        with transaction.atomic():
+            blob = cls.objects.select_for_update().filter(name=name).first()
+            if blob is not None:
+                if blob.refcount > 1:
+                    cls.objects.filter(pk=blob.pk).update(refcount=models.F('refcount') - 1)
+                    return
+                blob.delete()
+                PreviewImage.discard(blob.checksum)
+            StorageDeletion.enqueue(name)
+
+    @classmethod
+    def swap(cls, previous_name, new_name):
+        """Move one reference from ``previous_name`` (if any) to a freshly saved ``new_name``."""
+        if previous_name == new_name:
+            return
+        cls.acquire(new_name)
+        if previous_name:
+            cls.release(previous_name)
+
+    class Meta:
+        verbose_name = 'Media Blob'
+        verbose_name_plural = 'Media Blobs'
+        ordering = ('-created_at',)
+
+# --- 10. Chunked Admin Uploads ---
+class UploadSession(models.Model):
+    """
+    A resumable, chunked admin upload (see shop/chunked_upload.py). Chunks
+    are appended to a staging file in CHUNKED_UPLOAD_DIR in order;
+    ``received_chunks`` is how many have been written and verified, so an
+    interrupted upload resumes from that chunk.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    model_label = models.CharField(max_length=100)
+    field_name = models.CharField(max_length=100)
+    filename = models.CharField(max_length=255)
+    total_size = models.PositiveBigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    received_chunks = models.PositiveIntegerField(default=0)
+    stored_name = models.CharField(max_length=500, blank=True, help_text="Storage name once assembled")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.received_chunks}/{self.chunk_count} chunks)"
+
+    @property
+    def chunk_count(self):
+        return max(-(-self.total_size // self.chunk_size), 1)
+
+    @property
+    def is_complete(self):
+        return self.received_chunks >= self.chunk_count
+
+    @property
+    def staging_path(self):
+        return os.path.join(settings.CHUNKED_UPLOAD_DIR, f"{self.pk}.part")
+
+    def expected_chunk_size(self, index):
+        if index == self.chunk_count - 1:
+            return self.total_size - index * self.chunk_size
+        return self.chunk_size
+
+    def discard(self):
+        """Delete the staging file and the session."""
+        try:
+            os.remove(self.staging_path)
+        except FileNotFoundError:
+            pass
+        self.delete()
+
+    @classmethod
+    def discard_stale(cls, older_than):
+        stale = list(cls.objects.filter(updated_at__lt=timezone.now() - older_than))
+        for session in stale:
+            session.discard()
+        return len(stale)
+
+    class Meta:
+        verbose_name = 'Upload Session'
+        verbose_name_plural = 'Upload Sessions'
+        ordering = ('-created_at',)
+
+
+# --- 11. Storage Deletion Queue ---
+class StorageDeletion(models.Model):
+    """
+    A stored file waiting to be deleted. Rows are written in the same
+    transaction as the change that orphaned the file and drained in batches
+    by shop.storage_cleanup, so no request waits on the storage API.
+    """
+    name = models.CharField(max_length=500, unique=True, help_text="Storage name of the file")
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def enqueue(cls, name):
+        from . import storage_cleanup
+
+        cls.objects.get_or_create(name=name)
+        background.submit(storage_cleanup.process_deletions)
+
+    class Meta:
+        verbose_name = 'Storage Deletion'
+        verbose_name_plural = 'Storage Deletions'
+        ordering = ('created_at',)
+
+
+# --- 12. Preview Images ---
+class PreviewImage(models.Model):
+    """
+    One rendered size/format of the first page of a PDF (shop/previews.py),
+    keyed by the PDF's checksum so papers sharing a file share previews.
+    """
+    source_checksum = models.CharField(max_length=64, db_index=True, help_text="SHA-256 of the PDF")
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    image_format = models.CharField(max_length=10)
+    name = models.CharField(max_length=500, help_text="Storage name (content hash of the image)")
+    size = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.source_checksum[:12]} {self.width}px {self.image_format}"
+
+    @classmethod
+    def store(cls, source_checksum, width, image_format, name, height, size):
+        """Record a rendered preview, queueing the image it replaces (if any) for deletion."""
+        previous = cls.objects.filter(
+            source_checksum=source_checksum, width=width, image_format=image_format
+        ).values_list('name', flat=True).first()
+        cls.objects.update_or_create(
+            source_checksum=source_checksum, width=width, image_format=image_format,
+            defaults={'name': name, 'height': height, 'size': size},
+        )
+        if previous and previous != name and not cls.objects.filter(name=previous).exists():
+            StorageDeletion.enqueue(previous)
+
+    @classmethod
+    def discard(cls, source_checksum):
+        """Delete the previews of a PDF that is no longer stored."""
+        previews = cls.objects.filter(source_checksum=source_checksum)
+        names = set(previews.values_list('name', flat=True))
+        previews.delete()
+        for name in names - set(cls.objects.filter(name__in=names).values_list('name', flat=True)):
+            StorageDeletion.enqueue(name)
+
+    class Meta:
+        verbose_name = 'Preview Image'
+        verbose_name_plural = 'Preview Images'
+        ordering = ('source_checksum', 'image_format', 'width')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['source_checksum', 'width', 'image_format'], name='unique_preview_size'
+            ),
+        ]
+
+
+# --- 13. Watermarked Copies ---
+class WatermarkedCopy(models.Model):
+    """
+    A paid paper stamped with the buyer's email and payment reference
+    (shop/watermark.py). Made once per payment and paper, and remade when the
+    paper's PDF changes (``source_checksum`` no longer matches).
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_READY, 'Ready'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    payment = models.ForeignKey(Payment, on_delete=models.CASCADE, related_name='watermarked_copies')
+    paper = models.ForeignKey(QuestionPaper, on_delete=models.CASCADE, related_name='watermarked_copies')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    file = models.FileField(
+        upload_to=watermark.WATERMARK_FOLDER, storage=watermark.storage, max_length=500, blank=True
+    )
+    source_checksum = models.CharField(max_length=64, blank=True, help_text="SHA-256 of the PDF that was stamped")
+    pages = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.paper} for #{self.payment.ref} ({self.status})"
+
+    def is_current(self, paper):
+        return self.status == self.STATUS_READY and bool(self.file) and self.source_checksum == paper.checksum
+
+    @classmethod
+    def request(cls, payment_id, paper):
+        """
+        Return the copy of ``paper`` for a payment, queueing it for stamping
+        when it is new, stale, or has been pending longer than
+        WATERMARK_PENDING_SECONDS (its job was lost, e.g. to a restart).
+        """
+        copy, created = cls.objects.get_or_create(payment_id=payment_id, paper=paper)
+        if copy.status == cls.STATUS_FAILED or copy.is_current(paper):
+            return copy
+        stuck_since = timezone.now() - timedelta(seconds=settings.WATERMARK_PENDING_SECONDS)
+        if created or copy.status == cls.STATUS_READY or copy.updated_at < stuck_since:
+            copy.status = cls.STATUS_PENDING
+            copy.save(update_fields=['status', 'updated_at'])
+            watermark.submit(copy.pk)
+        return copy
+
+    def mark_ready(self, name, source_checksum, pages):
+        """Record a stored copy, queueing the file it replaces (if any) for deletion."""
+        previous = self.file.name
+        updated = type(self).objects.filter(pk=self.pk).update(
+            status=self.STATUS_READY, file=name, source_checksum=source_checksum,
+            pages=pages, error='', updated_at=timezone.now(),
+        )
+        if not updated:
+            # Removed while it was being stamped (e.g. the payment was deleted)
+            StorageDeletion.enqueue(name)
+        elif previous and previous != name:
+            StorageDeletion.enqueue(previous)
+
+    def mark_failed(self, error):
+        type(self).objects.filter(pk=self.pk).update(
+            status=self.STATUS_FAILED, error=str(error)[:1000], updated_at=timezone.now()
+        )
+
     class Meta:
-        ordering = ('-created_at',)
\ No newline at end of file
+        verbose_name = 'Watermarked Copy'
+        verbose_name_plural = 'Watermarked Copies'
+        ordering = ('-created_at',)
+        constraints = [
+            models.UniqueConstraint(fields=['payment', 'paper'], name='unique_watermarked_copy'),
+        ]
+
+
+# Release files on every delete, including admin bulk deletes and cascades,
+# which never call Model.delete()
+@receiver(post_delete, sender=QuestionPaper)
+def release_paper_file(sender, instance, **kwargs):
+    if instance.pdf_file:
+        MediaBlob.release(instance.pdf_file.name)
+
+
+@receiver(post_delete, sender=QuestionPaper)
+def delete_paper_downloads(sender, instance, **kwargs):
+    # Download history is in another database, so there is no CASCADE
+    DownloadHistory.objects.filter(paper_id=instance.pk).delete()
+    DownloadRollup.objects.filter(paper_id=instance.pk).delete()
+
+
+@receiver(post_delete, sender=Payment)
+def detach_payment_downloads(sender, instance, **kwargs):
+    DownloadHistory.objects.filter(payment_id=instance.pk).update(payment_id=None)
+
+
+@receiver(post_delete, sender=FreeSample)
+def release_sample_file(sender, instance, **kwargs):
+    if instance.sample_pdf:
+        MediaBlob.release(instance.sample_pdf.name)
+
+
+@receiver(post_delete, sender=WatermarkedCopy)
+def release_watermarked_file(sender, instance, **kwargs):
+    if instance.file:
+        StorageDeletion.enqueue(instance.file.name)
@@ -0,0 +1,51 @@
+# shop/paystack.py
+
+"""
+Non-blocking Paystack API calls for the async payment views.
+
+Every call returns ``(status_code, data)``. Network errors and non-JSON
+replies come back as ``(0, {'status': False, 'message': ...})`` so callers
+only have one failure shape to handle.
+"""
+
+import httpx
+from django.conf import settings
+
+from .http_clients import get_async_client
+
+PAYSTACK_API_URL = "https://api.paystack.co"
+
+GATEWAY_ERROR = {'status': False, 'message': 'Could not reach the payment gateway. Please try again.'}
+
+
+def _headers():
+    return {
+        "Authorization": f"Bearer {settings.PAYSTACK_SECRET_KEY}",
+        "Content-Type": "application/json"
+    }
+
+
+def is_successful(verification_data, expected_amount):
+    """True if a verify response is a successful charge for the expected amount (in pesewas)."""
+    data = verification_data.get('data') or {}
+    return data.get('status') == 'success' and data.get('amount') == expected_amount
+
+
+async def ainitialize_transaction(payload):
+    try:
+        response = await get_async_client().post(
+            f"{PAYSTACK_API_URL}/transaction/initialize", headers=_headers(), json=payload
+        )
+        return response.status_code, response.json()
+    except (httpx.HTTPError, ValueError):
+        return 0, GATEWAY_ERROR
+
+
+async def averify_transaction(reference):
+    try:
+        response = await get_async_client().get(
+            f"{PAYSTACK_API_URL}/transaction/verify/{reference}", headers=_headers()
+        )
+        return response.status_code, response.json()
+    except (httpx.HTTPError, ValueError):
+        return 0, GATEWAY_ERROR
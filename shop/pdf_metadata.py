@@ -0,0 +1,103 @@
+# shop/pdf_metadata.py
+
+"""
+PDF metadata (byte size, page count, SHA-256) from a single pass over a file.
+
+``scan()`` consumes an iterable of byte chunks (an upload's ``chunks()``)
+once, hashing and counting as it goes. Page objects are counted from the
+``/Type /Page`` markers in the PDF structure; PDFs that hide their page
+objects in compressed object streams yield no markers, so for those the
+page tree is read with pypdf from the same local file.
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+from collections import namedtuple
+
+PdfMetadata = namedtuple('PdfMetadata', ['size', 'pages', 'checksum'])
+
+# "/Type /Page" but not "/Type /Pages"
+_PAGE_MARKER = re.compile(rb'/Type\s{0,16}/Page(?![A-Za-z])')
+# Kept between chunks so a marker split across a chunk boundary is still seen
+_OVERLAP = 64
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _count_markers(chunks, hasher):
+    size = 0
+    pages = 0
+    tail = b''
+    for chunk in chunks:
+        size += len(chunk)
+        hasher.update(chunk)
+        buffer = tail + chunk
+        boundary = len(tail)
+        for match in _PAGE_MARKER.finditer(buffer):
+            # Markers ending before the boundary were counted with the previous
+            # chunk; ones touching the end of the buffer wait for the next chunk
+            # (a following letter would make them "/Pages").
+            if boundary <= match.end() < len(buffer):
+                pages += 1
+        tail = buffer[-_OVERLAP:]
+
+    # End of file: a marker can now end exactly at the last byte
+    for match in _PAGE_MARKER.finditer(tail):
+        if match.end() == len(tail):
+            pages += 1
+    return size, pages
+
+
+def count_pages_with_pypdf(fileobj):
+    """Page count from the PDF page tree (seekable file), or None if unreadable."""
+    from pypdf import PdfReader
+    from pypdf.errors import PdfReadError
+
+    try:
+        fileobj.seek(0)
+        return len(PdfReader(fileobj).pages)
+    except (PdfReadError, ValueError, KeyError, TypeError):
+        return None
+    finally:
+        fileobj.seek(0)
+
+
+def scan(chunks):
+    """Return PdfMetadata for the bytes in ``chunks``. ``pages`` is 0 if no markers were found."""
+    hasher = hashlib.sha256()
+    size, pages = _count_markers(chunks, hasher)
+    return PdfMetadata(size, pages, hasher.hexdigest())
+
+
+def scan_file(fileobj):
+    """Scan a seekable local file, falling back to pypdf for the page count."""
+    fileobj.seek(0)
+    metadata = scan(iter(lambda: fileobj.read(CHUNK_SIZE), b''))
+    if not metadata.pages:
+        metadata = metadata._replace(pages=count_pages_with_pypdf(fileobj) or 0)
+    fileobj.seek(0)
+    return metadata
+
+
+def scan_path(path):
+    with open(path, 'rb') as f:
+        return scan_file(f)
+
+
+def link_for_background_scan(path):
+    """
+    Give a background scan its own reference to an upload's temp file, which
+    Django deletes when the request ends. Hard-links when possible, copies
+    otherwise. The caller's job must remove the returned path.
+    """
+    fd, link_path = tempfile.mkstemp(suffix='.pdf', prefix='scan-')
+    os.close(fd)
+    os.remove(link_path)
+    try:
+        os.link(path, link_path)
+    except OSError:
+        shutil.copyfile(path, link_path)
+    return link_path
@@ -0,0 +1,237 @@
+# shop/previews.py
+
+"""
+Preview images of the first page of each question paper.
+
+``render_previews`` runs on the background pool after a paper's checksum is
+known (never during a request). It renders page one once with the configured
+PREVIEW_RENDERER, then Pillow resizes it to each of PREVIEW_WIDTHS and
+encodes every size in each of PREVIEW_FORMATS (WebP, with JPEG as a
+fallback). Images are stored under content-hash names
+(``previews/<sha256>.<ext>``), so a URL always serves the same bytes and can
+be cached forever. Previews belong to the PDF's checksum, not to a paper, so
+papers sharing a file share previews too.
+
+Templates call ``QuestionPaper.generate_thumbnail`` / ``get_preview_image_url``;
+each is one lookup in an in-process cache of the preview URLs per checksum.
+"""
+
+import hashlib
+import importlib.util
+import io
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+from .media_urls import MediaUrlCache
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_FOLDER = 'previews/'
+
+# Pillow format name and file extension per PREVIEW_FORMATS entry
+FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+
+# Seconds to remember that a checksum has no previews yet
+MISSING_PREVIEW_TTL = 60
+
+
+# ====================================================================
+# RENDERERS
+# ====================================================================
+
+# Renderers implement render(path, width, password) -> PIL image and available(),
+# which is False when what they need isn't installed (render_previews then skips).
+# Paid PDFs are password-protected; they are opened with the paper's password.
+
+class PdftoppmRenderer:
+    """Renders with poppler's ``pdftoppm`` command (apt install poppler-utils)."""
+
+    requirement = "the pdftoppm command (apt install poppler-utils)"
+
+    def available(self):
+        return shutil.which('pdftoppm') is not None
+
+    def render(self, path, width, password=''):
+        from PIL import Image
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'page')
+            subprocess.run(
+                ['pdftoppm', '-f', '1', '-l', '1', '-singlefile', '-png',
+                 '-scale-to-x', str(width), '-scale-to-y', '-1',
+                 *(['-upw', password] if password else []), path, output],
+                check=True, capture_output=True, timeout=120,
+            )
+            with Image.open(f"{output}.png") as image:
+                image.load()
+                return image
+
+
+class PyMuPDFRenderer:
+    """Renders with PyMuPDF (in requirements.txt; its wheels bundle MuPDF)."""
+
+    requirement = "PyMuPDF (pip install pymupdf)"
+
+    def available(self):
+        return importlib.util.find_spec('fitz') is not None
+
+    def render(self, path, width, password=''):
+        import fitz
+        from PIL import Image
+
+        with fitz.open(path) as document:
+            if document.needs_pass and not document.authenticate(password):
+                raise ValueError("The PDF's password doesn't match the paper's password.")
+            page = document[0]
+            zoom = width / page.rect.width
+            pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            return Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+
+
+def get_renderer():
+    return import_string(settings.PREVIEW_RENDERER)()
+
+
+_warned_unavailable = False
+
+
+def _warn_unavailable(renderer):
+    # Once per process: every upload would otherwise repeat it
+    global _warned_unavailable
+    if not _warned_unavailable:
+        _warned_unavailable = True
+        logger.warning(
+            "Preview images are not being rendered: PREVIEW_RENDERER %s needs %s.",
+            settings.PREVIEW_RENDERER, renderer.requirement,
+        )
+
+
+# ====================================================================
+# PIPELINE
+# ====================================================================
+
+def _storage():
+    # Previews bypass the content-addressed PDF blobs and go to the backend
+    return getattr(default_storage, 'backend', default_storage)
+
+
+@contextmanager
+def local_copy(field_file):
+    """A local file path for ``field_file`` (read through the media cache)."""
+    with tempfile.NamedTemporaryFile(suffix='.pdf') as temp_file:
+        with field_file.open('rb') as source:
+            shutil.copyfileobj(source, temp_file, 1024 * 1024)
+        temp_file.flush()
+        yield temp_file.name
+
+
+def encode(image, width, image_format):
+    """Resize ``image`` to ``width`` pixels wide and encode it; returns ``(bytes, height)``."""
+    from PIL import Image
+
+    pillow_format, _ = FORMATS[image_format]
+    resized = image.copy()
+    if resized.width > width:
+        resized = resized.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+    buffer = io.BytesIO()
+    resized.save(buffer, pillow_format, quality=settings.PREVIEW_QUALITY, optimize=True)
+    return buffer.getvalue(), resized.height
+
+
+def render_previews(paper_id, force=False):
+    """Background job: render and store the previews for a paper's PDF."""
+    from .models import PreviewImage, QuestionPaper
+
+    paper = QuestionPaper.objects.filter(pk=paper_id).first()
+    if paper is None or not paper.pdf_file or not paper.checksum:
+        return
+    if not force and PreviewImage.objects.filter(source_checksum=paper.checksum).exists():
+        return
+
+    renderer = get_renderer()
+    if not renderer.available():
+        _warn_unavailable(renderer)
+        return
+
+    widths = sorted(settings.PREVIEW_WIDTHS)
+    with local_copy(paper.pdf_file) as path:
+        page = renderer.render(path, widths[-1], paper.password).convert('RGB')
+
+    storage = _storage()
+    for width in widths:
+        for image_format in settings.PREVIEW_FORMATS:
+            data, height = encode(page, width, image_format)
+            name = f"{PREVIEW_FOLDER}{hashlib.sha256(data).hexdigest()}.{FORMATS[image_format][1]}"
+            # Same name means same bytes: an existing file is reused as is
+            if not storage.exists(name):
+                name = storage.save(name, ContentFile(data))
+            PreviewImage.store(paper.checksum, width, image_format, name, height, len(data))
+    url_cache.discard(('previews', paper.checksum))
+
+
+# ====================================================================
+# URL LOOKUP
+# ====================================================================
+
+url_cache = MediaUrlCache(settings.MEDIA_URL_CACHE_SIZE)
+
+
+def preview_storage_path(name):
+    """Local path of a stored preview, or None when storage is remote."""
+    try:
+        return _storage().path(name)
+    except NotImplementedError:
+        return None
+
+
+def storage_url(name):
+    """Public URL of a stored preview."""
+    if preview_storage_path(name) is None:
+        # Remote storage (Cloudinary): its CDN serves the content-hashed file
+        return _storage().url(name)
+    # Local storage: served by shop:preview_image with immutable caching
+    return reverse('shop:preview_image', args=[name])
+
+
+def preview_urls(checksum):
+    """``{(image_format, width): url}`` for a PDF checksum (cached in-process)."""
+    from .models import PreviewImage
+
+    key = ('previews', checksum)
+    urls = url_cache.get(key, min_remaining=0)
+    if urls is None:
+        urls = {
+            (image_format, width): storage_url(name)
+            for image_format, width, name in PreviewImage.objects.filter(
+                source_checksum=checksum
+            ).values_list('image_format', 'width', 'name')
+        }
+        ttl = settings.MEDIA_URL_TTL_SECONDS if urls else MISSING_PREVIEW_TTL
+        url_cache.set(key, urls, time.time() + ttl)
+    return urls
+
+
+def preview_url(checksum, width, image_format):
+    """URL of the smallest preview at least ``width`` wide (else the largest), or None."""
+    if not checksum:
+        return None
+    urls = preview_urls(checksum)
+    widths = sorted(w for f, w in urls if f == image_format)
+    if not widths:
+        return None
+    best = next((w for w in widths if w >= width), widths[-1])
+    return urls[(image_format, best)]
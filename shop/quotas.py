@@ -0,0 +1,232 @@
+# shop/quotas.py
+
+"""
+Per-payment download quotas.
+
+A download token shared in a group chat lets anyone download the paper, so
+each paid download is counted against its payment before anything else
+happens. Over-quota requests are turned away with a 429 before any database
+query or write, and before any file transfer.
+
+Three sliding windows of DOWNLOAD_QUOTA_WINDOW_SECONDS are kept:
+
+- downloads per payment (DOWNLOAD_QUOTA_PER_PAYMENT),
+- downloads per payment and paper (DOWNLOAD_QUOTA_PER_PAPER),
+- distinct client IPs per payment (DOWNLOAD_QUOTA_IPS_PER_PAYMENT).
+
+Each window is approximated from two fixed buckets: the current one, plus
+the previous one weighted by how much of it still overlaps the window.
+Counters live in the Django cache, which must be shared (Redis, Memcached
+or the database cache) for every worker to see the same counts: with the
+default local-memory cache each worker counts on its own, multiplying the
+quotas by the number of workers. If the cache is unreachable, each process
+counts on its own until it comes back. A quota of 0 turns that check off.
+"""
+
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Seconds to stay on the in-process counters after the shared cache fails
+SHARED_RETRY_SECONDS = 30
+
+
+def client_ip(request):
+    """
+    The client's IP address. Behind TRUSTED_PROXY_COUNT reverse proxies it is
+    the X-Forwarded-For hop added by the outermost of them, counted from the
+    right: hops further left come from the client and can be anything.
+    """
+    depth = settings.TRUSTED_PROXY_COUNT
+    if depth > 0:
+        hops = [hop.strip() for hop in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if hop.strip()]
+        if len(hops) >= depth:
+            return hops[-depth]
+    return request.META.get('REMOTE_ADDR')
+
+
+# ====================================================================
+# COUNTER STORES
+# ====================================================================
+
+class CacheCounters:
+    """Counters in the shared Django cache."""
+
+    def get_many(self, keys):
+        return cache.get_many(keys)
+
+    def add(self, key, ttl):
+        """Set ``key`` to 1 if it doesn't exist; True if it was added."""
+        return cache.add(key, 1, ttl)
+
+    def incr(self, key, ttl):
+        if cache.add(key, 1, ttl):
+            return 1
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # Expired between add() and incr()
+            cache.set(key, 1, ttl)
+            return 1
+
+
+class LocalCounters:
+    """In-process counters, used while the shared cache is unavailable."""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key, now):
+        entry = self._values.get(key)
+        if entry is not None and entry[1] <= now:
+            del self._values[key]
+            return None
+        return entry
+
+    def _prune(self, now):
+        if len(self._values) > self.max_keys:
+            for key in [key for key, (_, expires_at) in self._values.items() if expires_at <= now]:
+                del self._values[key]
+
+    def get_many(self, keys):
+        now = time.time()
+        with self._lock:
+            return {key: entry[0] for key in keys if (entry := self._live(key, now)) is not None}
+
+    def add(self, key, ttl):
+        now = time.time()
+        with self._lock:
+            if self._live(key, now) is not None:
+                return False
+            self._values[key] = (1, now + ttl)
+            self._prune(now)
+            return True
+
+    def incr(self, key, ttl):
+        now = time.time()
+        with self._lock:
+            entry = self._live(key, now)
+            value, expires_at = (entry[0] + 1, entry[1]) if entry else (1, now + ttl)
+            self._values[key] = (value, expires_at)
+            self._prune(now)
+            return value
+
+
+shared_counters = CacheCounters()
+local_counters = LocalCounters()
+_shared_down_until = 0
+
+
+def _call(method, *args):
+    """Run a counter operation on the shared cache, falling back to this process."""
+    global _shared_down_until
+    if time.time() >= _shared_down_until:
+        try:
+            return getattr(shared_counters, method)(*args)
+        except Exception:
+            logger.warning("Download quota cache unavailable; counting in-process for now", exc_info=True)
+            _shared_down_until = time.time() + SHARED_RETRY_SECONDS
+    return getattr(local_counters, method)(*args)
+
+
+# ====================================================================
+# SLIDING WINDOWS
+# ====================================================================
+
+def _buckets(now, window):
+    current = int(now // window)
+    overlap = 1 - (now - current * window) / window
+    return current, overlap
+
+
+def _estimate(counts, key, current, overlap):
+    return counts.get(f"{key}:{current - 1}", 0) * overlap + counts.get(f"{key}:{current}", 0)
+
+
+def _retry_after(counts, key, current, overlap, limit, window):
+    """Seconds until one more hit on ``key`` fits under ``limit`` (assuming no others)."""
+    previous = counts.get(f"{key}:{current - 1}", 0)
+    latest = counts.get(f"{key}:{current}", 0)
+    room = limit - 1 - latest
+    if room >= 0:
+        # The previous bucket's weight runs down before this bucket ends
+        wait = window * (overlap - room / previous) if previous else 0
+    else:
+        # After this bucket ends it becomes the previous one and runs down in turn
+        wait = window * overlap + window * (1 - (limit - 1) / latest)
+    return max(math.ceil(wait), 1)
+
+
+def _keys(payment_id, paper_ids, ip):
+    return (
+        f"dlquota:pay:{payment_id}",
+        f"dlquota:ips:{payment_id}",
+        f"dlquota:ip:{payment_id}:{ip}",
+        [f"dlquota:paper:{payment_id}:{paper_id}" for paper_id in paper_ids],
+    )
+
+
+def check_download(payment_id, paper_ids, ip):
+    """
+    Check a paid download of ``paper_ids`` (a ZIP may cover several) under
+    ``payment_id`` from ``ip`` against the quotas, without counting it.
+    Returns None if it's allowed, otherwise the number of seconds to wait.
+    """
+    window = settings.DOWNLOAD_QUOTA_WINDOW_SECONDS
+    current, overlap = _buckets(time.time(), window)
+    payment_key, ips_key, ip_key, paper_keys = _keys(payment_id, paper_ids, ip)
+
+    keys = [payment_key, ips_key, ip_key] + paper_keys
+    counts = _call('get_many', [f"{key}:{bucket}" for key in keys for bucket in (current - 1, current)])
+    new_ip = not (counts.get(f"{ip_key}:{current - 1}") or counts.get(f"{ip_key}:{current}"))
+
+    checks = [(payment_key, settings.DOWNLOAD_QUOTA_PER_PAYMENT)]
+    checks += [(key, settings.DOWNLOAD_QUOTA_PER_PAPER) for key in paper_keys]
+    if new_ip:
+        checks.append((ips_key, settings.DOWNLOAD_QUOTA_IPS_PER_PAYMENT))
+    for key, limit in checks:
+        if limit and _estimate(counts, key, current, overlap) + 1 > limit:
+            return _retry_after(counts, key, current, overlap, limit, window)
+    return None
+
+
+def record_download(payment_id, paper_ids, ip):
+    """Count a download that ``check_download`` allowed, once it is actually served."""
+    window = settings.DOWNLOAD_QUOTA_WINDOW_SECONDS
+    ttl = window * 2
+    current, _ = _buckets(time.time(), window)
+    payment_key, ips_key, ip_key, paper_keys = _keys(payment_id, paper_ids, ip)
+
+    _call('incr', f"{payment_key}:{current}", ttl)
+    for key in paper_keys:
+        _call('incr', f"{key}:{current}", ttl)
+    # Distinct IPs: count an address the first time it appears in the window
+    if _call('add', f"{ip_key}:{current}", ttl) and not _call('get_many', [f"{ip_key}:{current - 1}"]):
+        _call('incr', f"{ips_key}:{current}", ttl)
+
+
+# ====================================================================
+# RESUMED DOWNLOADS
+# ====================================================================
+# A streamed download counted once may be resumed with Range requests
+# without being counted again; see download_file.
+
+def _served_key(payment_id, paper_id, etag):
+    return f"dlquota:served:{payment_id or 'free'}:{paper_id}:{etag}"
+
+
+def mark_served(payment_id, paper_id, etag):
+    """Remember that the download of this file version was counted."""
+    _call('add', _served_key(payment_id, paper_id, etag), settings.DOWNLOAD_QUOTA_WINDOW_SECONDS * 2)
+
+
+def was_served(payment_id, paper_id, etag):
+    return bool(_call('get_many', [_served_key(payment_id, paper_id, etag)]))
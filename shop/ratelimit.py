@@ -0,0 +1,206 @@
+# shop/ratelimit.py
+
+"""
+Token-bucket rate limiting for public endpoints.
+
+    @rate_limit('contact', ip, 'RATE_LIMIT_CONTACT')
+    def contact_us(request): ...
+
+Each (scope, key) pair has a bucket of ``count`` tokens that refills at
+``count`` per ``period``; a request takes one token, and a request that
+finds the bucket empty gets a 429 with Retry-After without reaching the
+view. Rates are settings such as ``'5/h'`` or ``'30/m'`` (``s``, ``m``,
+``h``, ``d``, optionally with a multiplier: ``'10/15m'``); an empty or zero
+rate turns the limit off. Malformed rates stop startup with
+ImproperlyConfigured (``check_rates``, run by the app config).
+
+Buckets live in the Django cache, which must be shared (Redis, Memcached
+or the database cache) for every worker to enforce the same limit; with
+the default local-memory cache each worker has its own buckets. Each process also remembers the last state it saw for a bucket, and
+a bucket it knows is still empty is rejected from memory without a cache
+round-trip or a lock, so a client hammering an endpoint costs almost
+nothing. Shared updates are read-modify-write, so concurrent requests can
+occasionally take one token too many; that is fine for abuse control. If
+the cache is down, each process limits on its own.
+"""
+
+import functools
+import inspect
+import logging
+import math
+import re
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse, JsonResponse
+
+from .quotas import client_ip
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+_RATE_RE = re.compile(r'(\d+)/([1-9]\d*)?([smhd])')
+
+# Forget this process's bucket states once there are more than this many
+MAX_LOCAL_BUCKETS = 10000
+
+# key -> (tokens, updated_at), replaced whole so readers never need a lock
+_local = {}
+
+
+# ====================================================================
+# KEYS
+# ====================================================================
+
+def ip(request, *args, **kwargs):
+    """Key on the client's IP address."""
+    return client_ip(request)
+
+
+def url_kwarg(name):
+    """Key on a URL parameter, e.g. ``url_kwarg('payment_ref')``."""
+    def key(request, *args, **kwargs):
+        return kwargs.get(name)
+    return key
+
+
+def post_field(name):
+    """Key on a submitted form field, e.g. ``post_field('phone_number')``."""
+    def key(request, *args, **kwargs):
+        return request.POST.get(name, '').strip() or None
+    return key
+
+
+# ====================================================================
+# BUCKETS
+# ====================================================================
+
+def parse_rate(rate):
+    """``'5/m'`` -> ``(5, 5 / 60)`` (capacity, tokens per second); None when off."""
+    rate = (rate or '').strip()
+    if rate in ('', '0'):
+        return None
+    match = _RATE_RE.fullmatch(rate)
+    if match is None:
+        raise ImproperlyConfigured(f"Invalid rate {rate!r}: expected 'count/period', e.g. '5/h' or '10/15m'.")
+    count = int(match.group(1))
+    if count == 0:
+        return None
+    seconds = PERIODS[match.group(3)] * int(match.group(2) or 1)
+    return count, count / seconds
+
+
+def check_rates():
+    """Parse every RATE_LIMIT_* setting, so a malformed one stops startup rather than a request."""
+    for name in dir(settings):
+        if name.startswith('RATE_LIMIT_'):
+            try:
+                parse_rate(getattr(settings, name))
+            except ImproperlyConfigured as exc:
+                raise ImproperlyConfigured(f"{name}: {exc}") from None
+
+
+def _refill(state, capacity, per_second, now):
+    if state is None:
+        return capacity
+    tokens, updated_at = state
+    return min(capacity, tokens + (now - updated_at) * per_second)
+
+
+def known_empty(bucket_key, capacity, per_second):
+    """
+    Fast path: seconds to wait if this process last saw the bucket empty
+    and it hasn't refilled since, else None. Memory only, no lock.
+    """
+    tokens = _refill(_local.get(bucket_key), capacity, per_second, time.time())
+    if tokens < 1:
+        return math.ceil((1 - tokens) / per_second)
+    return None
+
+
+def take(bucket_key, capacity, per_second):
+    """Take a token from the shared bucket. Returns None if allowed, else seconds until one is available."""
+    now = time.time()
+    try:
+        tokens = _refill(cache.get(bucket_key), capacity, per_second, now)
+        shared = True
+    except Exception:
+        logger.warning("Rate limit cache unavailable; limiting in-process", exc_info=True)
+        tokens = _refill(_local.get(bucket_key), capacity, per_second, now)
+        shared = False
+
+    allowed = tokens >= 1
+    if allowed:
+        tokens -= 1
+    if shared:
+        try:
+            cache.set(bucket_key, (tokens, now), math.ceil(capacity / per_second) + 1)
+        except Exception:
+            logger.warning("Rate limit cache unavailable; limiting in-process", exc_info=True)
+
+    if len(_local) > MAX_LOCAL_BUCKETS:
+        _local.clear()
+    _local[bucket_key] = (tokens, now)
+    return None if allowed else math.ceil((1 - tokens) / per_second)
+
+
+def too_many_requests(request, retry_after):
+    message = "Too many requests. Please try again later."
+    if request.path.startswith('/api/') or 'application/json' in request.headers.get('Accept', ''):
+        response = JsonResponse({'error': message}, status=429)
+    else:
+        response = HttpResponse(message, status=429, content_type='text/plain; charset=utf-8')
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+# ====================================================================
+# DECORATOR
+# ====================================================================
+
+def rate_limit(scope, key, rate_setting, methods=('POST',)):
+    """
+    Limit a view (sync or async) to the rate in settings.<rate_setting> per
+    ``key(request, *args, **kwargs)``. Only ``methods`` are counted; a None
+    key skips the limit for that request.
+    """
+    def bucket(request, args, kwargs):
+        """``(bucket_key, capacity, per_second)`` for this request, or None if it isn't limited."""
+        if request.method not in methods:
+            return None
+        rate = parse_rate(getattr(settings, rate_setting, ''))
+        value = key(request, *args, **kwargs)
+        if rate is None or value is None:
+            return None
+        return (f"ratelimit:{scope}:{value}",) + rate
+
+    def decorator(view):
+        if inspect.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                limit = bucket(request, args, kwargs)
+                if limit is not None:
+                    retry_after = known_empty(*limit)
+                    if retry_after is None:
+                        retry_after = await sync_to_async(take)(*limit)
+                    if retry_after is not None:
+                        return too_many_requests(request, retry_after)
+                return await view(request, *args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            limit = bucket(request, args, kwargs)
+            if limit is not None:
+                retry_after = known_empty(*limit)
+                if retry_after is None:
+                    retry_after = take(*limit)
+                if retry_after is not None:
+                    return too_many_requests(request, retry_after)
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
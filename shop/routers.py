@@ -0,0 +1,50 @@
+# shop/routers.py
+
+"""
+Database routing for the high-write log tables.
+
+Download history, its interned user agents and its rollups live in their own
+database (settings.TELEMETRY_DATABASE, a separate SQLite file by default), so
+a burst of download logging never holds the write lock that checkout and
+payment updates need. Everything else stays on 'default'.
+
+Telemetry rows refer to papers and payments by plain ids (``paper_id``,
+``payment_id``) because foreign keys can't cross databases; see
+``DownloadHistory.attach_related`` for loading them in bulk. Setting
+TELEMETRY_DATABASE to 'default' puts everything back in one database.
+"""
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+TELEMETRY_MODELS = {'shop.downloadhistory', 'shop.useragent', 'shop.downloadrollup'}
+
+
+def telemetry_db():
+    return settings.TELEMETRY_DATABASE
+
+
+def _is_telemetry(model):
+    return model._meta.label_lower in TELEMETRY_MODELS
+
+
+class TelemetryRouter:
+    def db_for_read(self, model, **hints):
+        if _is_telemetry(model):
+            return telemetry_db()
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if _is_telemetry(type(obj1)) == _is_telemetry(type(obj2)):
+            return True
+        return telemetry_db() == DEFAULT_DB_ALIAS
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        alias = telemetry_db()
+        if alias == DEFAULT_DB_ALIAS:
+            return None
+        # Unhinted RunPython/RunSQL operations only run on the main database
+        is_telemetry = model_name is not None and f"{app_label}.{model_name}" in TELEMETRY_MODELS
+        return (db == alias) == is_telemetry
@@ -0,0 +1,253 @@
+# shop/sms.py
+
+"""
+SMS dispatch for password delivery.
+
+Views call ``asend_sms()``: it records an SmsMessage, skips duplicates and
+throttled numbers, and hands the message to the backend named by
+settings.SMS_BACKEND, retrying with exponential backoff. ``adispatch()``
+sends any number of queued messages, batching identical texts into one
+provider request.
+
+Backends:
+- ``shop.sms.ArkeselBackend``  - Arkesel v2 API (production)
+- ``shop.sms.ConsoleBackend``  - prints messages to stdout (development)
+- ``shop.sms.InMemoryBackend`` - collects messages in ``InMemoryBackend.outbox`` (tests)
+"""
+
+import asyncio
+import logging
+import sys
+from collections import defaultdict
+from datetime import timedelta
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .http_clients import get_async_client
+from .models import SmsMessage
+
+logger = logging.getLogger(__name__)
+
+
+class SmsDeliveryError(Exception):
+    """Raised by backends when a send fails. Errors with retryable=False are not retried."""
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+# ====================================================================
+# BACKENDS
+# ====================================================================
+
+class BaseSmsBackend:
+    # Most recipients a single provider request may carry
+    max_batch_size = 100
+
+    async def send(self, recipients, body):
+        """Send ``body`` to every number in ``recipients`` and return the provider's reply as text."""
+        raise NotImplementedError
+
+
+class ArkeselBackend(BaseSmsBackend):
+    api_url = "https://sms.arkesel.com/api/v2/sms/send"
+
+    async def send(self, recipients, body):
+        payload = {
+            "sender": settings.SMS_SENDER_ID,
+            "message": body,
+            "recipients": list(recipients),
+            "apiKey": settings.ARKESEL_API_KEY
+        }
+        try:
+            response = await get_async_client().post(self.api_url, json=payload)
+        except httpx.HTTPError as e:
+            raise SmsDeliveryError(f"Arkesel unreachable: {e!r}") from e
+
+        if response.status_code != 200:
+            # Bad keys, invalid numbers and exhausted credit won't fix themselves on retry
+            retryable = response.status_code == 429 or response.status_code >= 500
+            raise SmsDeliveryError(f"Arkesel HTTP {response.status_code}: {response.text[:500]}", retryable=retryable)
+
+        try:
+            status = response.json().get('status')
+        except ValueError:
+            status = None
+        if status != 'success':
+            raise SmsDeliveryError(f"Arkesel rejected the message: {response.text[:500]}", retryable=False)
+        return response.text
+
+
+class ConsoleBackend(BaseSmsBackend):
+    async def send(self, recipients, body):
+        sys.stdout.write(f"SMS to {', '.join(recipients)}:\n{body}\n{'-' * 40}\n")
+        sys.stdout.flush()
+        return 'console'
+
+
+class InMemoryBackend(BaseSmsBackend):
+    # Every send is appended here as {'recipients': [...], 'body': '...'}
+    outbox = []
+    # Number of upcoming sends that should fail with a retryable error
+    fail_times = 0
+
+    async def send(self, recipients, body):
+        if InMemoryBackend.fail_times > 0:
+            InMemoryBackend.fail_times -= 1
+            raise SmsDeliveryError("Simulated provider failure")
+        InMemoryBackend.outbox.append({'recipients': list(recipients), 'body': body})
+        return 'queued in memory'
+
+
+def get_backend():
+    return import_string(settings.SMS_BACKEND)()
+
+
+# ====================================================================
+# DISPATCH
+# ====================================================================
+
+def _dedupe_cache_key(dedupe_key):
+    return f"sms-dedupe:{dedupe_key}"
+
+
+async def _is_throttled(phone_number):
+    """Count a send against the number's window; True once it exceeds SMS_THROTTLE_MAX_PER_WINDOW."""
+    limit = settings.SMS_THROTTLE_MAX_PER_WINDOW
+    if limit <= 0:
+        return False
+
+    key = f"sms-throttle:{phone_number}"
+    window = settings.SMS_THROTTLE_WINDOW_SECONDS
+    if await cache.aadd(key, 1, window):
+        return False
+    try:
+        count = await cache.aincr(key)
+    except ValueError:
+        # The window expired between add() and incr()
+        await cache.aset(key, 1, window)
+        return False
+    return count > limit
+
+
+async def asend_sms(phone_number, body, payment=None, dedupe_key=''):
+    """
+    Log and send one SMS. Returns the SmsMessage describing the outcome.
+
+    If a message with the same ``dedupe_key`` is in flight or was sent within
+    SMS_DEDUPE_SECONDS, nothing is sent and that earlier message is returned.
+    """
+    if dedupe_key:
+        claimed = await cache.aadd(_dedupe_cache_key(dedupe_key), True, settings.SMS_DEDUPE_SECONDS)
+        if not claimed:
+            earlier = await SmsMessage.objects.filter(dedupe_key=dedupe_key).order_by('-created_at').afirst()
+            if earlier is not None:
+                return earlier
+        else:
+            # The cache may have been cleared; the log is the source of truth
+            earlier = await sync_to_async(SmsMessage.find_recent_duplicate)(dedupe_key)
+            if earlier is not None:
+                return earlier
+
+    message = await SmsMessage.objects.acreate(
+        phone_number=phone_number,
+        body=body,
+        payment=payment,
+        dedupe_key=dedupe_key,
+        backend=settings.SMS_BACKEND,
+    )
+
+    if await _is_throttled(phone_number):
+        message.status = SmsMessage.STATUS_THROTTLED
+        message.error = "Too many messages to this number; try again later."
+        await message.asave(update_fields=['status', 'error'])
+    else:
+        await adispatch([message])
+
+    if dedupe_key and message.status != SmsMessage.STATUS_SENT:
+        # Let the customer try again straight away if this attempt didn't go out
+        await cache.adelete(_dedupe_cache_key(dedupe_key))
+    return message
+
+
+async def adispatch(messages):
+    """Send SmsMessage rows, one provider request per batch of identical texts."""
+    backend = get_backend()
+    by_body = defaultdict(list)
+    for message in messages:
+        by_body[message.body].append(message)
+
+    batches = []
+    for group in by_body.values():
+        for start in range(0, len(group), backend.max_batch_size):
+            batches.append(group[start:start + backend.max_batch_size])
+
+    await asyncio.gather(*(_send_batch(backend, batch) for batch in batches))
+
+
+async def _send_batch(backend, batch):
+    recipients = [message.phone_number for message in batch]
+    max_attempts = max(1, settings.SMS_MAX_ATTEMPTS)
+    response, error, attempts = '', None, 0
+
+    for attempt in range(1, max_attempts + 1):
+        attempts = attempt
+        try:
+            response = await backend.send(recipients, batch[0].body)
+            error = None
+            break
+        except Exception as e:
+            error = e
+            if not getattr(e, 'retryable', False) or attempt == max_attempts:
+                break
+            await asyncio.sleep(settings.SMS_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
+
+    if error is not None:
+        logger.warning("Error sending SMS to %s after %d attempt(s): %s", ', '.join(recipients), attempts, error)
+
+    sent_at = timezone.now() if error is None else None
+    for message in batch:
+        message.status = SmsMessage.STATUS_SENT if error is None else SmsMessage.STATUS_FAILED
+        message.backend = settings.SMS_BACKEND
+        message.attempts += attempts
+        message.provider_response = response or ''
+        message.error = str(error) if error is not None else ''
+        message.sent_at = sent_at
+        await message.asave(update_fields=[
+            'status', 'backend', 'attempts', 'provider_response', 'error', 'sent_at'
+        ])
+
+
+# ====================================================================
+# REPORTING
+# ====================================================================
+
+def get_stats(hours=24):
+    """Status counts, throughput and retry figures for messages created in the last ``hours``."""
+    since = timezone.now() - timedelta(hours=hours)
+    recent = SmsMessage.objects.filter(created_at__gte=since)
+
+    by_status = dict(recent.values_list('status').annotate(total=Count('id')).order_by())
+    total = sum(by_status.values())
+    sent = by_status.get(SmsMessage.STATUS_SENT, 0)
+    failed = by_status.get(SmsMessage.STATUS_FAILED, 0)
+
+    return {
+        'hours': hours,
+        'total': total,
+        'by_status': by_status,
+        'sent_per_hour': sent / hours if hours else 0,
+        'failure_rate': failed / (sent + failed) if sent + failed else 0,
+        'avg_attempts': recent.exclude(attempts=0).aggregate(avg=Avg('attempts'))['avg'] or 0,
+        'top_errors': list(
+            recent.filter(status=SmsMessage.STATUS_FAILED)
+            .values('error').annotate(total=Count('id')).order_by('-total')[:5]
+        ),
+    }
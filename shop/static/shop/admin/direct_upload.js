@@ -0,0 +1,239 @@
+/*
+ * Direct-to-storage uploads for the shop admin (see shop/direct_upload.py).
+ *
+ * File inputs marked with data-direct-upload-* attributes are uploaded as
+ * soon as a file is picked: ticket -> upload to storage -> complete. The
+ * returned reference goes into a hidden input and the file input is cleared,
+ * so saving the form never sends the PDF through the app server.
+ *
+ * Files larger than one chunk go through the chunked, resumable endpoint
+ * instead (see shop/chunked_upload.py): each chunk is sent with its SHA-256
+ * and retried on failure, and picking the same file again after a dropped
+ * connection resumes from the last chunk the server verified.
+ */
+(function () {
+    'use strict';
+
+    function csrfToken(form) {
+        var input = form.querySelector('input[name="csrfmiddlewaretoken"]');
+        return input ? input.value : '';
+    }
+
+    function postJson(url, body, token) {
+        return fetch(url, {
+            method: 'POST',
+            credentials: 'same-origin',
+            headers: {'Content-Type': 'application/json', 'X-CSRFToken': token},
+            body: JSON.stringify(body)
+        }).then(function (response) {
+            return response.json().then(function (data) {
+                if (!response.ok) {
+                    throw new Error(data.error || 'Request failed');
+                }
+                return data;
+            });
+        });
+    }
+
+    function sendFile(upload, file, onProgress) {
+        return new Promise(function (resolve, reject) {
+            var xhr = new XMLHttpRequest();
+            xhr.open(upload.method, upload.url);
+            xhr.upload.onprogress = function (event) {
+                if (event.lengthComputable) {
+                    onProgress(Math.round(event.loaded * 100 / event.total));
+                }
+            };
+            xhr.onload = function () {
+                var result = {};
+                try {
+                    result = JSON.parse(xhr.responseText);
+                } catch (e) { /* non-JSON provider response */ }
+                if (xhr.status >= 200 && xhr.status < 300) {
+                    resolve(result);
+                } else {
+                    reject(new Error((result.error && (result.error.message || result.error)) || 'Upload failed'));
+                }
+            };
+            xhr.onerror = function () {
+                reject(new Error('Upload failed'));
+            };
+
+            if (upload.file_field) {
+                var body = new FormData();
+                Object.keys(upload.fields).forEach(function (key) {
+                    body.append(key, upload.fields[key]);
+                });
+                body.append(upload.file_field, file);
+                xhr.send(body);
+            } else {
+                xhr.setRequestHeader('Content-Type', 'application/pdf');
+                xhr.send(file);
+            }
+        });
+    }
+
+    var CHUNK_RETRIES = 3;
+
+    function requestJson(method, url, body, token, headers) {
+        var allHeaders = {'X-CSRFToken': token};
+        Object.keys(headers || {}).forEach(function (key) {
+            allHeaders[key] = headers[key];
+        });
+        return fetch(url, {
+            method: method,
+            credentials: 'same-origin',
+            headers: allHeaders,
+            body: body
+        }).then(function (response) {
+            return response.json().then(function (data) {
+                data.status = response.status;
+                return data;
+            });
+        });
+    }
+
+    function sha256Hex(blob) {
+        return blob.arrayBuffer().then(function (buffer) {
+            return crypto.subtle.digest('SHA-256', buffer);
+        }).then(function (digest) {
+            return Array.prototype.map.call(new Uint8Array(digest), function (byte) {
+                return ('0' + byte.toString(16)).slice(-2);
+            }).join('');
+        });
+    }
+
+    function chunkedSession(input, file, token) {
+        var startUrl = input.dataset.chunkedUploadUrl;
+        var resumeKey = 'chunked-upload:' + [
+            input.dataset.directUploadModel, input.name, file.name, file.size, file.lastModified
+        ].join(':');
+        var uploadId = window.localStorage.getItem(resumeKey);
+        var resumed = uploadId ?
+            requestJson('GET', startUrl + uploadId + '/', undefined, token) :
+            Promise.resolve({status: 404});
+
+        return resumed.then(function (data) {
+            if (data.status === 200) {
+                return data;
+            }
+            return postJson(startUrl, {
+                model: input.dataset.directUploadModel,
+                field: input.name,
+                filename: file.name,
+                size: file.size
+            }, token);
+        }).then(function (session) {
+            window.localStorage.setItem(resumeKey, session.upload_id);
+            session.resumeKey = resumeKey;
+            return session;
+        });
+    }
+
+    function sendChunks(input, file, token, onProgress) {
+        var startUrl = input.dataset.chunkedUploadUrl;
+
+        return chunkedSession(input, file, token).then(function (session) {
+            var sessionUrl = startUrl + session.upload_id + '/';
+
+            function sendChunk(index, attempt) {
+                if (index >= session.chunk_count) {
+                    return postJson(sessionUrl + 'complete/', {}, token).then(function (data) {
+                        window.localStorage.removeItem(session.resumeKey);
+                        return data;
+                    });
+                }
+                onProgress(Math.round(index * 100 / session.chunk_count));
+                var chunk = file.slice(index * session.chunk_size, (index + 1) * session.chunk_size);
+                return sha256Hex(chunk).then(function (checksum) {
+                    return requestJson('PUT', sessionUrl + 'chunks/' + index + '/', chunk, token, {
+                        'Content-Type': 'application/octet-stream',
+                        'X-Chunk-SHA256': checksum
+                    });
+                }).catch(function () {
+                    return {status: 0};
+                }).then(function (data) {
+                    if (data.status === 200) {
+                        return sendChunk(data.next_chunk, 0);
+                    }
+                    if (data.status === 409 && data.next_chunk !== index) {
+                        // Server is elsewhere (e.g. a chunk it never verified): follow it
+                        return sendChunk(data.next_chunk, attempt + 1);
+                    }
+                    if (attempt + 1 >= CHUNK_RETRIES) {
+                        throw new Error(data.error || 'Chunk ' + index + ' failed; pick the file again to resume');
+                    }
+                    return sendChunk(index, attempt + 1);
+                });
+            }
+
+            return sendChunk(session.next_chunk, 0);
+        });
+    }
+
+    function setSubmitting(form, busy) {
+        form.querySelectorAll('input[type="submit"], button[type="submit"]').forEach(function (button) {
+            button.disabled = busy;
+        });
+    }
+
+    function attach(input) {
+        var form = input.form;
+        var status = document.createElement('span');
+        status.className = 'help direct-upload-status';
+        input.parentNode.insertBefore(status, input.nextSibling);
+
+        var reference = form.querySelector('input[name="' + input.dataset.directUploadReference + '"]');
+        if (!reference) {
+            reference = document.createElement('input');
+            reference.type = 'hidden';
+            reference.name = input.dataset.directUploadReference;
+            form.appendChild(reference);
+        }
+
+        input.addEventListener('change', function () {
+            var file = input.files[0];
+            if (!file) {
+                return;
+            }
+            var token = csrfToken(form);
+            var ticket;
+            reference.value = '';
+            setSubmitting(form, true);
+            status.textContent = 'Preparing upload…';
+
+            var onProgress = function (percent) {
+                status.textContent = 'Uploading ' + file.name + ': ' + percent + '%';
+            };
+            var uploaded;
+            if (file.size > Number(input.dataset.chunkedUploadThreshold)) {
+                uploaded = sendChunks(input, file, token, onProgress);
+            } else {
+                uploaded = postJson(input.dataset.directUploadTicketUrl, {
+                    model: input.dataset.directUploadModel,
+                    field: input.name,
+                    filename: file.name
+                }, token).then(function (data) {
+                    ticket = data.ticket;
+                    return sendFile(data.upload, file, onProgress);
+                }).then(function (result) {
+                    return postJson(input.dataset.directUploadCompleteUrl, {ticket: ticket, result: result}, token);
+                });
+            }
+
+            uploaded.then(function (data) {
+                reference.value = data.reference;
+                input.value = '';
+                status.textContent = 'Uploaded ' + file.name + '. Save to attach it.';
+            }).catch(function (error) {
+                status.textContent = 'Upload failed: ' + error.message;
+            }).then(function () {
+                setSubmitting(form, false);
+            });
+        });
+    }
+
+    document.addEventListener('DOMContentLoaded', function () {
+        document.querySelectorAll('input[type="file"][data-direct-upload-ticket-url]').forEach(attach);
+    });
+})();
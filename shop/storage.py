@@ -0,0 +1,226 @@
+# shop/storage.py
+
+"""
+Local disk cache in front of the media storage backend.
+
+CachedMediaStorage wraps the real backend (Cloudinary in production) and
+keeps recently read files on local disk, so admin previews, sample
+generation and checksum jobs download a PDF from remote storage once:
+
+- the cache is capped at ``max_bytes``; the least recently read files are
+  evicted first (reads refresh a file's mtime)
+- fills are atomic: data is written to a temp file in the cache directory
+  and renamed into place, so readers never see a partial file
+- fills are single-flight: concurrent readers of the same uncached file in
+  this process wait for one download instead of each starting their own
+  (locks are striped by name, so the lock table never grows)
+- the cache size is tracked as files are added and evicted; the directory
+  is only walked when that total passes ``max_bytes`` or is older than
+  SIZE_RESCAN_SECONDS (other processes fill the same directory)
+
+Saves are content-addressed: a file is stored under its SHA-256 and an
+upload identical to an existing blob reuses it (shop.models.MediaBlob keeps
+the reference counts). Deletes, existence checks, URLs and paths go
+straight to the backend; deletes also drop the cached copy.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from django.core.files import File
+from django.core.files.storage import Storage
+from django.utils.deconstruct import deconstructible
+from django.utils.module_loading import import_string
+
+
+FILL_LOCK_STRIPES = 64
+
+SIZE_RESCAN_SECONDS = 5 * 60
+
+
+@deconstructible
+class CachedMediaStorage(Storage):
+
+    def __init__(self, backend, location, max_bytes):
+        # ``backend`` is a storage class path (from STORAGES OPTIONS) or an instance
+        self.backend = import_string(backend)() if isinstance(backend, str) else backend
+        self.location = str(location)
+        self.max_bytes = max_bytes
+        self._fill_locks = [threading.Lock() for _ in range(FILL_LOCK_STRIPES)]
+        # Bytes in the cache directory as of the last walk plus what was added since
+        self._size = None
+        self._scanned_at = 0
+        self._size_lock = threading.Lock()
+
+    # --- Cache paths ---
+
+    def cache_path(self, name):
+        """Where ``name`` lives in the local cache (whether or not it is cached yet)."""
+        digest = hashlib.sha256(name.encode('utf-8')).hexdigest()
+        extension = os.path.splitext(name)[1]
+        return os.path.join(self.location, digest[:2], digest + extension)
+
+    def is_cached(self, name):
+        return os.path.exists(self.cache_path(name))
+
+    def _fill_lock(self, name):
+        # Names sharing a stripe just fill one after the other
+        return self._fill_locks[hash(name) % FILL_LOCK_STRIPES]
+
+    # --- Reads ---
+
+    def _open(self, name, mode='rb'):
+        if 'r' not in mode or '+' in mode:
+            return self.backend.open(name, mode)
+        path = self.cache_path(name)
+        if not self._touch(path):
+            with self._fill_lock(name):
+                # Another thread may have filled it while we waited
+                if not self._touch(path):
+                    self._fill(name, path)
+        try:
+            return File(open(path, mode), name=name)
+        except FileNotFoundError:
+            # Evicted by another fill between the check and the open
+            with self._fill_lock(name):
+                self._fill(name, path)
+            return File(open(path, mode), name=name)
+
+    def _touch(self, path):
+        """Mark a cached file as recently used. False if it isn't cached."""
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _fill(self, name, path):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file, self.backend.open(name, 'rb') as source:
+                shutil.copyfileobj(source, temp_file, 1024 * 1024)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self._add_size(os.path.getsize(path), keep=path)
+
+    def _add_size(self, size, keep=None):
+        with self._size_lock:
+            stale = self._size is None or time.monotonic() - self._scanned_at > SIZE_RESCAN_SECONDS
+            if not stale:
+                self._size += size
+            if stale or self._size > self.max_bytes:
+                self._size = self._enforce_budget(keep)
+                self._scanned_at = time.monotonic()
+
+    def _enforce_budget(self, keep=None):
+        """Delete least recently used files until the cache fits in max_bytes. Returns the bytes left."""
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.location):
+            for filename in files:
+                if filename.endswith('.part'):
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
+
+    def evict(self, name):
+        path = self.cache_path(name)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._size_lock:
+            if self._size is not None:
+                self._size = max(self._size - size, 0)
+
+    # --- Delegated to the backend ---
+
+    def _save(self, name, content):
+        """
+        Store ``content`` under a name derived from its SHA-256. If a blob with
+        the same content already exists its name is returned and nothing is
+        uploaded; otherwise the file is uploaded and registered as a MediaBlob.
+        """
+        from .models import MediaBlob
+
+        checksum = getattr(content, 'sha256', None) or self._hash(content)
+        blob = MediaBlob.objects.filter(checksum=checksum).first()
+        if blob is not None:
+            return blob.name
+
+        directory, filename = os.path.split(name)
+        blob_name = os.path.join(directory, checksum + os.path.splitext(filename)[1])
+        stored_name = self.backend._save(blob_name, content)
+        blob, _ = MediaBlob.objects.get_or_create(
+            checksum=checksum,
+            defaults={'name': stored_name, 'size': content.size or 0},
+        )
+        if blob.name != stored_name:
+            # Lost a race with an identical concurrent upload: keep theirs
+            self.backend.delete(stored_name)
+        return blob.name
+
+    @staticmethod
+    def _hash(content):
+        hasher = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            hasher.update(chunk)
+        content.seek(0)
+        return hasher.hexdigest()
+
+    def delete(self, name):
+        self.evict(name)
+        return self.backend.delete(name)
+
+    def exists(self, name):
+        # Not the cache: a cached copy can outlive a delete made by another process
+        return self.backend.exists(name)
+
+    def size(self, name):
+        try:
+            return os.path.getsize(self.cache_path(name))
+        except FileNotFoundError:
+            return self.backend.size(name)
+
+    def url(self, name):
+        return self.backend.url(name)
+
+    def path(self, name):
+        return self.backend.path(name)
+
+    def listdir(self, path):
+        return self.backend.listdir(path)
+
+    def get_available_name(self, name, max_length=None):
+        return self.backend.get_available_name(name, max_length=max_length)
+
+    def generate_filename(self, filename):
+        return self.backend.generate_filename(filename)
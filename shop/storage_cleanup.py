@@ -0,0 +1,225 @@
+# shop/storage_cleanup.py
+
+"""
+Background deletion of stored media and reconciliation of storage with the
+database.
+
+Deletes never happen inside a request: MediaBlob.release() queues the name
+as a StorageDeletion row and ``process_deletions`` drains the queue in
+batches on the background pool (one Cloudinary ``delete_resources`` call per
+batch of up to 100 files). A name that has been referenced again since it
+was queued is dropped from the queue instead of deleted. Failed deletions
+are retried on the next run until STORAGE_DELETE_MAX_ATTEMPTS.
+
+``find_orphans`` pages through the upload, preview and watermark folders
+and yields the ones nothing in the database points at; the
+sweep_media_orphans command queues them for deletion.
+"""
+
+import logging
+import threading
+from datetime import datetime, timezone as dt_timezone
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import models
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .direct_upload import UPLOAD_FIELDS
+from .previews import PREVIEW_FOLDER
+from .watermark import WATERMARK_FOLDER
+
+logger = logging.getLogger(__name__)
+
+# One drain at a time per process; a drain keeps going until the queue is empty
+_drain_lock = threading.Lock()
+
+
+def _backend(storage):
+    return getattr(storage, 'backend', storage)
+
+
+def _is_cloudinary(storage):
+    try:
+        from cloudinary_storage.storage import MediaCloudinaryStorage
+    except ImportError:
+        return False
+    return isinstance(storage, MediaCloudinaryStorage)
+
+
+def _delivery_type(backend):
+    return getattr(backend, 'DELIVERY_TYPE', 'upload')
+
+
+def upload_folders():
+    """The ``upload_to`` folder of every media field that stores uploads."""
+    return [
+        apps.get_model(label)._meta.get_field(field_name).upload_to
+        for label, field_name in UPLOAD_FIELDS.items()
+    ]
+
+
+def media_folders():
+    """Every folder the site stores files under: uploads, previews and watermarked copies."""
+    return upload_folders() + [PREVIEW_FOLDER, WATERMARK_FOLDER]
+
+
+def referenced_names(names):
+    """The subset of ``names`` still referenced by a paper, sample, blob, upload, preview or watermarked copy."""
+    from .models import FreeSample, MediaBlob, PreviewImage, QuestionPaper, UploadSession, WatermarkedCopy
+
+    names = list(names)
+    referenced = set()
+    for queryset in (
+        QuestionPaper.objects.filter(pdf_file__in=names).values_list('pdf_file', flat=True),
+        FreeSample.objects.filter(sample_pdf__in=names).values_list('sample_pdf', flat=True),
+        MediaBlob.objects.filter(name__in=names).values_list('name', flat=True),
+        UploadSession.objects.filter(stored_name__in=names).values_list('stored_name', flat=True),
+        PreviewImage.objects.filter(name__in=names).values_list('name', flat=True),
+        WatermarkedCopy.objects.filter(file__in=names).values_list('file', flat=True),
+    ):
+        referenced.update(queryset)
+    return referenced
+
+
+# ====================================================================
+# DELETION QUEUE
+# ====================================================================
+
+def delete_files(storage, names):
+    """Delete ``names`` from storage. Returns ``{name: error}`` for failures."""
+    backend = _backend(storage)
+    if hasattr(storage, 'evict'):
+        for name in names:
+            storage.evict(name)
+
+    if _is_cloudinary(backend):
+        import cloudinary.api
+
+        try:
+            result = cloudinary.api.delete_resources(
+                list(names), resource_type=backend.RESOURCE_TYPE, type=_delivery_type(backend), invalidate=True
+            )
+        except Exception as e:
+            return {name: str(e) for name in names}
+        return {
+            name: status
+            for name, status in result.get('deleted', {}).items()
+            if status not in ('deleted', 'not_found')
+        }
+
+    errors = {}
+    for name in names:
+        try:
+            backend.delete(name)
+        except Exception as e:
+            errors[name] = str(e)
+    return errors
+
+
+def process_deletions(batch_size=None, retry_failed=False, storage=None):
+    """
+    Drain the StorageDeletion queue in batches. Returns the number of files
+    deleted (0 if another thread in this process is already draining).
+    """
+    from .models import StorageDeletion
+
+    if not _drain_lock.acquire(blocking=False):
+        return 0
+    try:
+        storage = storage or default_storage
+        batch_size = batch_size or settings.STORAGE_DELETE_BATCH_SIZE
+        queue = StorageDeletion.objects.order_by('pk')
+        if not retry_failed:
+            queue = queue.filter(attempts__lt=settings.STORAGE_DELETE_MAX_ATTEMPTS)
+
+        deleted = 0
+        last_pk = 0
+        while True:
+            batch = list(queue.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                return deleted
+            last_pk = batch[-1].pk
+
+            in_use = referenced_names(item.name for item in batch)
+            to_delete = [item.name for item in batch if item.name not in in_use]
+            errors = delete_files(storage, to_delete) if to_delete else {}
+
+            StorageDeletion.objects.filter(
+                pk__in=[item.pk for item in batch if item.name not in errors]
+            ).delete()
+            for name, error in errors.items():
+                StorageDeletion.objects.filter(name=name).update(
+                    attempts=models.F('attempts') + 1, last_error=error[:1000]
+                )
+                logger.warning("Could not delete %s from storage: %s", name, error)
+            deleted += len(to_delete) - len(errors)
+    finally:
+        _drain_lock.release()
+
+
+# ====================================================================
+# ORPHAN SWEEP
+# ====================================================================
+
+def iter_stored_pages(storage, folder, page_size):
+    """Yield pages of ``(name, created_at)`` for the files stored under ``folder``."""
+    backend = _backend(storage)
+
+    if _is_cloudinary(backend):
+        import cloudinary.api
+
+        cursor = None
+        while True:
+            options = {'next_cursor': cursor} if cursor else {}
+            result = cloudinary.api.resources(
+                type=_delivery_type(backend),
+                resource_type=backend.RESOURCE_TYPE,
+                prefix=backend._prepend_prefix(folder),
+                max_results=min(page_size, 500),
+                **options,
+            )
+            yield [(item['public_id'], parse_datetime(item['created_at'])) for item in result['resources']]
+            cursor = result.get('next_cursor')
+            if not cursor:
+                return
+
+    try:
+        _, filenames = backend.listdir(folder)
+    except FileNotFoundError:
+        return
+    filenames = sorted(filenames)
+    for start in range(0, len(filenames), page_size):
+        page = []
+        for filename in filenames[start:start + page_size]:
+            name = folder + filename
+            try:
+                created_at = backend.get_modified_time(name)
+            except (NotImplementedError, OSError):
+                created_at = datetime.fromtimestamp(0, tz=dt_timezone.utc)
+            page.append((name, created_at))
+        yield page
+
+
+def find_orphans(storage=None, page_size=500, min_age=None):
+    """
+    Yield ``(folder, page_count, orphans)`` for each page of stored files,
+    where ``orphans`` are names nothing references that aren't already
+    queued for deletion. Files younger than ``min_age`` are skipped: they
+    may be direct uploads whose admin form hasn't been saved yet.
+    """
+    from .models import StorageDeletion
+
+    storage = storage or default_storage
+    cutoff = timezone.now() - min_age if min_age else None
+    for folder in media_folders():
+        for page in iter_stored_pages(storage, folder, page_size):
+            names = [
+                name for name, created_at in page
+                if cutoff is None or created_at is None or created_at < cutoff
+            ]
+            in_use = referenced_names(names)
+            queued = set(StorageDeletion.objects.filter(name__in=names).values_list('name', flat=True))
+            yield folder, len(page), [name for name in names if name not in in_use and name not in queued]
@@ -1,3 +1,1030 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import uuid
+import zipfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.admin.sites import AdminSite
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.db import connections
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    chunked_upload, direct_upload, download_archive, download_log, file_serving, media_urls, previews, quotas, ratelimit,
+    sms, tokens, useragents, watermark,
+)
+from .cloudinary_media import AuthenticatedRawMediaStorage
+from .routers import TelemetryRouter
+from .storage import FILL_LOCK_STRIPES, CachedMediaStorage
+from .zip_stream import ArchiveEntry, stream_zip
+from .admin import PaymentAdmin
+from .models import (
+    Classes, DownloadHistory, DownloadRollup, MediaBlob, Payment, PaymentItem, PreviewImage, QuestionPaper, SmsMessage,
+    StorageDeletion, Subject, Term, UserAgent,
+)
+
+# Real user agents seen on the site and in the wild
+HUMAN_USER_AGENTS = [
+    # Android Chrome, including budget phones common locally
+    'Mozilla/5.0 (Linux; Android 10; K) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36',
+    'Mozilla/5.0 (Linux; Android 11; TECNO KE5) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.5735.196 Mobile Safari/537.36',
+    'Mozilla/5.0 (Linux; Android 12; Infinix X6816) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.6045.163 Mobile Safari/537.36',
+    'Mozilla/5.0 (Linux; Android 9; CUBOT X19) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.104 Mobile Safari/537.36',
+    'Mozilla/5.0 (Linux; Android 13; SM-A145F) AppleWebKit/537.36 (KHTML, like Gecko) SamsungBrowser/23.0 Chrome/115.0.0.0 Mobile Safari/537.36',
+    'Opera/9.80 (Android; Opera Mini/36.2.2254/191.256; U; en) Presto/2.12.423 Version/12.16',
+    # iPhone Safari and desktop browsers
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.1 Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36 Edg/120.0.0.0',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.1 Safari/605.1.15',
+    'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:121.0) Gecko/20100101 Firefox/121.0',
+    # In-app browsers
+    'Mozilla/5.0 (Linux; Android 13; SM-A536B Build/TP1A.220624.014; wv) AppleWebKit/537.36 (KHTML, like Gecko) Version/4.0 Chrome/119.0.6045.163 Mobile Safari/537.36 [FB_IAB/FB4A;FBAV/443.0.0.31.110;]',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 16_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148 [FBAN/FBIOS;FBDV/iPhone12,1;FBMD/iPhone;FBSN/iOS;FBSV/16.6;FBSS/2;FBID/phone;FBLC/en_US;FBOP/5]',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148 Instagram 307.0.0.21.111 (iPhone13,2; iOS 17_0; en_US; en; scale=3.00; 1170x2532; 531328515)',
+    'Mozilla/5.0 (Linux; Android 12; itel A665L Build/SP1A.210812.016; wv) AppleWebKit/537.36 (KHTML, like Gecko) Version/4.0 Chrome/118.0.5993.111 Mobile Safari/537.36 WhatsApp/2.23.24.76',
+]
+
+BOT_USER_AGENTS = [
+    # Link previews
+    'WhatsApp/2.23.20.0 A',
+    'WhatsApp/2.2349.52 i',
+    'facebookexternalhit/1.1 (+http://www.facebook.com/externalhit_uatext.php)',
+    'facebookcatalog/1.0',
+    'meta-externalagent/1.1 (+https://developers.facebook.com/docs/sharing/webmasters/crawler)',
+    'TelegramBot (like TwitterBot)',
+    'Twitterbot/1.0',
+    'LinkedInBot/1.0 (compatible; Mozilla/5.0; Apache-HttpClient +http://www.linkedin.com)',
+    'Slackbot-LinkExpanding 1.0 (+https://api.slack.com/robots)',
+    'Mozilla/5.0 (compatible; Discordbot/2.0; +https://discordapp.com)',
+    'Mozilla/5.0 (Windows NT 6.1; WOW64) SkypeUriPreview Preview/0.5 skype-url-preview@microsoft.com',
+    # Search engines and SEO crawlers
+    'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+    'Mozilla/5.0 (Linux; Android 6.0.1; Nexus 5X Build/MMB29P) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.6099.129 Mobile Safari/537.36 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+    'Mozilla/5.0 AppleWebKit/537.36 (KHTML, like Gecko; compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm) Chrome/116.0.1938.76 Safari/537.36',
+    'Mozilla/5.0 (compatible; YandexBot/3.0; +http://yandex.com/bots)',
+    'Mozilla/5.0 (compatible; Baiduspider/2.0; +http://www.baidu.com/search/spider.html)',
+    'DuckDuckBot/1.1; (+http://duckduckgo.com/duckduckbot.html)',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_5) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/13.1.1 Safari/605.1.15 (Applebot/0.1; +http://www.apple.com/go/applebot)',
+    'Mozilla/5.0 (compatible; AhrefsBot/7.0; +http://ahrefs.com/robot/)',
+    'Mozilla/5.0 (compatible; SemrushBot/7~bl; +http://www.semrush.com/bot.html)',
+    'Mozilla/5.0 (Linux; Android 7.0;) AppleWebKit/537.36 (KHTML, like Gecko) Mobile Safari/537.36 (compatible; PetalBot;+https://webmaster.petalsearch.com/site/petalbot)',
+    'Mozilla/5.0 (compatible; Yahoo! Slurp; http://help.yahoo.com/help/us/ysearch/slurp)',
+    'Mozilla/5.0 AppleWebKit/537.36 (KHTML, like Gecko; compatible; GPTBot/1.0; +https://openai.com/gptbot)',
+    # Headless browsers, audits and scripts
+    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) HeadlessChrome/120.0.6099.109 Safari/537.36',
+    'Mozilla/5.0 (Linux; Android 11; moto g power (2022)) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Mobile Safari/537.36 Chrome-Lighthouse',
+    'python-requests/2.31.0',
+    'curl/8.4.0',
+    'Wget/1.21.4',
+    'Go-http-client/1.1',
+    'Java/17.0.9',
+    'axios/1.6.2',
+    '',
+    '   ',
+]
+
+
+class UserAgentTests(SimpleTestCase):
+    def test_people_are_human(self):
+        for user_agent in HUMAN_USER_AGENTS:
+            with self.subTest(user_agent=user_agent):
+                self.assertFalse(useragents.is_bot(user_agent))
+
+    def test_bots_are_bots(self):
+        for user_agent in BOT_USER_AGENTS:
+            with self.subTest(user_agent=user_agent):
+                self.assertTrue(useragents.is_bot(user_agent))
+
+    def test_prefetches_are_not_counted(self):
+        factory = RequestFactory()
+        browser = HUMAN_USER_AGENTS[0]
+        self.assertTrue(useragents.is_human(factory.get('/', HTTP_USER_AGENT=browser)))
+        for header, value in [
+            ('HTTP_SEC_PURPOSE', 'prefetch'),
+            ('HTTP_SEC_PURPOSE', 'prefetch;prerender'),
+            ('HTTP_PURPOSE', 'prefetch'),
+            ('HTTP_X_MOZ', 'prefetch'),
+            ('HTTP_X_PURPOSE', 'preview'),
+        ]:
+            with self.subTest(header=header, value=value):
+                request = factory.get('/', HTTP_USER_AGENT=browser, **{header: value})
+                self.assertTrue(useragents.is_prefetch(request))
+                self.assertFalse(useragents.is_human(request))
+
+    def test_parse(self):
+        expected = {
+            HUMAN_USER_AGENTS[0]: ('Chrome', 'Android', 'mobile'),
+            HUMAN_USER_AGENTS[3]: ('Chrome', 'Android', 'mobile'),
+            HUMAN_USER_AGENTS[4]: ('Samsung Internet', 'Android', 'mobile'),
+            HUMAN_USER_AGENTS[5]: ('Opera Mini', 'Android', 'mobile'),
+            HUMAN_USER_AGENTS[6]: ('Safari', 'iOS', 'mobile'),
+            HUMAN_USER_AGENTS[7]: ('Chrome', 'Windows', 'desktop'),
+            HUMAN_USER_AGENTS[8]: ('Edge', 'Windows', 'desktop'),
+            HUMAN_USER_AGENTS[9]: ('Safari', 'macOS', 'desktop'),
+            HUMAN_USER_AGENTS[10]: ('Firefox', 'Linux', 'desktop'),
+            HUMAN_USER_AGENTS[11]: ('Facebook', 'Android', 'mobile'),
+            HUMAN_USER_AGENTS[12]: ('Facebook', 'iOS', 'mobile'),
+            HUMAN_USER_AGENTS[13]: ('Instagram', 'iOS', 'mobile'),
+            HUMAN_USER_AGENTS[14]: ('WhatsApp', 'Android', 'mobile'),
+            'Mozilla/5.0 (Linux; Android 13; SM-X200) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36': ('Chrome', 'Android', 'tablet'),
+            'Mozilla/5.0 (iPad; CPU OS 16_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) CriOS/119.0.6045.169 Mobile/15E148 Safari/604.1': ('Chrome', 'iOS', 'tablet'),
+            BOT_USER_AGENTS[11]: ('Bot', 'Other', 'bot'),
+            '': ('Unknown', 'Unknown', 'unknown'),
+        }
+        for user_agent, parsed in expected.items():
+            with self.subTest(user_agent=user_agent):
+                self.assertEqual(tuple(useragents.parse(user_agent)), parsed)
+
+
+def make_paper(title='Mathematics', price='5.00', **kwargs):
+    class_level, _ = Classes.objects.get_or_create(slug='jhs-1', defaults={'name': 'JHS 1'})
+    term, _ = Term.objects.get_or_create(class_name=class_level, slug='term-1', defaults={'name': 'Term 1'})
+    subject, _ = Subject.objects.get_or_create(slug=title.lower(), defaults={'name': title})
+    fields = {'is_paid': True, 'pdf_file': f'question_papers/{subject.slug}.pdf'}
+    fields.update(kwargs)
+    return QuestionPaper.objects.create(
+        title=title, class_level=class_level, term=term, subject=subject, price=Decimal(price), **fields
+    )
+
+
+@override_settings(PENDING_CHECKOUT_REUSE_SECONDS=900)
+class PendingCheckoutTests(TestCase):
+    def setUp(self):
+        self.maths = make_paper('Mathematics')
+        self.science = make_paper('Science', price='7.50')
+
+    def make_bundle(self, papers, email='ama@example.com', phone_number='0240000000'):
+        payment = Payment.objects.create(
+            email=email, phone_number=phone_number, authorization_url='https://checkout.paystack.com/abc'
+        )
+        PaymentItem.objects.bulk_create([
+            PaymentItem(payment=payment, question_paper=paper, price=paper.price) for paper in papers
+        ])
+        return payment
+
+    def test_single_paper_checkout_is_reused(self):
+        payment = Payment.objects.create(
+            question_paper=self.maths, email='ama@example.com', phone_number='0240000000',
+            authorization_url='https://checkout.paystack.com/abc',
+        )
+        self.assertEqual(Payment.find_pending_checkout(self.maths, 'AMA@example.com', '0240000000'), payment)
+        self.assertIsNone(Payment.find_pending_checkout(self.science, 'ama@example.com', '0240000000'))
+
+    def test_bundle_checkout_is_reused_for_the_same_papers(self):
+        bundle = self.make_bundle([self.maths, self.science])
+        self.assertEqual(
+            Payment.find_pending_bundle_checkout([self.science, self.maths], 'ama@example.com', '0240000000'),
+            bundle,
+        )
+
+    def test_bundle_checkout_needs_the_same_papers_and_customer(self):
+        self.make_bundle([self.maths, self.science])
+        self.assertIsNone(Payment.find_pending_bundle_checkout([self.maths], 'ama@example.com', '0240000000'))
+        self.assertIsNone(
+            Payment.find_pending_bundle_checkout([self.maths, self.science], 'kofi@example.com', '0240000000')
+        )
+
+    def test_verified_or_expired_bundles_are_not_reused(self):
+        bundle = self.make_bundle([self.maths, self.science])
+        with self.settings(PENDING_CHECKOUT_REUSE_SECONDS=0):
+            self.assertIsNone(
+                Payment.find_pending_bundle_checkout([self.maths, self.science], 'ama@example.com', '0240000000')
+            )
+        Payment.objects.filter(pk=bundle.pk).update(verified=True)
+        self.assertIsNone(
+            Payment.find_pending_bundle_checkout([self.maths, self.science], 'ama@example.com', '0240000000')
+        )
+
+
+class PaymentAdminTests(TestCase):
+    def test_items_added_in_the_admin_take_the_paper_price(self):
+        paper = make_paper('Science', price='7.50')
+        payment = Payment.objects.create(email='ama@example.com')
+        model_admin = PaymentAdmin(Payment, AdminSite())
+        request = RequestFactory().post('/')
+        request.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        formset_class = model_admin.get_inline_instances(request)[0].get_formset(request, payment)
+        formset = formset_class({
+            'items-TOTAL_FORMS': '1', 'items-INITIAL_FORMS': '0',
+            'items-0-question_paper': str(paper.pk),
+        }, instance=payment, prefix='items')
+        self.assertTrue(formset.is_valid(), formset.errors)
+        model_admin.save_formset(request, None, formset, change=True)
+        self.assertEqual(payment.items.get().price, Decimal('7.50'))
+
+
+@override_settings(PAYMENT_STATUS_POLL_INTERVAL=0.01)
+class PaymentStatusTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.payment = Payment.objects.create(question_paper=make_paper(), email='ama@example.com')
+        self.url = reverse('shop:payment_status_api', args=[self.payment.ref])
+
+    def test_reports_pending_and_verified(self):
+        self.assertEqual(self.client.get(self.url).json()['status'], 'pending')
+        self.payment.mark_as_verified(transaction_id='T1')
+        response = self.client.get(self.url)
+        self.assertEqual(response.json(), {'reference': self.payment.ref, 'status': 'verified', 'verified': True})
+
+    def test_unknown_reference(self):
+        response = self.client.get(reverse('shop:payment_status_api', args=['NOPE']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_pending_is_not_cached_for_long(self):
+        with self.settings(PAYMENT_PENDING_STATUS_CACHE_SECONDS=0):
+            cache.clear()
+            self.assertEqual(self.client.get(self.url).json()['status'], 'pending')
+            # A write this process's cache never saw, e.g. from another worker
+            Payment.objects.filter(pk=self.payment.pk).update(verified=True)
+            self.assertEqual(self.client.get(self.url).json()['status'], 'verified')
+
+    def test_long_poll_gives_up_at_the_deadline(self):
+        response = self.client.get(self.url, {'wait': '0.05'})
+        self.assertEqual(response.json()['status'], 'pending')
+
+    async def test_event_stream(self):
+        with self.settings(PAYMENT_STATUS_MAX_WAIT_SECONDS=0):
+            response = await self.async_client.get(self.url, headers={'Accept': 'text/event-stream'})
+            body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertIn('"status": "pending"', body)
+
+
+class FileServingTests(SimpleTestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.pdf')
+        self.content = bytes(range(256)) * 5000
+        with os.fdopen(handle, 'wb') as f:
+            f.write(self.content)
+        self.addCleanup(os.remove, self.path)
+
+    def test_parse_range(self):
+        self.assertEqual(file_serving.parse_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(file_serving.parse_range('bytes=900-', 1000), (900, 999))
+        self.assertEqual(file_serving.parse_range('bytes=-100', 1000), (900, 999))
+        self.assertEqual(file_serving.parse_range('bytes=500-5000', 1000), (500, 999))
+        self.assertIsNone(file_serving.parse_range('bytes=0-1,5-9', 1000))
+        self.assertIsNone(file_serving.parse_range('', 1000))
+        self.assertFalse(file_serving.parse_range('bytes=1000-', 1000))
+        self.assertFalse(file_serving.parse_range('bytes=-0', 1000))
+
+    def test_range_and_if_range(self):
+        response = file_serving.stream_file(RequestFactory().get('/'), self.path, 'paper.pdf')
+        etag = response['ETag']
+        request = RequestFactory().get('/', HTTP_RANGE='bytes=1000-1999', HTTP_IF_RANGE=etag)
+        response = file_serving.stream_file(request, self.path, 'paper.pdf')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 1000-1999/{len(self.content)}')
+        self.assertEqual(b''.join(response), self.content[1000:2000])
+        # The file changed since: send it whole
+        request = RequestFactory().get('/', HTTP_RANGE='bytes=1000-1999', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(file_serving.stream_file(request, self.path, 'paper.pdf').status_code, 200)
+
+    async def test_asgi_responses_stream_asynchronously(self):
+        factory = AsyncRequestFactory()
+        for headers, expected in [({}, self.content), ({'Range': 'bytes=10-299999'}, self.content[10:300000])]:
+            with self.subTest(headers=headers):
+                response = file_serving.stream_file(factory.get('/', headers=headers), self.path, 'paper.pdf')
+                self.assertTrue(response.is_async)
+                chunks = [chunk async for chunk in response.streaming_content]
+                self.assertGreater(len(chunks), 1)
+                self.assertEqual(b''.join(chunks), expected)
+                self.assertEqual(int(response['Content-Length']), len(expected))
+
+
+class ZipStreamTests(SimpleTestCase):
+    def entries(self):
+        files = {'maths.pdf': b'%PDF maths' * 40000, 'science.pdf': b'%PDF science' * 10}
+        return [
+            ArchiveEntry(name, File(io.BytesIO(data), name=name), len(data), None, f'/download/{name}')
+            for name, data in files.items()
+        ], files
+
+    def test_archive_holds_the_manifest_and_every_file(self):
+        entries, files = self.entries()
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(stream_zip('Term 1', entries))))
+        self.assertEqual(archive.namelist(), ['manifest.json', 'maths.pdf', 'science.pdf'])
+        for name, data in files.items():
+            self.assertEqual(archive.read(name), data)
+        manifest = json.loads(archive.read('manifest.json'))
+        self.assertEqual([entry['included'] for entry in manifest['entries']], [True, True])
+
+    def test_start_skips_entries_already_received(self):
+        entries, _ = self.entries()
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(stream_zip('Term 1', entries, start=1))))
+        self.assertEqual(archive.namelist(), ['manifest.json', 'science.pdf'])
+        manifest = json.loads(archive.read('manifest.json'))
+        self.assertEqual([entry['included'] for entry in manifest['entries']], [False, True])
+
+
+@override_settings(
+    SMS_BACKEND='shop.sms.InMemoryBackend', SMS_MAX_ATTEMPTS=3, SMS_RETRY_BACKOFF_SECONDS=0,
+    SMS_DEDUPE_SECONDS=60, SMS_THROTTLE_MAX_PER_WINDOW=2, SMS_THROTTLE_WINDOW_SECONDS=60,
+)
+class SmsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        sms.InMemoryBackend.outbox = []
+        sms.InMemoryBackend.fail_times = 0
+
+    async def test_duplicates_are_sent_once(self):
+        first = await sms.asend_sms('0240000000', 'Your password', dedupe_key='password:ABC')
+        second = await sms.asend_sms('0240000000', 'Your password', dedupe_key='password:ABC')
+        self.assertEqual(second.pk, first.pk)
+        self.assertEqual(len(sms.InMemoryBackend.outbox), 1)
+        # A resend has its own key, so the first send doesn't swallow it
+        resend = await sms.asend_sms('0240000000', 'Your password', dedupe_key='password-resend:ABC')
+        self.assertEqual(resend.status, SmsMessage.STATUS_SENT)
+        self.assertEqual(len(sms.InMemoryBackend.outbox), 2)
+
+    async def test_retryable_failures_are_retried(self):
+        sms.InMemoryBackend.fail_times = 2
+        message = await sms.asend_sms('0240000000', 'Your password')
+        self.assertEqual(message.status, SmsMessage.STATUS_SENT)
+        self.assertEqual(message.attempts, 3)
+
+    async def test_gives_up_after_max_attempts(self):
+        sms.InMemoryBackend.fail_times = 3
+        with self.assertLogs('shop.sms', 'WARNING'):
+            message = await sms.asend_sms('0240000000', 'Your password', dedupe_key='password:ABC')
+        self.assertEqual(message.status, SmsMessage.STATUS_FAILED)
+        self.assertEqual(sms.InMemoryBackend.outbox, [])
+        # A failed send doesn't hold the dedupe key
+        retry = await sms.asend_sms('0240000000', 'Your password', dedupe_key='password:ABC')
+        self.assertEqual(retry.status, SmsMessage.STATUS_SENT)
+
+    async def test_numbers_are_throttled(self):
+        statuses = [(await sms.asend_sms('0240000000', f'Message {n}')).status for n in range(3)]
+        self.assertEqual(statuses, [SmsMessage.STATUS_SENT, SmsMessage.STATUS_SENT, SmsMessage.STATUS_THROTTLED])
+        other = await sms.asend_sms('0550000000', 'Message')
+        self.assertEqual(other.status, SmsMessage.STATUS_SENT)
+
+    async def test_identical_texts_are_batched(self):
+        messages = [
+            await SmsMessage.objects.acreate(phone_number=f'02400000{n:02}', body='Same text')
+            for n in range(3)
+        ]
+        messages.append(await SmsMessage.objects.acreate(phone_number='0550000000', body='Other text'))
+        await sms.adispatch(messages)
+        batches = sorted(sms.InMemoryBackend.outbox, key=lambda send: len(send['recipients']))
+        self.assertEqual([len(send['recipients']) for send in batches], [1, 3])
+        self.assertTrue(all(message.status == SmsMessage.STATUS_SENT for message in messages))
+
+    def test_flush_retries_failed_and_stale_pending_only(self):
+        failed = SmsMessage.objects.create(phone_number='0240000001', body='Hi', status=SmsMessage.STATUS_FAILED)
+        in_flight = SmsMessage.objects.create(phone_number='0240000002', body='Hi')
+        abandoned = SmsMessage.objects.create(phone_number='0240000003', body='Hi')
+        SmsMessage.objects.filter(pk=abandoned.pk).update(created_at=timezone.now() - timedelta(minutes=30))
+        call_command('flush_sms', stdout=io.StringIO())
+        self.assertEqual(sms.InMemoryBackend.outbox, [{'recipients': ['0240000003', '0240000001'], 'body': 'Hi'}])
+        in_flight.refresh_from_db()
+        self.assertEqual(in_flight.status, SmsMessage.STATUS_PENDING)
+        failed.refresh_from_db()
+        self.assertEqual(failed.status, SmsMessage.STATUS_SENT)
+
+
+class TokenTests(TestCase):
+    def setUp(self):
+        self.paper = make_paper()
+        self.payment = Payment.objects.create(question_paper=self.paper, email='ama@example.com', verified=True)
+
+    def test_download_token_round_trip(self):
+        grant = tokens.read_download_token(tokens.make_download_token(self.paper, self.payment), self.paper)
+        self.assertEqual((grant.paper_id, grant.payment_id, grant.email), (self.paper.pk, self.payment.pk, 'ama@example.com'))
+
+    def test_download_token_is_bound_to_its_paper(self):
+        other = make_paper('Science')
+        self.assertIsNone(tokens.read_download_token(tokens.make_download_token(self.paper, self.payment), other))
+
+    def test_tampered_and_expired_tokens_are_rejected(self):
+        token = tokens.make_download_token(self.paper, self.payment)
+        self.assertIsNone(tokens.read_download_token(token[:-2] + 'xx', self.paper))
+        self.assertIsNone(tokens.read_download_token(tokens.make_download_token(self.paper, self.payment, ttl=-1), self.paper))
+        self.assertIsNone(tokens.read_download_token('', self.paper))
+
+    def test_payment_tokens_are_not_interchangeable(self):
+        access = tokens.make_access_token(self.payment)
+        self.assertIsNotNone(tokens.read_access_token(access, self.payment.ref))
+        self.assertIsNone(tokens.read_archive_token(access, self.payment.ref))
+        self.assertIsNone(tokens.read_access_token(tokens.make_archive_token(self.payment), self.payment.ref))
+        self.assertIsNone(tokens.read_access_token(access, 'OTHERREF'))
+
+
+@override_settings(SMS_BACKEND='shop.sms.InMemoryBackend', SMS_RETRY_BACKOFF_SECONDS=0)
+class DownloadAccessTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        sms.InMemoryBackend.outbox = []
+        sms.InMemoryBackend.fail_times = 0
+        self.paper = make_paper()
+        self.payment = Payment.objects.create(
+            question_paper=self.paper, email='ama@example.com', phone_number='0240000000', verified=True
+        )
+        self.status_url = reverse('shop:payment_status', args=[self.payment.ref])
+        self.download_url = reverse('shop:download_file', args=[self.paper.slug])
+
+    def test_reference_alone_mints_no_tokens(self):
+        self.assertNotContains(self.client.get(self.status_url), '?token=')
+        callback = self.client.get(reverse('shop:payment_callback'), {'reference': self.payment.ref})
+        self.assertNotContains(callback, '?token=')
+        self.assertNotContains(callback, self.paper.password or 'no password set')
+
+    def test_checkout_browser_sees_its_links(self):
+        session = self.client.session
+        session['purchases'] = [self.payment.ref]
+        session.save()
+        self.assertContains(self.client.get(self.status_url), f'{self.download_url}?token=')
+
+    def test_access_link_unlocks_the_downloads(self):
+        response = self.client.get(self.payment.get_access_url())
+        self.assertContains(response, f'{self.download_url}?token=')
+        # Remembered for this browser afterwards
+        self.assertContains(self.client.get(self.status_url), f'{self.download_url}?token=')
+        forged = self.client_class().get(f'{self.status_url}?key=forged')
+        self.assertNotContains(forged, '?token=')
+
+    def test_resend_delivers_a_fresh_access_link_to_the_phone(self):
+        response = self.client.post(reverse('shop:resend_password_api', args=[self.payment.ref]))
+        self.assertEqual(response.status_code, 200)
+        [sent] = sms.InMemoryBackend.outbox
+        self.assertEqual(sent['recipients'], ['0240000000'])
+        access_url = sent['body'].split('Download: ')[1].split()[0]
+        self.assertContains(self.client_class().get(access_url), f'{self.download_url}?token=')
+
+    def test_unverified_payments_get_no_resend(self):
+        Payment.objects.filter(pk=self.payment.pk).update(verified=False)
+        response = self.client.post(reverse('shop:resend_password_api', args=[self.payment.ref]))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(sms.InMemoryBackend.outbox, [])
+
+
+@override_settings(WATERMARK_ENABLED=False, DOWNLOAD_QUOTA_PER_PAPER=2, DOWNLOAD_QUOTA_PER_PAYMENT=0)
+class DownloadQuotaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        storages = override_settings(STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': media_root}},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        })
+        storages.enable()
+        self.addCleanup(storages.disable)
+        os.makedirs(os.path.join(media_root, 'question_papers'))
+        with open(os.path.join(media_root, 'question_papers', 'mathematics.pdf'), 'wb') as f:
+            f.write(b'%PDF-1.4 ' + b'x' * 4096)
+        self.paper = make_paper()
+        payment = Payment.objects.create(question_paper=self.paper, email='ama@example.com', verified=True)
+        self.url = f"{reverse('shop:download_file', args=[self.paper.slug])}?token={tokens.make_download_token(self.paper, payment)}"
+        self.client.defaults['HTTP_USER_AGENT'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0 Safari/537.36'
+        logger = mock.patch.object(DownloadHistory, 'log_download')
+        self.log_download = logger.start()
+        self.addCleanup(logger.stop)
+
+    @override_settings(DOWNLOAD_SERVE_MODE='stream')
+    def test_resuming_a_counted_download_is_free(self):
+        etag = self.client.get(self.url)['ETag']
+        for _ in range(3):
+            response = self.client.get(self.url, HTTP_RANGE='bytes=100-', HTTP_IF_RANGE=etag)
+            self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.log_download.call_count, 1)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertEqual(self.client.get(self.url).status_code, 429)
+
+    @override_settings(DOWNLOAD_SERVE_MODE='stream')
+    def test_ranges_that_resume_nothing_are_counted(self):
+        etag = file_serving.stream_etag(self.paper.pdf_file)
+        # Nothing was counted yet to continue, then no If-Range
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=1-', HTTP_IF_RANGE=etag).status_code, 206)
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=1-').status_code, 206)
+        # Starting at byte 0 is a new download
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-', HTTP_IF_RANGE=etag).status_code, 429)
+        self.assertEqual(self.log_download.call_count, 2)
+
+    @override_settings(DOWNLOAD_SERVE_MODE='redirect')
+    def test_range_is_ignored_when_not_streaming(self):
+        with mock.patch('shop.views.resolve_media_url', return_value='https://cdn.example.com/paper.pdf'):
+            self.assertEqual(self.client.get(self.url).status_code, 302)
+            for _ in range(2):
+                response = self.client.get(self.url, HTTP_RANGE='bytes=1-', HTTP_IF_RANGE='"anything"')
+            self.assertEqual(response.status_code, 429)
+        self.assertEqual(self.log_download.call_count, 2)
+
+
+class RateLimitTests(TestCase):
+    databases = {'default', 'telemetry'}
+
+    def setUp(self):
+        cache.clear()
+        ratelimit._local.clear()
+
+    def test_parse_rate(self):
+        self.assertEqual(ratelimit.parse_rate('5/m'), (5, 5 / 60))
+        self.assertEqual(ratelimit.parse_rate('10/15m'), (10, 10 / 900))
+        for rate in ['', '0', '0/h']:
+            self.assertIsNone(ratelimit.parse_rate(rate))
+        for rate in ['5', '5/', '5/0m', '5/w', 'five/h']:
+            with self.subTest(rate=rate), self.assertRaises(ImproperlyConfigured):
+                ratelimit.parse_rate(rate)
+
+    @override_settings(RATE_LIMIT_CONTACT_IP='5')
+    def test_malformed_rates_fail_the_startup_check(self):
+        with self.assertRaisesMessage(ImproperlyConfigured, 'RATE_LIMIT_CONTACT_IP'):
+            ratelimit.check_rates()
+
+    def test_client_ip_ignores_hops_the_client_sets(self):
+        request = RequestFactory().get('/', REMOTE_ADDR='10.0.0.2', HTTP_X_FORWARDED_FOR='6.6.6.6, 41.0.0.7')
+        with override_settings(TRUSTED_PROXY_COUNT=0):
+            self.assertEqual(quotas.client_ip(request), '10.0.0.2')
+        with override_settings(TRUSTED_PROXY_COUNT=1):
+            self.assertEqual(quotas.client_ip(request), '41.0.0.7')
+        with override_settings(TRUSTED_PROXY_COUNT=3):
+            self.assertEqual(quotas.client_ip(request), '10.0.0.2')
+
+    @override_settings(RATE_LIMIT_CONTACT_IP='1/h', TRUSTED_PROXY_COUNT=1)
+    def test_forged_forwarded_for_shares_the_bucket(self):
+        url = reverse('shop:contact_us')
+        self.client.post(url, HTTP_X_FORWARDED_FOR='1.1.1.1, 41.0.0.7')
+        response = self.client.post(url, HTTP_X_FORWARDED_FOR='2.2.2.2, 41.0.0.7')
+        self.assertEqual(response.status_code, 429)
+
+    @override_settings(RATE_LIMIT_CHECKOUT_PHONE='1/h')
+    def test_checkouts_are_limited_per_phone_number(self):
+        paper = make_paper()
+        url = reverse('shop:buy_paper', args=[paper.slug])
+        self.assertEqual(self.client.post(url, {'phone_number': '0240000000'}).status_code, 200)
+        response = self.client.post(url, {'phone_number': '0240000000'}, REMOTE_ADDR='10.9.9.9')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(self.client.post(url, {'phone_number': '0550000000'}).status_code, 200)
+
+
+@override_settings(DOWNLOAD_LOG_BATCH_SIZE=1000)
+class DownloadLogTests(TestCase):
+    databases = {'default', 'telemetry'}
+
+    def setUp(self):
+        spill_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spill_dir)
+        spill_settings = override_settings(DOWNLOAD_LOG_SPILL_DIR=spill_dir)
+        spill_settings.enable()
+        self.addCleanup(spill_settings.disable)
+        self.spill_dir = spill_dir
+        timer = mock.patch.object(download_log, '_start_timer')
+        timer.start()
+        self.addCleanup(timer.stop)
+        self.addCleanup(self.reset_buffer)
+        self.reset_buffer()
+
+    def reset_buffer(self):
+        with download_log._lock:
+            download_log._buffer.clear()
+            if download_log._spill_file is not None:
+                download_log._spill_file.close()
+                download_log._spill_file = None
+
+    def spilled(self):
+        return sorted(os.listdir(self.spill_dir))
+
+    def test_events_are_spilled_then_written_in_one_batch(self):
+        download_log.record(7, email='a@example.com', user_agent='Mozilla/5.0')
+        download_log.record(7, payment_id=3, user_agent='Mozilla/5.0')
+        self.assertEqual(DownloadHistory.objects.count(), 0)
+        self.assertEqual(self.spilled(), [os.path.basename(download_log._spill_path())])
+
+        self.assertEqual(download_log.flush(), 2)
+        self.assertEqual(DownloadHistory.objects.filter(paper_id=7).count(), 2)
+        self.assertEqual(UserAgent.objects.count(), 1)
+        self.assertEqual(self.spilled(), [])
+
+    def test_failed_flush_keeps_events_on_disk_for_recovery(self):
+        download_log.record(7)
+        with mock.patch.object(download_log, 'write_events', side_effect=RuntimeError('database is locked')), \
+                self.assertLogs('shop.download_log', 'ERROR'):
+            self.assertEqual(download_log.flush(), 0)
+        self.assertEqual(len(self.spilled()), 1)
+        self.assertEqual(download_log.pending_count(), 0)
+
+        self.assertEqual(download_log.flush(), 1)
+        self.assertEqual(DownloadHistory.objects.count(), 1)
+        self.assertEqual(self.spilled(), [])
+
+    def test_spill_files_of_an_earlier_process_with_this_pid_survive(self):
+        # Left by a crashed process that had this PID, under the old and the current naming
+        for name, paper_id in [(f'downloads-{os.getpid()}.jsonl', 5), (f'downloads-{os.getpid()}-0123456789ab.jsonl', 6)]:
+            download_log.record(paper_id)
+            events, path = download_log._take_batch()
+            os.replace(path, os.path.join(self.spill_dir, name))
+        download_log.record(7)
+        self.assertEqual(download_log.flush(), 3)
+        self.assertEqual(sorted(DownloadHistory.objects.values_list('paper_id', flat=True)), [5, 6, 7])
+        self.assertEqual(self.spilled(), [])
+
+    def test_flush_writes_what_the_spill_file_holds(self):
+        download_log.record(7)
+        # Written to the file, but not in the buffer
+        with open(download_log._spill_path(), 'a', encoding='utf-8') as f:
+            f.write(json.dumps({
+                'event_id': uuid.uuid4().hex, 'paper_id': 8, 'payment_id': None, 'user_email': None,
+                'ip_address': None, 'user_agent': '', 'downloaded_at': timezone.now().isoformat(),
+            }) + '\n')
+        self.assertEqual(download_log.flush(), 2)
+        self.assertEqual(sorted(DownloadHistory.objects.values_list('paper_id', flat=True)), [7, 8])
+
+    def test_recovery_skips_events_already_written(self):
+        download_log.record(7)
+        download_log.record(8)
+        events, path = download_log._take_batch()
+        download_log.write_events(events[:1])
+        # Left by a process that died before removing it
+        os.replace(path, os.path.join(self.spill_dir, 'downloads-999999999.jsonl'))
+        self.assertEqual(download_log.recover(), 1)
+        self.assertEqual(sorted(DownloadHistory.objects.values_list('paper_id', flat=True)), [7, 8])
+
+
+class DownloadArchiveTests(TestCase):
+    databases = {'default', 'telemetry'}
+
+    def setUp(self):
+        archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_dir)
+        archive_settings = override_settings(DOWNLOAD_ARCHIVE_DIR=archive_dir, DOWNLOAD_RETENTION_DAYS=30)
+        archive_settings.enable()
+        self.addCleanup(archive_settings.disable)
+        self.old = timezone.now() - timedelta(days=40)
+        agent = UserAgent.objects.create(digest='x' * 64, string='Mozilla/5.0', browser='Other', os='Other', device='desktop')
+        for paper_id, payment_id, when in [(7, None, self.old), (7, 3, self.old), (8, None, self.old), (7, None, timezone.now())]:
+            DownloadHistory.objects.create(paper_id=paper_id, payment_id=payment_id, downloaded_at=when, user_agent=agent)
+
+    def test_old_rows_move_into_rollups_and_the_archive(self):
+        self.assertEqual(DownloadHistory.total(paper_id=7), 3)
+        self.assertEqual(download_archive.archive_batch(download_archive.cutoff(), batch_size=2), 2)
+        self.assertEqual(download_archive.archive_batch(download_archive.cutoff(), batch_size=2), 1)
+        self.assertEqual(download_archive.archive_batch(download_archive.cutoff()), 0)
+
+        self.assertEqual(DownloadHistory.objects.count(), 1)
+        self.assertEqual(DownloadHistory.total(paper_id=7), 3)
+        self.assertEqual(DownloadHistory.total(), 4)
+        day = timezone.localdate(self.old)
+        rollup = DownloadRollup.objects.get(paper_id=7, day=day)
+        self.assertEqual((rollup.downloads, rollup.paid_downloads), (2, 1))
+
+        with gzip.open(download_archive.archive_path(day), 'rt') as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(sorted(row['paper_id'] for row in rows), [7, 7, 8])
+        self.assertEqual({row['user_agent'] for row in rows}, {'Mozilla/5.0'})
+
+    def test_command_dry_run_changes_nothing(self):
+        out = io.StringIO()
+        call_command('archive_downloads', dry_run=True, stdout=out)
+        self.assertIn('3 download(s)', out.getvalue())
+        self.assertEqual(DownloadHistory.objects.count(), 4)
+        call_command('archive_downloads', pause=0, stdout=io.StringIO())
+        self.assertEqual(DownloadHistory.objects.count(), 1)
+
+
+class TelemetryRouterTests(SimpleTestCase):
+    def test_telemetry_models_use_their_own_database(self):
+        router = TelemetryRouter()
+        self.assertEqual(router.db_for_write(DownloadHistory), 'telemetry')
+        self.assertEqual(router.db_for_read(UserAgent), 'telemetry')
+        self.assertIsNone(router.db_for_read(Payment))
+        self.assertTrue(router.allow_migrate('telemetry', 'shop', 'downloadrollup'))
+        self.assertFalse(router.allow_migrate('default', 'shop', 'downloadhistory'))
+        self.assertTrue(router.allow_migrate('default', 'shop', 'payment'))
+        self.assertFalse(router.allow_migrate('telemetry', 'shop', None))
+        self.assertFalse(router.allow_relation(DownloadHistory(), Payment()))
+
+    @override_settings(TELEMETRY_DATABASE='default')
+    def test_one_database_when_telemetry_is_default(self):
+        router = TelemetryRouter()
+        self.assertEqual(router.db_for_write(DownloadHistory), 'default')
+        self.assertIsNone(router.allow_migrate('default', 'shop', 'downloadhistory'))
+        self.assertTrue(router.allow_relation(DownloadHistory(), Payment()))
+
+
+class MoveTelemetryTests(TestCase):
+    databases = {'default', 'telemetry'}
+
+    def setUp(self):
+        # The table as an upgraded site still has it in the main database: migrations
+        # for it stopped running there once the router was on
+        with connections['default'].cursor() as cursor:
+            cursor.execute(
+                'CREATE TABLE "shop_downloadhistory" ("id" integer NOT NULL PRIMARY KEY, '
+                '"paper_id" bigint NOT NULL, "payment_id" bigint NULL, "user_email" varchar(254) NULL, '
+                '"ip_address" char(39) NULL, "user_agent" text NOT NULL, "downloaded_at" datetime NOT NULL)'
+            )
+            cursor.executemany(
+                'INSERT INTO "shop_downloadhistory" VALUES (%s, %s, %s, %s, %s, %s, %s)', [
+                    (1, 7, None, 'a@example.com', '10.0.0.1', 'Mozilla/5.0 (Windows NT 10.0) Chrome/120.0', '2025-03-01 10:00:00'),
+                    (2, 7, 3, 'b@example.com', '10.0.0.2', '', '2025-03-02 10:00:00'),
+                    (3, 8, 4, 'c@example.com', None, 'Mozilla/5.0 (Windows NT 10.0) Chrome/120.0', '2025-03-03 10:00:00'),
+                ]
+            )
+
+    def test_moves_rows_from_the_legacy_schema(self):
+        call_command('move_telemetry', batch_size=2, stdout=io.StringIO())
+        moved = list(DownloadHistory.objects.select_related('user_agent').order_by('pk'))
+        self.assertEqual([(row.pk, row.paper_id, row.payment_id) for row in moved], [(1, 7, None), (2, 7, 3), (3, 8, 4)])
+        self.assertEqual(moved[0].downloaded_at.isoformat(), '2025-03-01T10:00:00+00:00')
+        self.assertEqual(moved[0].user_agent.string, 'Mozilla/5.0 (Windows NT 10.0) Chrome/120.0')
+        self.assertEqual(moved[2].user_agent_id, moved[0].user_agent_id)
+        self.assertIsNone(moved[1].user_agent)
+        with connections['default'].cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM "shop_downloadhistory"')
+            self.assertEqual(cursor.fetchone(), (0,))
+
+    def test_rerun_after_an_interrupted_copy_adds_nothing_twice(self):
+        DownloadHistory.objects.create(pk=1, paper_id=7, user_email='a@example.com')
+        call_command('move_telemetry', stdout=io.StringIO())
+        call_command('move_telemetry', stdout=io.StringIO())
+        self.assertEqual(DownloadHistory.objects.count(), 3)
+        self.assertEqual(DownloadHistory.total(paper_id=7), 2)
+
+
+class SignedMediaUrlTests(SimpleTestCase):
+    def setUp(self):
+        media_urls.url_cache.clear()
+        self.addCleanup(media_urls.url_cache.clear)
+        self.storage = AuthenticatedRawMediaStorage()
+
+    def test_urls_are_signed_cdn_urls(self):
+        url = self.storage.signed_url('question_papers/maths.pdf')
+        self.assertTrue(url.startswith('https://res.cloudinary.com/'))
+        self.assertIn('/raw/authenticated/s--', url)
+        self.assertTrue(url.endswith('/question_papers/maths.pdf'))
+
+    @override_settings(CLOUDINARY_AUTH_TOKEN_KEY='00112233445566778899aabbccddeeff')
+    def test_urls_expire_with_token_access(self):
+        url = self.storage.signed_url('question_papers/maths.pdf', expires_at=2000000000)
+        self.assertIn('__cld_token__=exp=2000000000', url)
+        # Server-side reads don't expire
+        self.assertNotIn('__cld_token__', self.storage.url('question_papers/maths.pdf'))
+
+    def test_files_are_stored_under_the_name_given(self):
+        with mock.patch('cloudinary.uploader.upload', return_value={'public_id': 'previews/abc.webp'}) as upload:
+            self.assertEqual(self.storage.save('previews/abc.webp', ContentFile(b'RIFF')), 'previews/abc.webp')
+        options = upload.call_args.kwargs
+        self.assertEqual(options['type'], 'authenticated')
+        self.assertIs(options['unique_filename'], False)
+        self.assertIs(options['overwrite'], False)
+
+    def test_resolved_urls_come_from_the_storage(self):
+        field_file = File(io.BytesIO(), name='question_papers/maths.pdf')
+        field_file.storage = self.storage
+        url = media_urls.resolve_media_url(field_file)
+        self.assertIn('/raw/authenticated/s--', url)
+        self.assertIs(media_urls.resolve_media_url(field_file), url)
+
+
+class CachedMediaStorageTests(SimpleTestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.backend = FileSystemStorage(location=os.path.join(root, 'remote'))
+        self.storage = CachedMediaStorage(self.backend, os.path.join(root, 'cache'), max_bytes=2500)
+        for name in ('a.pdf', 'b.pdf', 'c.pdf'):
+            self.backend.save(name, ContentFile(b'x' * 1000))
+
+    def read(self, name):
+        with self.storage.open(name) as f:
+            return f.read()
+
+    def test_reads_fill_the_cache_once(self):
+        self.assertEqual(self.read('a.pdf'), b'x' * 1000)
+        with mock.patch.object(self.backend, 'open', side_effect=AssertionError('read from backend')):
+            self.assertEqual(self.read('a.pdf'), b'x' * 1000)
+
+    def test_least_recently_read_files_are_evicted(self):
+        self.read('a.pdf')
+        self.read('b.pdf')
+        os.utime(self.storage.cache_path('a.pdf'), (1, 1))
+        self.read('c.pdf')
+        self.assertFalse(self.storage.is_cached('a.pdf'))
+        self.assertTrue(self.storage.is_cached('b.pdf'))
+        self.assertTrue(self.storage.is_cached('c.pdf'))
+
+    def test_cache_size_is_tracked_without_walking(self):
+        self.read('a.pdf')
+        with mock.patch('shop.storage.os.walk', side_effect=AssertionError('walked the cache')):
+            self.read('b.pdf')
+            self.storage.evict('b.pdf')
+            self.read('b.pdf')
+        self.assertEqual(self.storage._size, 2000)
+
+    def test_exists_asks_the_backend(self):
+        self.read('a.pdf')
+        # Deleted elsewhere (another process): the cached copy doesn't count
+        self.backend.delete('a.pdf')
+        self.assertFalse(self.storage.exists('a.pdf'))
+
+    def test_fill_locks_are_bounded(self):
+        locks = {id(self.storage._fill_lock(f'paper-{n}.pdf')) for n in range(1000)}
+        self.assertLessEqual(len(locks), FILL_LOCK_STRIPES)
+        self.assertIs(self.storage._fill_lock('paper-1.pdf'), self.storage._fill_lock('paper-1.pdf'))
+
+
+class MediaBlobTests(TestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.backend = FileSystemStorage(location=os.path.join(root, 'remote'))
+        self.storage = CachedMediaStorage(self.backend, os.path.join(root, 'cache'), max_bytes=10000)
+        submit = mock.patch('shop.background.submit')
+        submit.start()
+        self.addCleanup(submit.stop)
+
+    def test_identical_uploads_share_one_blob(self):
+        first = self.storage.save('question_papers/maths.pdf', ContentFile(b'%PDF same'))
+        second = self.storage.save('question_papers/maths-copy.pdf', ContentFile(b'%PDF same'))
+        other = self.storage.save('question_papers/english.pdf', ContentFile(b'%PDF other'))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertEqual(MediaBlob.objects.count(), 2)
+        self.assertEqual(len(self.backend.listdir('question_papers')[1]), 2)
+
+    def test_file_is_released_with_its_last_reference(self):
+        name = self.storage.save('question_papers/maths.pdf', ContentFile(b'%PDF same'))
+        MediaBlob.swap('', name)
+        MediaBlob.swap('', name)
+        MediaBlob.release(name)
+        self.assertEqual(MediaBlob.objects.get(name=name).refcount, 1)
+        self.assertFalse(StorageDeletion.objects.exists())
+        MediaBlob.release(name)
+        self.assertFalse(MediaBlob.objects.filter(name=name).exists())
+        self.assertTrue(StorageDeletion.objects.filter(name=name).exists())
+
+
+@override_settings(CHUNKED_UPLOAD_CHUNK_BYTES=4, DIRECT_UPLOAD_BACKEND='shop.direct_upload.LocalDirectUpload')
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        upload_settings = override_settings(CHUNKED_UPLOAD_DIR=os.path.join(root, 'chunks'), STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': root}},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        })
+        upload_settings.enable()
+        self.addCleanup(upload_settings.disable)
+        self.root = root
+
+    def send(self, session, index, data, checksum=None):
+        checksum = checksum or hashlib.sha256(data).hexdigest()
+        chunked_upload.write_chunk(session, index, checksum, io.BytesIO(data))
+
+    def test_chunks_are_verified_and_assembled_in_order(self):
+        content = b'%PDF-1.4 data'
+        session = chunked_upload.start('shop.questionpaper', 'pdf_file', 'maths.pdf', len(content))
+        self.assertEqual(session.chunk_count, 4)
+        self.send(session, 0, content[:4])
+        with self.assertRaises(direct_upload.DirectUploadError):
+            self.send(session, 2, content[8:12])
+        with self.assertRaises(direct_upload.DirectUploadError):
+            self.send(session, 1, content[4:8], checksum='0' * 64)
+        # A failed chunk is cut off again; the upload resumes from it
+        self.assertEqual(os.path.getsize(session.staging_path), 4)
+        with self.assertRaises(direct_upload.DirectUploadError):
+            chunked_upload.assemble(session)
+        for index in range(1, 4):
+            self.send(session, index, content[index * 4:(index + 1) * 4])
+
+        reference = chunked_upload.assemble(session)
+        name = direct_upload.read_reference(reference, 'shop.questionpaper', 'pdf_file')
+        with open(os.path.join(self.root, name), 'rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertFalse(os.path.exists(session.staging_path))
+        # Completing again returns the same reference without storing twice
+        again = chunked_upload.assemble(session)
+        self.assertEqual(direct_upload.read_reference(again, 'shop.questionpaper', 'pdf_file'), name)
+
+
+class WatermarkTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.text = watermark.footer_text('ama@example.com', 'REF123')
+
+    def make_pdf(self, password=None):
+        from pypdf import PdfWriter
+
+        path = os.path.join(self.root, 'source.pdf')
+        writer = PdfWriter()
+        writer.add_blank_page(width=595, height=842)
+        writer.add_blank_page(width=595, height=842).rotate(90)
+        if password:
+            writer.encrypt(password, algorithm='AES-256')
+        with open(path, 'wb') as f:
+            writer.write(f)
+        return path
+
+    def assert_stamped(self, reader):
+        self.assertEqual(len(reader.pages), 2)
+        for page in reader.pages:
+            self.assertIn('Licensed to ama@example.com', page.extract_text())
+            self.assertIn('Ref REF123', page.extract_text())
+
+    def test_every_page_gets_the_footer(self):
+        from pypdf import PdfReader
+
+        output = os.path.join(self.root, 'stamped.pdf')
+        pages, _ = watermark.stamp_pdf(self.make_pdf(), output, self.text)
+        self.assertEqual(pages, 2)
+        reader = PdfReader(output)
+        self.assertFalse(reader.is_encrypted)
+        self.assert_stamped(reader)
+
+    def test_protected_pdfs_are_stamped_and_keep_their_password(self):
+        from pypdf import PdfReader
+
+        output = os.path.join(self.root, 'stamped.pdf')
+        source = self.make_pdf(password='INSIGHT_1234ABCD')
+        with self.assertRaises(ValueError):
+            watermark.stamp_pdf(source, output, self.text, 'wrong')
+        watermark.stamp_pdf(source, output, self.text, 'INSIGHT_1234ABCD')
+        reader = PdfReader(output)
+        self.assertTrue(reader.is_encrypted)
+        self.assertFalse(reader.decrypt('wrong'))
+        self.assertTrue(reader.decrypt('INSIGHT_1234ABCD'))
+        self.assert_stamped(reader)
+
+
+class PreviewRendererTests(TestCase):
+    def setUp(self):
+        previews._warned_unavailable = False
+        self.addCleanup(setattr, previews, '_warned_unavailable', False)
+
+    def test_pymupdf_renders_the_first_page(self):
+        import fitz
+
+        with fitz.open() as document:
+            document.new_page(width=595, height=842)
+            data = document.tobytes()
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as pdf:
+            pdf.write(data)
+            pdf.flush()
+            image = previews.PyMuPDFRenderer().render(pdf.name, 320)
+        self.assertEqual(image.width, 320)
+        self.assertAlmostEqual(image.height, 453, delta=1)
+
+    def test_pymupdf_opens_protected_pdfs_with_the_password(self):
+        import fitz
+
+        with fitz.open() as document:
+            document.new_page(width=595, height=842)
+            data = document.tobytes(encryption=fitz.PDF_ENCRYPT_AES_256, user_pw='INSIGHT_1234ABCD', owner_pw='owner')
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as pdf:
+            pdf.write(data)
+            pdf.flush()
+            with self.assertRaises(ValueError):
+                previews.PyMuPDFRenderer().render(pdf.name, 320)
+            image = previews.PyMuPDFRenderer().render(pdf.name, 320, 'INSIGHT_1234ABCD')
+        self.assertEqual(image.width, 320)
+
+    @override_settings(PREVIEW_WIDTHS=[80, 160], PREVIEW_FORMATS=['webp'])
+    def test_previews_of_protected_papers_are_rendered(self):
+        import fitz
+
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        storages = override_settings(STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': root}},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        })
+        storages.enable()
+        self.addCleanup(storages.disable)
+        paper = make_paper(checksum='b' * 64, password='INSIGHT_1234ABCD')
+        os.makedirs(os.path.dirname(paper.pdf_file.path))
+        with fitz.open() as document:
+            document.new_page(width=595, height=842)
+            document.save(paper.pdf_file.path, encryption=fitz.PDF_ENCRYPT_AES_256, user_pw=paper.password, owner_pw='owner')
+        previews.render_previews(paper.pk)
+        self.assertEqual(
+            sorted(PreviewImage.objects.filter(source_checksum=paper.checksum).values_list('width', flat=True)), [80, 160]
+        )
+
+    @override_settings(PREVIEW_RENDERER='shop.previews.PdftoppmRenderer')
+    def test_missing_renderer_is_logged_and_skipped(self):
+        paper = make_paper(checksum='a' * 64)
+        with mock.patch('shop.previews.shutil.which', return_value=None):
+            with self.assertLogs('shop.previews', 'WARNING') as logs:
+                previews.render_previews(paper.pk)
+                previews.render_previews(paper.pk)
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('poppler-utils', logs.output[0])
+        self.assertFalse(PreviewImage.objects.exists())
@@ -0,0 +1,108 @@
+# shop/tokens.py
+
+"""
+Signed, expiring download tokens for paid papers.
+
+A token is minted once a payment is verified and carries the paper id, the
+payment id, the customer's email and an expiry timestamp, signed with
+SECRET_KEY (HMAC-SHA256 via django.core.signing). download_file checks the
+signature and expiry without touching the database, so any node sharing
+SECRET_KEY can authorize a download. Archive tokens do the same for the
+ZIP of everything a payment covers.
+
+Knowing a payment reference is not enough to get new tokens. Download
+links are only shown to the browser that started the checkout, or to
+whoever opens the access link (an access token for the payment status
+page) sent to the buyer's phone by SMS at verification and on resend.
+"""
+
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core import signing
+
+DOWNLOAD_TOKEN_SALT = 'shop.download-token'
+ARCHIVE_TOKEN_SALT = 'shop.archive-token'
+ACCESS_TOKEN_SALT = 'shop.access-token'
+
+DownloadGrant = namedtuple('DownloadGrant', ['paper_id', 'payment_id', 'email', 'expires_at'])
+# Archive and access tokens both grant something for a whole payment
+ArchiveGrant = namedtuple('ArchiveGrant', ['payment_ref', 'payment_id', 'email', 'expires_at'])
+
+
+def make_download_token(paper, payment, ttl=None):
+    """Return a URL-safe token allowing ``payment`` to download ``paper`` for ``ttl`` seconds."""
+    if ttl is None:
+        ttl = settings.DOWNLOAD_TOKEN_TTL_SECONDS
+    payload = {
+        'p': paper.pk,
+        'y': payment.pk,
+        'e': payment.email,
+        'x': int(time.time()) + ttl,
+    }
+    return signing.dumps(payload, salt=DOWNLOAD_TOKEN_SALT, compress=True)
+
+
+def read_download_token(token, paper):
+    """
+    Return the DownloadGrant in ``token`` if it is authentic, unexpired and
+    issued for ``paper``; otherwise None.
+    """
+    if not token:
+        return None
+    try:
+        payload = signing.loads(token, salt=DOWNLOAD_TOKEN_SALT)
+        grant = DownloadGrant(payload['p'], payload['y'], payload['e'], payload['x'])
+    except (signing.BadSignature, KeyError, TypeError):
+        return None
+
+    if grant.paper_id != paper.pk or grant.expires_at < time.time():
+        return None
+    return grant
+
+
+def _make_payment_token(payment, salt, ttl):
+    if ttl is None:
+        ttl = settings.DOWNLOAD_TOKEN_TTL_SECONDS
+    payload = {
+        'r': payment.ref,
+        'y': payment.pk,
+        'e': payment.email,
+        'x': int(time.time()) + ttl,
+    }
+    return signing.dumps(payload, salt=salt, compress=True)
+
+
+def _read_payment_token(token, payment_ref, salt):
+    if not token:
+        return None
+    try:
+        payload = signing.loads(token, salt=salt)
+        grant = ArchiveGrant(payload['r'], payload['y'], payload['e'], payload['x'])
+    except (signing.BadSignature, KeyError, TypeError):
+        return None
+
+    if grant.payment_ref != payment_ref or grant.expires_at < time.time():
+        return None
+    return grant
+
+
+def make_archive_token(payment, ttl=None):
+    """Return a token allowing the ZIP of every paper in ``payment`` to be downloaded for ``ttl`` seconds."""
+    return _make_payment_token(payment, ARCHIVE_TOKEN_SALT, ttl)
+
+
+def read_archive_token(token, payment_ref):
+    """Return the ArchiveGrant in ``token`` if it is authentic, unexpired and for ``payment_ref``."""
+    return _read_payment_token(token, payment_ref, ARCHIVE_TOKEN_SALT)
+
+
+def make_access_token(payment, ttl=None):
+    """Return a token that unlocks the download links on ``payment``'s status page for ``ttl`` seconds."""
+    return _make_payment_token(payment, ACCESS_TOKEN_SALT, ttl)
+
+
+def read_access_token(token, payment_ref):
+    """Return the grant in an access token if it is authentic, unexpired and for ``payment_ref``."""
+    return _read_payment_token(token, payment_ref, ACCESS_TOKEN_SALT)
@@ -20,6 +20,20 @@ urlpatterns = [
     # 1.3. Check payment status
     path('payment/status/<str:reference>/', views.payment_status, name='payment_status'),
     
+    # 1.4. Lightweight JSON status (long-poll with ?wait=N, or SSE)
+    path('api/payment-status/<str:reference>/', views.payment_status_api, name='payment_status_api'),
+    
+    # 1.5. Admin direct-to-storage uploads
+    path('api/uploads/ticket/', views.direct_upload_ticket, name='direct_upload_ticket'),
+    path('api/uploads/complete/', views.direct_upload_complete, name='direct_upload_complete'),
+    path('api/uploads/local/<str:ticket>/', views.direct_upload_local, name='direct_upload_local'),
+    
+    # 1.6. Chunked, resumable admin uploads for large files
+    path('api/uploads/chunked/', views.chunked_upload_start, name='chunked_upload_start'),
+    path('api/uploads/chunked/<uuid:upload_id>/', views.chunked_upload_status, name='chunked_upload_status'),
+    path('api/uploads/chunked/<uuid:upload_id>/chunks/<int:index>/', views.chunked_upload_chunk, name='chunked_upload_chunk'),
+    path('api/uploads/chunked/<uuid:upload_id>/complete/', views.chunked_upload_complete, name='chunked_upload_complete'),
+    
     # ====================================================================
     # 2. TRANSACTION / DOWNLOAD VIEWS
     # ====================================================================
@@ -27,9 +41,19 @@ urlpatterns = [
     # 2.1. Payment initiation for paid papers
     path('buy/<slug:paper_slug>/', views.initiate_payment_or_download, name='buy_paper'),
     
+    # 2.1b. Bundle checkout: several papers from one term in a single payment
+    path('buy/bundle/<slug:class_slug>/<slug:term_slug>/', views.initiate_bundle_payment, name='buy_bundle'),
+    
     # 2.2. Direct file download (handles both free and paid papers)
     path('download/<slug:paper_slug>/', views.download_file, name='download_file'),
     
+    # 2.2a. Streamed ZIPs: everything in a purchase, or a term's free papers
+    path('download/purchase/<str:reference>/zip/', views.download_purchase_zip, name='download_purchase_zip'),
+    path('download/term/<slug:class_slug>/<slug:term_slug>/zip/', views.download_term_zip, name='download_term_zip'),
+    
+    # 2.2b. Locally stored preview images (content-hashed, cached forever)
+    path('previews/<path:name>', views.preview_image, name='preview_image'),
+    
     # 2.3. Payment callback from Paystack
     path('payment/callback/', views.payment_callback, name='payment_callback'),
     
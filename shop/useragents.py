@@ -0,0 +1,146 @@
+# shop/useragents.py
+
+"""
+Telling people from link-preview bots, crawlers and prefetches.
+
+Sharing a paper's link on WhatsApp or Facebook makes their servers fetch it
+to build a preview, search engines crawl every page, and browsers prefetch
+links the user may never open. None of these should count as a view or a
+download. Views call ``is_human(request)`` before counting or logging.
+
+User agents are matched against one compiled pattern of bot tokens, and
+results are cached per UA string since a site sees the same few hundred
+strings over and over. In-app browsers (Facebook, Instagram, WhatsApp on
+Android) carry tokens like ``FBAN`` or ``Instagram`` but are real people, so
+the pattern names the preview fetchers precisely (``facebookexternalhit``,
+not ``facebook``). An empty user agent counts as a bot.
+
+``parse`` sorts a user agent into browser family, OS and device class for
+the interned UserAgent table, so reports and admin filters never re-read
+the raw strings.
+"""
+
+import functools
+import re
+from collections import namedtuple
+
+# Patterns (case-insensitive) that mark a user agent as non-human
+BOT_TOKENS = (
+    # Generic markers used by most crawlers ("Cubot" is a phone brand)
+    r'(?<!cu)bot\b', r'crawl', r'spider', r'slurp', r'scrape',
+    # Link previews
+    r'facebookexternalhit', r'facebookcatalog', r'meta-externalagent', r'facebot',
+    r'whatsapp/', r'telegrambot', r'twitterbot', r'linkedinbot', r'slackbot',
+    r'slack-imgproxy', r'discordbot', r'skypeuripreview', r'snap url preview',
+    r'redditbot', r'embedly', r'iframely', r'google-pagerenderer',
+    r'googleother', r'google-inspectiontool', r'feedfetcher', r'apis-google',
+    r'mediapartners-google', r'adsbot',
+    # Headless browsers, audits and HTTP libraries
+    r'headlesschrome', r'lighthouse', r'pagespeed', r'phantomjs', r'python-requests',
+    r'python-urllib', r'aiohttp', r'httpx', r'go-http-client', r'curl/', r'wget/',
+    r'libwww-perl', r'java/', r'axios/', r'node-fetch', r'scrapy',
+    r'pingdom', r'statuscake',
+)
+
+BOT_PATTERN = re.compile('|'.join(BOT_TOKENS), re.IGNORECASE)
+
+# Android WhatsApp's in-app browser is a WebView ("...; wv) ... WhatsApp/x"),
+# the preview fetcher is just "WhatsApp/2.x.y A"
+_IN_APP_BROWSER = re.compile(r'\bwv\)|FBAN|FBAV|Instagram', re.IGNORECASE)
+
+# Request headers browsers send on speculative fetches (Chrome sends
+# Sec-Purpose/Purpose, Firefox X-Moz, Safari X-Purpose)
+PREFETCH_HEADERS = ('HTTP_SEC_PURPOSE', 'HTTP_PURPOSE', 'HTTP_X_MOZ', 'HTTP_X_PURPOSE')
+PREFETCH_VALUES = ('prefetch', 'prerender', 'preview')
+
+
+@functools.lru_cache(maxsize=4096)
+def is_bot(user_agent):
+    """True if ``user_agent`` belongs to a crawler, preview fetcher or script."""
+    if not user_agent or not user_agent.strip():
+        return True
+    if _IN_APP_BROWSER.search(user_agent):
+        return False
+    return BOT_PATTERN.search(user_agent) is not None
+
+
+def is_prefetch(request):
+    """True if the browser fetched this speculatively, not because the user opened it."""
+    for header in PREFETCH_HEADERS:
+        value = request.META.get(header, '').lower()
+        if value and any(purpose in value for purpose in PREFETCH_VALUES):
+            return True
+    return False
+
+
+def is_human(request):
+    """True if this request should count as a view or download."""
+    return not is_prefetch(request) and not is_bot(request.META.get('HTTP_USER_AGENT', ''))
+
+
+# ====================================================================
+# PARSING
+# ====================================================================
+
+ParsedUserAgent = namedtuple('ParsedUserAgent', ['browser', 'os', 'device'])
+
+DEVICE_DESKTOP = 'desktop'
+DEVICE_MOBILE = 'mobile'
+DEVICE_TABLET = 'tablet'
+DEVICE_BOT = 'bot'
+DEVICE_UNKNOWN = 'unknown'
+
+# First match wins, so more specific families come before the ones they imitate
+# (every Chromium browser also says "Chrome", and nearly everything says "Safari")
+BROWSERS = [
+    ('Facebook', re.compile(r'FBAN|FBAV|FB_IAB')),
+    ('Instagram', re.compile(r'Instagram')),
+    ('WhatsApp', re.compile(r'WhatsApp/')),
+    ('Opera Mini', re.compile(r'Opera Mini')),
+    ('Opera', re.compile(r'OPR/|Opera|OPiOS')),
+    ('Edge', re.compile(r'Edg/|Edge/|EdgA/|EdgiOS/')),
+    ('Samsung Internet', re.compile(r'SamsungBrowser')),
+    ('UC Browser', re.compile(r'UCBrowser|UCWEB')),
+    ('Firefox', re.compile(r'Firefox/|FxiOS/')),
+    ('Chrome', re.compile(r'Chrome/|CriOS/')),
+    ('Safari', re.compile(r'Version/[\d.]+.*Safari/|Mobile/\w+ Safari/')),
+    ('Internet Explorer', re.compile(r'MSIE |Trident/')),
+]
+
+OPERATING_SYSTEMS = [
+    ('Windows', re.compile(r'Windows')),
+    ('Android', re.compile(r'Android')),
+    ('iOS', re.compile(r'iPhone|iPad|iPod')),
+    ('macOS', re.compile(r'Macintosh|Mac OS X')),
+    ('Chrome OS', re.compile(r'CrOS')),
+    ('Linux', re.compile(r'Linux')),
+]
+
+_TABLET = re.compile(r'iPad|Tablet')
+_PHONE = re.compile(r'Mobile|iPhone|iPod|Opera Mini')
+
+
+def _first(patterns, user_agent):
+    for name, pattern in patterns:
+        if pattern.search(user_agent):
+            return name
+    return 'Other'
+
+
+@functools.lru_cache(maxsize=4096)
+def parse(user_agent):
+    """``ParsedUserAgent(browser, os, device)`` for a User-Agent string."""
+    if not user_agent or not user_agent.strip():
+        return ParsedUserAgent('Unknown', 'Unknown', DEVICE_UNKNOWN)
+    os_name = _first(OPERATING_SYSTEMS, user_agent)
+    if is_bot(user_agent):
+        return ParsedUserAgent('Bot', os_name, DEVICE_BOT)
+
+    # Android tablets leave "Mobile" out of the user agent
+    if _TABLET.search(user_agent) or (os_name == 'Android' and not _PHONE.search(user_agent)):
+        device = DEVICE_TABLET
+    elif _PHONE.search(user_agent):
+        device = DEVICE_MOBILE
+    else:
+        device = DEVICE_DESKTOP
+    return ParsedUserAgent(_first(BROWSERS, user_agent), os_name, device)
@@ -1,17 +1,30 @@
 # shop/views.py
 
+import asyncio
 import json
-import requests
+import os
+import time
+from asgiref.sync import sync_to_async
 from django import forms
 from django.shortcuts import render, redirect, get_object_or_404
 from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse, HttpResponse, Http404
+from django.http import FileResponse, JsonResponse, HttpResponse, Http404, StreamingHttpResponse
+from django.core.cache import cache
 from django.urls import reverse
-from django.db import models
+from django.db import models, transaction
 from django.core.mail import send_mail
 from django.db.models import Count
-from .models import Classes, Term, Subject, QuestionPaper, Payment, DownloadHistory
+from .models import Classes, Term, Subject, QuestionPaper, Payment, PaymentItem, DownloadHistory, SmsMessage, UploadSession, PreviewImage, WatermarkedCopy
+from . import chunked_upload, direct_upload, paystack, quotas, sms, useragents
+from .ratelimit import ip, post_field, rate_limit, url_kwarg
+from .file_serving import is_resumed_request, response_iterator, serve_field_file, set_download_headers, stream_etag
+from .media_urls import resolve_media_url
+from .previews import preview_storage_path
+from .quotas import client_ip
+from .tokens import read_access_token, read_archive_token, read_download_token
+from .zip_stream import ArchiveEntry, build_manifest, stream_zip
 from django.utils import timezone
 
 # ====================================================================
@@ -28,7 +41,7 @@ def class_list(request):
     total_papers = QuestionPaper.objects.filter(is_available=True).count()
     
     # Get download count (if available)
-    total_downloads = DownloadHistory.objects.count()
+    total_downloads = DownloadHistory.total()
     
     context = {
         'classes': classes,
@@ -96,6 +109,8 @@ def subject_list(request, class_slug, term_slug):
         'term': term,
         'subjects_list': subjects_list,
         'total_papers': all_papers.count(),
+        'has_paid_papers': any(paper.is_paid for paper in all_papers),
+        'has_free_papers': any(not paper.is_paid and paper.pdf_file for paper in all_papers),
         'page_title': f'{class_level.name} {term.name} - Select Subject',
     }
     return render(request, 'shop/subject_list.html', context)
@@ -142,8 +157,9 @@ def paper_detail(request, class_slug, term_slug, subject_slug, paper_slug):
         is_available=True
     )
     
-    # Increment view count
-    paper.increment_views()
+    # Increment view count (link previews, crawlers and prefetches don't count)
+    if useragents.is_human(request):
+        paper.increment_views()
     
     # Get related papers (other papers in same subject and term)
     related_papers = QuestionPaper.objects.filter(
@@ -219,17 +235,69 @@ class ContactForm(forms.Form):
 # ====================================================================
 # 3. MAIN CONDITIONAL LOGIC & PAYMENT INITIATION
 # ====================================================================
+# The gateway-bound views (checkout, callback, webhook, SMS resend) are async:
+# Paystack/Arkesel round trips use a pooled non-blocking client, and ORM work
+# and template rendering go through sync_to_async.
 
-def initiate_payment_or_download(request, paper_slug):
+# Download links are only shown to the browser that started a checkout (its
+# session lists the reference) or to whoever opens the SMS access link; a bare
+# payment reference never mints tokens (see shop/tokens.py).
+PURCHASES_SESSION_KEY = 'purchases'
+PURCHASES_SESSION_LIMIT = 20
+
+def _add_purchase(refs, ref):
+    return refs if ref in refs else (refs + [ref])[-PURCHASES_SESSION_LIMIT:]
+
+async def _aremember_purchase(request, payment):
+    refs = await request.session.aget(PURCHASES_SESSION_KEY, [])
+    await request.session.aset(PURCHASES_SESSION_KEY, _add_purchase(refs, payment.ref))
+
+def _remember_purchase(request, payment):
+    refs = request.session.get(PURCHASES_SESSION_KEY, [])
+    request.session[PURCHASES_SESSION_KEY] = _add_purchase(refs, payment.ref)
+
+def _opened_access_link(request, payment):
+    return read_access_token(request.GET.get('key'), payment.ref) is not None
+
+async def _start_paystack_checkout(request, payment):
+    """
+    Initializes a Paystack transaction for an unverified payment and redirects
+    the customer to the checkout page. Works for single papers and bundles alike.
+    """
+    data = {
+        "email": payment.email,
+        "amount": await sync_to_async(payment.amount_in_pesewas)(),
+        "currency": settings.CURRENCY_CODE,
+        "reference": str(payment.ref),
+        "callback_url": f"{request.scheme}://{request.get_host()}{reverse('shop:payment_callback')}",
+        "channels": ["mobile_money"],
+    }
+    
+    status_code, response_data = await paystack.ainitialize_transaction(data)
+
+    if status_code == 200 and response_data.get('status'):
+        # Keep the checkout URL so retries within the reuse window skip the gateway
+        payment.authorization_url = response_data['data']['authorization_url']
+        await sync_to_async(payment.save)(update_fields=['authorization_url'])
+        await _aremember_purchase(request, payment)
+        return redirect(payment.authorization_url)
+
+    print(f"Paystack Error: {response_data}") 
+    # Never initialized at the gateway, so don't leave it behind as a pending row
+    await sync_to_async(payment.delete)()
+    return await sync_to_async(render)(request, 'shop/error.html', {'message': response_data.get('message', 'Could not initiate payment.')})
+
+@rate_limit('checkout-phone', post_field('phone_number'), 'RATE_LIMIT_CHECKOUT_PHONE')
+async def initiate_payment_or_download(request, paper_slug):
     """
     Handles 'shop:buy_paper'. Checks the 'is_paid' flag:
     - If False (free), redirects to the new free download landing page.
     - If True (paid), proceeds with Paystack payment initiation form.
     """
     try:
-        paper = get_object_or_404(QuestionPaper, slug=paper_slug)
+        paper = await sync_to_async(get_object_or_404)(QuestionPaper, slug=paper_slug)
     except Exception:
-        return render(request, 'shop/error.html', {'message': 'The requested item was not found.'})
+        return await sync_to_async(render)(request, 'shop/error.html', {'message': 'The requested item was not found.'})
 
     # === CONDITIONAL LOGIC ===
     if not paper.is_paid:
@@ -244,44 +312,92 @@ def initiate_payment_or_download(request, paper_slug):
             email = form.cleaned_data['email']
             phone_number = form.cleaned_data['phone_number']
 
-            # 1. Create the local Payment record (unverified)
-            payment = Payment.objects.create(
+            # 1. Reuse a recent pending checkout for the same customer (e.g. a retried MoMo prompt)
+            pending = await sync_to_async(Payment.find_pending_checkout)(paper, email, phone_number)
+            if pending:
+                await _aremember_purchase(request, pending)
+                return redirect(pending.authorization_url)
+
+            # 2. Create the local Payment record (unverified)
+            payment = await sync_to_async(Payment.objects.create)(
                 question_paper=paper,
                 email=email,
                 phone_number=phone_number
             )
             
-            # 2. Paystack API Call Setup
-            url = "https://api.paystack.co/transaction/initialize"
-            headers = {
-                "Authorization": f"Bearer {settings.PAYSTACK_SECRET_KEY}",
-                "Content-Type": "application/json"
-            }
-            
-            data = {
-                "email": email,
-                "amount": payment.amount_in_pesewas(),
-                "currency": settings.CURRENCY_CODE,
-                "reference": str(payment.ref),
-                "callback_url": f"{request.scheme}://{request.get_host()}{reverse('shop:payment_callback')}",
-                "channels": ["mobile_money"],
-            }
-            
-            # 3. Make the request to Paystack
-            response = requests.post(url, headers=headers, data=json.dumps(data))
-            response_data = response.json()
-
-            if response.status_code == 200 and response_data.get('status'):
-                return redirect(response_data['data']['authorization_url'])
-            else:
-                print(f"Paystack Error: {response_data}") 
-                return render(request, 'shop/error.html', {'message': response_data.get('message', 'Could not initiate payment.')})
+            # 3. Hand over to Paystack
+            return await _start_paystack_checkout(request, payment)
     
     # Initial GET request for PAID papers: Display the form
     else:
         form = PurchaseForm()
 
-    return render(request, 'shop/buy_paper.html', {'form': form, 'paper': paper})
+    return await sync_to_async(render)(request, 'shop/buy_paper.html', {'form': form, 'paper': paper})
+
+def _create_bundle_payment(email, phone_number, papers):
+    """One Payment for the whole bundle, with a line item per paper."""
+    with transaction.atomic():
+        payment = Payment.objects.create(email=email, phone_number=phone_number)
+        PaymentItem.objects.bulk_create([
+            PaymentItem(payment=payment, question_paper=paper, price=paper.price)
+            for paper in papers
+        ])
+    return payment
+
+@rate_limit('checkout-phone', post_field('phone_number'), 'RATE_LIMIT_CHECKOUT_PHONE')
+async def initiate_bundle_payment(request, class_slug, term_slug):
+    """
+    Handles 'shop:buy_bundle'. Lets a customer pick several paid papers from one
+    term and pay for all of them with a single Paystack transaction.
+    """
+    class_level = await sync_to_async(get_object_or_404)(Classes, slug=class_slug)
+    term = await sync_to_async(get_object_or_404)(Term, class_name=class_level, slug=term_slug)
+    
+    papers = await sync_to_async(list)(QuestionPaper.objects.filter(
+        class_level=class_level,
+        term=term,
+        is_available=True,
+        is_paid=True
+    ).select_related('subject').order_by('subject__name', '-year', 'title'))
+    
+    selected_slugs = [paper.slug for paper in papers]
+    
+    if request.method == 'POST':
+        form = PurchaseForm(request.POST)
+        selected_slugs = request.POST.getlist('papers')
+        selected = [paper for paper in papers if paper.slug in selected_slugs]
+        
+        if not selected:
+            form.add_error(None, 'Select at least one paper for your bundle.')
+        
+        if form.is_valid():
+            email = form.cleaned_data['email']
+            phone_number = form.cleaned_data['phone_number']
+            
+            # Reuse a recent pending checkout for the same customer and papers
+            pending = await sync_to_async(Payment.find_pending_bundle_checkout)(selected, email, phone_number)
+            if pending:
+                await _aremember_purchase(request, pending)
+                return redirect(pending.authorization_url)
+            
+            payment = await sync_to_async(_create_bundle_payment)(email, phone_number, selected)
+            
+            # A single gateway transaction covers every item
+            return await _start_paystack_checkout(request, payment)
+    else:
+        form = PurchaseForm()
+    
+    context = {
+        'class_level': class_level,
+        'term': term,
+        'papers': papers,
+        'selected_slugs': selected_slugs,
+        'bundle_total': sum(paper.price for paper in papers),
+        'form': form,
+        'currency_code': settings.CURRENCY_CODE,
+        'page_title': f'Buy {class_level.name} {term.name} Papers',
+    }
+    return await sync_to_async(render)(request, 'shop/buy_bundle.html', context)
 
 # ====================================================================
 # 4. FREE DOWNLOAD VIEW (UPDATED FOR CLOUDINARY)
@@ -290,7 +406,7 @@ def initiate_payment_or_download(request, paper_slug):
 def download_file(request, paper_slug):
     """
     Handles file downloads for both free and paid papers.
-    For paid papers, requires payment verification.
+    For paid papers, requires a signed download token (see shop/tokens.py).
     """
     paper = get_object_or_404(QuestionPaper, slug=paper_slug)
     
@@ -298,36 +414,61 @@ def download_file(request, paper_slug):
     if not paper.is_available:
         raise Http404("This paper is not available for download.")
     
-    # For paid papers, check if user has paid
+    # Email for the download log; paid downloads take it from the token
+    user_email = request.GET.get('email', 'anonymous@example.com')
+    payment_id = None
+    
+    # For paid papers, require a signed download token minted at verification.
+    # Checking it is CPU-only: no Payment lookup.
     if paper.is_paid:
-        # Check for payment verification via session or URL parameter
-        payment_ref = request.GET.get('ref')
-        if not payment_ref:
-            # No payment reference, redirect to purchase page
+        grant = read_download_token(request.GET.get('token'), paper)
+        if grant is None:
+            # Missing, tampered or expired token: send them to the purchase page
             return redirect('shop:buy_paper', paper_slug=paper.slug)
+        payment_id = grant.payment_id
+        user_email = grant.email
         
-        # Verify payment exists and is verified
-        try:
-            payment = Payment.objects.get(ref=payment_ref, verified=True)
-        except Payment.DoesNotExist:
-            # Invalid or unverified payment
-            return redirect('shop:buy_paper', paper_slug=paper.slug)
+        # Shared links: enforce the per-payment quotas before any DB write or transfer,
+        # resumed or not (counted below, once the file is actually served)
+        retry_after = quotas.check_download(payment_id, [paper.pk], client_ip(request))
+        if retry_after is not None:
+            return _over_quota_response(retry_after)
     
     # For free papers or verified paid papers, proceed with download
-    if not paper.pdf_file or not paper.get_pdf_url():
+    if not paper.pdf_file:
         raise Http404("This paper does not have an associated file for download.")
     
-    # Log download history
-    user_email = request.GET.get('email', 'anonymous@example.com')
-    DownloadHistory.log_download(
-        paper=paper,
-        email=user_email,
-        request=request,
-        payment=payment if paper.is_paid else None
-    )
+    # Paid downloads are the buyer's own watermarked copy
+    pdf_file = _download_source(paper, payment_id)
+    if pdf_file is None:
+        return _preparing_response(request, paper.title)
+    
+    # Count and log once per download. Only a streamed file honours Range, so only
+    # there can a request resume a download: one that continues (If-Range) the
+    # exact file version an earlier, counted request served. Everything else counts.
+    # Bots still count against the quota, so a spoofed user agent can't dodge it.
+    etag = stream_etag(pdf_file)
+    resumed = is_resumed_request(request, etag) and quotas.was_served(payment_id, paper.pk, etag)
+    if not resumed:
+        if payment_id is not None:
+            quotas.record_download(payment_id, [paper.pk], client_ip(request))
+        if etag is not None:
+            quotas.mark_served(payment_id, paper.pk, etag)
+        if useragents.is_human(request):
+            DownloadHistory.log_download(
+                paper=paper,
+                email=user_email,
+                request=request,
+                payment_id=payment_id
+            )
     
-    # Get Cloudinary URL
-    pdf_url = paper.get_secure_pdf_url()
+    # Local storage: stream with Range support or hand off to the proxy
+    response = serve_field_file(request, pdf_file, paper.file_name)
+    if response is not None:
+        return response
+    
+    # Signed, expiring Cloudinary URL (cached per file)
+    pdf_url = resolve_media_url(pdf_file)
     
     if not pdf_url:
         raise Http404("The requested paper file was not found.")
@@ -335,11 +476,148 @@ def download_file(request, paper_slug):
     # Redirect to Cloudinary URL (browser will handle download)
     return redirect(pdf_url)
 
+def _download_source(paper, payment_id):
+    """
+    The file to serve for ``paper``: for paid papers the buyer's watermarked
+    copy once it's ready (None while it is still being stamped), and the
+    original if watermarking is off or failed.
+    """
+    if not (paper.is_paid and settings.WATERMARK_ENABLED):
+        return paper.pdf_file
+    copy = WatermarkedCopy.request(payment_id, paper)
+    if copy.status == WatermarkedCopy.STATUS_PENDING:
+        return None
+    if copy.status == WatermarkedCopy.STATUS_READY:
+        return copy.file
+    return paper.pdf_file
+
+def _over_quota_response(retry_after):
+    response = HttpResponse(
+        "This download link has been used too many times. Please try again later.",
+        status=429, content_type='text/plain; charset=utf-8',
+    )
+    response['Retry-After'] = str(retry_after)
+    return response
+
+def _preparing_response(request, title):
+    """A page that retries the download until the watermarked copy is ready."""
+    return render(request, 'shop/watermark_preparing.html', {
+        'title': title,
+        'retry_url': request.get_full_path(),
+        'page_title': 'Preparing Your Download',
+    }, status=202)
+
+def preview_image(request, name):
+    """
+    Serves a locally stored preview image. Names are content hashes, so the
+    response can be cached forever.
+    """
+    preview = PreviewImage.objects.filter(name=name).first()
+    if preview is None:
+        raise Http404("Preview not found.")
+    
+    path = preview_storage_path(name)
+    if path is None or not os.path.exists(path):
+        raise Http404("Preview not found.")
+    
+    response = FileResponse(open(path, 'rb'), content_type=f"image/{preview.image_format}")
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+# ====================================================================
+# 4b. ZIP DOWNLOADS (a whole purchase or a term's free papers)
+# ====================================================================
+
+def _archive_entry(paper, pdf_file, url):
+    if pdf_file is paper.pdf_file:
+        return ArchiveEntry(paper.file_name, pdf_file, paper.file_size_bytes or pdf_file.size, paper.checksum or None, url)
+    # Watermarked copy: its own size, and no checksum on record
+    return ArchiveEntry(paper.file_name, pdf_file, pdf_file.size, None, url)
+
+def _zip_response(request, title, filename, entries, log):
+    """
+    Stream a ZIP of ``entries`` (or just its manifest with ``?manifest=1``).
+    ``?start=N`` skips the first N entries to resume an interrupted download.
+    ``log(paper_index)`` records the download of each included entry.
+    """
+    if request.GET.get('manifest'):
+        return JsonResponse(build_manifest(title, entries))
+    
+    try:
+        start = min(max(int(request.GET.get('start', 0)), 0), len(entries))
+    except ValueError:
+        start = 0
+    if useragents.is_human(request):
+        for index in range(start, len(entries)):
+            log(index)
+    
+    response = StreamingHttpResponse(response_iterator(request, stream_zip(title, entries, start)))
+    set_download_headers(response, filename, 'application/zip')
+    # Let nginx pass each chunk on as it's written instead of buffering the archive
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def download_purchase_zip(request, reference):
+    """
+    Handles 'shop:download_purchase_zip': every paper a verified payment
+    covers, in one streamed ZIP. Authorized by a signed archive token.
+    """
+    grant = read_archive_token(request.GET.get('token'), reference)
+    if grant is None:
+        return redirect('shop:payment_status', reference=reference)
+    payment = get_object_or_404(Payment, pk=grant.payment_id, ref=reference)
+    
+    papers = [paper for paper in payment.get_papers() if paper.is_available and paper.pdf_file]
+    if not papers:
+        raise Http404("This purchase has no papers available for download.")
+    
+    if not request.GET.get('manifest'):
+        retry_after = quotas.check_download(payment.pk, [paper.pk for paper in papers], client_ip(request))
+        if retry_after is not None:
+            return _over_quota_response(retry_after)
+    
+    entries = []
+    for paper in papers:
+        pdf_file = _download_source(paper, payment.pk)
+        if pdf_file is None:
+            return _preparing_response(request, f"your {len(papers)} papers")
+        entries.append(_archive_entry(paper, pdf_file, payment.get_download_url(paper)))
+    
+    def log(index):
+        DownloadHistory.log_download(paper=papers[index], email=grant.email, request=request, payment_id=payment.pk)
+    
+    if not request.GET.get('manifest'):
+        quotas.record_download(payment.pk, [paper.pk for paper in papers], client_ip(request))
+    
+    return _zip_response(request, f"Insight Innovations purchase {payment.ref}", f"insight-innovations-{payment.ref}.zip", entries, log)
+
+def download_term_zip(request, class_slug, term_slug):
+    """Handles 'shop:download_term_zip': every free paper in a term, in one streamed ZIP."""
+    class_level = get_object_or_404(Classes, slug=class_slug)
+    term = get_object_or_404(Term, class_name=class_level, slug=term_slug)
+    
+    papers = list(QuestionPaper.objects.filter(
+        class_level=class_level, term=term, is_available=True, is_paid=False
+    ).exclude(pdf_file='').select_related('subject').order_by('subject__name', '-year', 'exam_type'))
+    if not papers:
+        raise Http404("This term has no free papers to download.")
+    
+    entries = [
+        _archive_entry(paper, paper.pdf_file, reverse('shop:download_file', args=[paper.slug]))
+        for paper in papers
+    ]
+    user_email = request.GET.get('email', 'anonymous@example.com')
+    
+    def log(index):
+        DownloadHistory.log_download(paper=papers[index], email=user_email, request=request)
+    
+    return _zip_response(request, f"{class_level.name} {term.name} free papers", f"{class_level.slug}-{term.slug}.zip", entries, log)
+
 # ====================================================================
 # 5. PAYMENT CALLBACK VIEW (UPDATED)
 # ====================================================================
 
-def payment_callback(request):
+async def payment_callback(request):
     """
     Handles the user redirect after payment on the Paystack gateway.
     Shows success page with download options.
@@ -350,52 +628,51 @@ def payment_callback(request):
         return redirect('shop:class_list')
     
     try:
-        payment = Payment.objects.get(ref=reference)
+        payment = await sync_to_async(Payment.objects.select_related('question_paper').get)(ref=reference)
     except Payment.DoesNotExist:
-        return render(request, 'shop/error.html', {
+        return await sync_to_async(render)(request, 'shop/error.html', {
             'message': f'Payment reference {reference} not found.',
             'page_title': 'Payment Error'
         })
     
-    # Check if payment is verified
-    if not payment.verified:
+    # Check if payment is verified. Reloads within the throttle window skip the
+    # gateway; the page polls the status API for the webhook result instead.
+    throttle_key = f"payment-verify:{reference}"
+    if not payment.verified and await sync_to_async(cache.add)(throttle_key, True, settings.PAYMENT_VERIFY_THROTTLE_SECONDS):
         # Check with Paystack
-        headers = {
-            "Authorization": f"Bearer {settings.PAYSTACK_SECRET_KEY}",
-            "Content-Type": "application/json"
-        }
-        verification_url = f"https://api.paystack.co/transaction/verify/{reference}"
-        verification_response = requests.get(verification_url, headers=headers)
+        status_code, verification_data = await paystack.averify_transaction(reference)
+        expected_amount = await sync_to_async(payment.amount_in_pesewas)()
         
-        if verification_response.status_code == 200:
-            verification_data = verification_response.json()
-            if (verification_data['data']['status'] == 'success' and 
-                verification_data['data']['amount'] == payment.amount_in_pesewas()):
-                
-                # Mark as verified
-                payment.mark_as_verified(
-                    transaction_id=verification_data['data']['id'],
-                    amount=float(verification_data['data']['amount']) / 100
-                )
+        if status_code == 200 and paystack.is_successful(verification_data, expected_amount):
+            # Mark as verified
+            await sync_to_async(payment.mark_as_verified)(
+                transaction_id=verification_data['data']['id'],
+                amount=float(verification_data['data']['amount']) / 100
+            )
     
-    # Create download URL with email parameter
-    download_url = reverse('shop:download_file', args=[payment.question_paper.slug])
-    download_url_with_params = f"{download_url}?ref={payment.ref}&email={payment.email}"
+    # Download links (one per paper for bundles) with signed tokens, for the buyer's browser only
+    papers = await sync_to_async(payment.get_papers)()
+    unlocked = payment.verified and reference in await request.session.aget(PURCHASES_SESSION_KEY, [])
+    downloads = await sync_to_async(payment.get_downloads)() if unlocked else []
     
     context = {
         'payment': payment,
+        'papers': papers,
         'currency_code': settings.CURRENCY_CODE,
-        'download_url': download_url_with_params,
+        'downloads': downloads,
+        'downloads_locked': payment.verified and not unlocked,
+        'download_url': downloads[0]['url'] if downloads else '',
+        'archive_url': payment.get_archive_url() if len(downloads) > 1 else None,
         'page_title': 'Payment Complete'
     }
-    return render(request, 'shop/callback_success.html', context)
+    return await sync_to_async(render)(request, 'shop/callback_success.html', context)
 
 # ====================================================================
 # 6. PAYSTACK WEBHOOK HANDLER
 # ====================================================================
 
 @csrf_exempt
-def paystack_webhook(request):
+async def paystack_webhook(request):
     """
     Handles POST requests from Paystack, verifies the payment, marks it as verified, 
     and triggers the SMS with the password.
@@ -412,50 +689,33 @@ def paystack_webhook(request):
         reference = payload['data']['reference']
         
         try:
-            payment = Payment.objects.get(ref=reference)
+            payment = await sync_to_async(Payment.objects.select_related('question_paper').get)(ref=reference)
         except Payment.DoesNotExist:
             return JsonResponse({'status': 'error', 'message': 'Payment reference not found'}, status=400)
 
         # Verify Payment with Paystack (Double Check)
-        headers = {
-            "Authorization": f"Bearer {settings.PAYSTACK_SECRET_KEY}",
-            "Content-Type": "application/json"
-        }
-        verification_url = f"https://api.paystack.co/transaction/verify/{reference}"
-        verification_response = requests.get(verification_url, headers=headers)
-        verification_data = verification_response.json()
+        status_code, verification_data = await paystack.averify_transaction(reference)
+        expected_amount = await sync_to_async(payment.amount_in_pesewas)()
 
-        if (verification_data['data']['status'] == 'success' and 
-            verification_data['data']['amount'] == payment.amount_in_pesewas()):
+        if paystack.is_successful(verification_data, expected_amount):
             
             # Mark Payment as Verified and Send Fulfillment
             if not payment.verified:
-                payment.verified = True
-                payment.amount_paid = float(verification_data['data']['amount']) / 100
-                if verification_data['data'].get('id'):
-                    payment.transaction_id = verification_data['data']['id']
-                payment.save()
+                await sync_to_async(payment.mark_as_verified)(
+                    transaction_id=verification_data['data'].get('id'),
+                    amount=float(verification_data['data']['amount']) / 100
+                )
 
-                question_paper = payment.question_paper
-                
-                # Compose the SMS message
-                message = f"Your password for {question_paper.title} is: {question_paper.password}. Thank you for your purchase from Insight Innovations!" 
-                
-                # Arkesel API Details
-                arkesel_url = "https://sms.arkesel.com/api/v2/sms/send"
-                arkesel_payload = {
-                    "sender": "Insight Innovations", 
-                    "message": message,
-                    "recipients": [payment.phone_number],
-                    "apiKey": settings.ARKESEL_API_KEY
-                }
+                # Compose the SMS message (all passwords in one message for bundles),
+                # with the access link that unlocks the downloads on any device
+                access_url = request.build_absolute_uri(payment.get_access_url())
+                message = await sync_to_async(payment.get_password_message)(access_url)
 
-                try:
-                    # Send the SMS via Arkesel
-                    requests.post(arkesel_url, json=arkesel_payload)
-                except Exception as e:
-                    # Log SMS error but don't fail the webhook
-                    print(f"Error sending SMS: {e}")
+                # Send the SMS (failures are logged on the SmsMessage, not raised)
+                await sms.asend_sms(
+                    payment.phone_number, message,
+                    payment=payment, dedupe_key=f"password:{payment.ref}"
+                )
                 
                 return JsonResponse({'status': 'success', 'message': 'Payment verified and password sent'}, status=200)
             
@@ -470,6 +730,7 @@ def paystack_webhook(request):
 # ====================================================================
 
 @csrf_exempt
+@rate_limit('track-download', ip, 'RATE_LIMIT_TRACK_DOWNLOAD')
 def track_download_api(request, paper_slug):
     """
     API endpoint to track downloads (called via JavaScript).
@@ -485,13 +746,14 @@ def track_download_api(request, paper_slug):
         email = data.get('email', 'anonymous@example.com')
         payment_ref = data.get('payment_ref')
         
-        # Log download
-        DownloadHistory.log_download(
-            paper=paper,
-            email=email,
-            request=request,
-            payment=Payment.objects.get(ref=payment_ref) if payment_ref else None
-        )
+        # Log download (not for bots or prefetches, which still get a success reply)
+        if useragents.is_human(request):
+            DownloadHistory.log_download(
+                paper=paper,
+                email=email,
+                request=request,
+                payment=Payment.objects.get(ref=payment_ref) if payment_ref else None
+            )
         
         return JsonResponse({'success': True, 'message': 'Download tracked'})
         
@@ -499,7 +761,9 @@ def track_download_api(request, paper_slug):
         return JsonResponse({'error': str(e)}, status=500)
 
 @csrf_exempt
-def resend_password_api(request, payment_ref):
+@rate_limit('resend-password-ip', ip, 'RATE_LIMIT_RESEND_PASSWORD_IP')
+@rate_limit('resend-password', url_kwarg('payment_ref'), 'RATE_LIMIT_RESEND_PASSWORD')
+async def resend_password_api(request, payment_ref):
     """
     API endpoint to resend password SMS.
     """
@@ -507,28 +771,30 @@ def resend_password_api(request, payment_ref):
         return JsonResponse({'error': 'Method not allowed'}, status=405)
     
     try:
-        payment = get_object_or_404(Payment, ref=payment_ref)
-        question_paper = payment.question_paper
-        
-        # Compose the SMS message
-        message = f"Your password for {question_paper.title} is: {question_paper.password}. Thank you for your purchase from Insight Innovations!"
+        payment = await sync_to_async(get_object_or_404)(Payment, ref=payment_ref)
+        if not payment.verified:
+            return JsonResponse({'error': 'This payment has not been verified yet'}, status=409)
         
-        # Arkesel API Details
-        arkesel_url = "https://sms.arkesel.com/api/v2/sms/send"
-        arkesel_payload = {
-            "sender": "Insight Innovations", 
-            "message": message,
-            "recipients": [payment.phone_number],
-            "apiKey": settings.ARKESEL_API_KEY
-        }
+        # Compose the SMS message, with a fresh access link; it only ever goes to the buyer's phone
+        access_url = request.build_absolute_uri(payment.get_access_url())
+        message = await sync_to_async(payment.get_password_message)(access_url)
         
-        response = requests.post(arkesel_url, json=arkesel_payload)
+        # Its own key: the webhook's "password:" send must not swallow an explicit resend,
+        # but repeated taps on the resend button should still only send once
+        sms_message = await sms.asend_sms(
+            payment.phone_number, message,
+            payment=payment, dedupe_key=f"password-resend:{payment.ref}"
+        )
         
-        if response.status_code == 200:
-            return JsonResponse({'success': True, 'message': 'Password resent'})
-        else:
+        if sms_message.status == SmsMessage.STATUS_THROTTLED:
+            return JsonResponse({'error': 'Too many SMS requests for this number. Please try again later.'}, status=429)
+        elif sms_message.status == SmsMessage.STATUS_FAILED:
             return JsonResponse({'error': 'Failed to send SMS'}, status=500)
+        # Sent now, or a duplicate of one sent/in flight moments ago
+        return JsonResponse({'success': True, 'message': 'Password resent'})
             
+    except Http404:
+        raise
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
@@ -701,6 +967,8 @@ def all_papers(request):
 # 10. CONTACT VIEW
 # ====================================================================
 
+@rate_limit('contact-ip', ip, 'RATE_LIMIT_CONTACT_IP')
+@rate_limit('contact-email', post_field('email'), 'RATE_LIMIT_CONTACT_EMAIL')
 def contact_us(request):
     """
     Handles the contact form display and submission, and sends the message via email.
@@ -804,8 +1072,15 @@ def payment_status(request, reference):
     """Check payment status"""
     try:
         payment = Payment.objects.get(ref=reference)
+        if payment.verified and _opened_access_link(request, payment):
+            _remember_purchase(request, payment)
+        unlocked = payment.verified and reference in request.session.get(PURCHASES_SESSION_KEY, [])
         context = {
             'payment': payment,
+            'papers': payment.get_papers(),
+            'downloads': payment.get_downloads() if unlocked else [],
+            'downloads_locked': payment.verified and not unlocked,
+            'currency_code': settings.CURRENCY_CODE,
             'page_title': 'Payment Status'
         }
         return render(request, 'shop/payment_status.html', context)
@@ -814,6 +1089,63 @@ def payment_status(request, reference):
             'message': f'Payment reference {reference} not found.',
             'page_title': 'Payment Not Found'
         })
+def _status_payload(reference, status):
+    return {'reference': reference, 'status': status, 'verified': status == 'verified'}
+
+async def _payment_status_events(reference, status, max_wait):
+    """Server-Sent Events stream: pushes the status now and again when it changes."""
+    yield f"retry: 3000\ndata: {json.dumps(_status_payload(reference, status))}\n\n"
+    deadline = time.monotonic() + max_wait
+    last_sent = time.monotonic()
+    while status == 'pending' and time.monotonic() < deadline:
+        await asyncio.sleep(settings.PAYMENT_STATUS_POLL_INTERVAL)
+        current = await Payment.aget_cached_status(reference)
+        if current != status:
+            status = current
+            yield f"data: {json.dumps(_status_payload(reference, status))}\n\n"
+            last_sent = time.monotonic()
+        elif time.monotonic() - last_sent >= 15:
+            # Comment line keeps proxies from closing an idle stream
+            yield ": keep-alive\n\n"
+            last_sent = time.monotonic()
+
+async def payment_status_api(request, reference):
+    """
+    Lightweight JSON status for a payment reference, served from the cached
+    verified flag (no template, no gateway call).
+    - ?wait=N long-polls up to N seconds (capped) until the payment is verified.
+    - Accept: text/event-stream streams Server-Sent Events instead.
+    Both wait on the event loop, so a waiting client holds no worker thread.
+    """
+    status = await Payment.aget_cached_status(reference)
+    if status == 'missing':
+        return JsonResponse({'error': 'Payment reference not found'}, status=404)
+    
+    max_wait = settings.PAYMENT_STATUS_MAX_WAIT_SECONDS
+    
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        response = StreamingHttpResponse(
+            _payment_status_events(reference, status, max_wait),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    
+    try:
+        wait = min(max(float(request.GET.get('wait', 0)), 0), max_wait)
+    except ValueError:
+        wait = 0
+    
+    deadline = time.monotonic() + wait
+    while status == 'pending' and time.monotonic() < deadline:
+        await asyncio.sleep(settings.PAYMENT_STATUS_POLL_INTERVAL)
+        status = await Payment.aget_cached_status(reference)
+    
+    response = JsonResponse(_status_payload(reference, status))
+    response['Cache-Control'] = 'no-store'
+    return response
+
 def your_view(request):
     context = {
         'current_year': timezone.now().year,
@@ -866,3 +1198,114 @@ def papers_by_type(request, exam_type):
         'page_title': f'{exam_type} Question Papers'
     }
     return render(request, 'shop/papers_by_type.html', context)
+
+# ====================================================================
+# 12. ADMIN DIRECT UPLOADS
+# ====================================================================
+# The browser uploads PDFs straight to storage; these views only hand out
+# signed tickets and confirm the result (see shop/direct_upload.py).
+
+@staff_member_required
+def direct_upload_ticket(request):
+    """Issue a signed upload ticket for a model file field."""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    
+    try:
+        data = json.loads(request.body)
+        ticket = direct_upload.issue_ticket(data['model'], data['field'], data.get('filename', ''))
+    except (ValueError, KeyError):
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    except direct_upload.DirectUploadError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(ticket)
+
+@csrf_exempt
+def direct_upload_local(request, ticket):
+    """
+    Stand-in storage endpoint for LocalDirectUpload. The signed ticket is the
+    authorization, as it would be for a provider's upload URL.
+    """
+    if request.method != 'PUT':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    
+    backend = direct_upload.get_backend()
+    if not isinstance(backend, direct_upload.LocalDirectUpload):
+        raise Http404("Local uploads are disabled.")
+    try:
+        backend.receive(ticket, request)
+    except direct_upload.DirectUploadError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'success': True})
+
+@staff_member_required
+def direct_upload_complete(request):
+    """Confirm an uploaded object and return the reference the admin form submits."""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    
+    try:
+        data = json.loads(request.body)
+        reference = direct_upload.complete_upload(data['ticket'], data.get('result'))
+    except (ValueError, KeyError):
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    except direct_upload.DirectUploadError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'reference': reference})
+
+@staff_member_required
+def chunked_upload_start(request):
+    """Open a resumable chunked upload session."""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    
+    try:
+        data = json.loads(request.body)
+        session = chunked_upload.start(data['model'], data['field'], data.get('filename', ''), int(data['size']))
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    except direct_upload.DirectUploadError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(_upload_session_payload(session))
+
+@staff_member_required
+def chunked_upload_status(request, upload_id):
+    """Where an interrupted upload should resume."""
+    session = get_object_or_404(UploadSession, pk=upload_id)
+    return JsonResponse(_upload_session_payload(session))
+
+@staff_member_required
+def chunked_upload_chunk(request, upload_id, index):
+    """One chunk as the raw request body, with its SHA-256 in the X-Chunk-SHA256 header."""
+    if request.method != 'PUT':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    
+    session = get_object_or_404(UploadSession, pk=upload_id)
+    try:
+        chunked_upload.write_chunk(session, index, request.headers.get('X-Chunk-SHA256'), request)
+    except direct_upload.DirectUploadError as e:
+        payload = _upload_session_payload(session)
+        payload['error'] = str(e)
+        return JsonResponse(payload, status=409)
+    return JsonResponse(_upload_session_payload(session))
+
+@staff_member_required
+def chunked_upload_complete(request, upload_id):
+    """Store the assembled file and return the reference the admin form submits."""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    
+    session = get_object_or_404(UploadSession, pk=upload_id)
+    try:
+        reference = chunked_upload.assemble(session)
+    except direct_upload.DirectUploadError as e:
+        return JsonResponse({'error': str(e)}, status=409)
+    return JsonResponse({'reference': reference})
+
+def _upload_session_payload(session):
+    return {
+        'upload_id': str(session.pk),
+        'chunk_size': session.chunk_size,
+        'chunk_count': session.chunk_count,
+        'next_chunk': session.received_chunks,
+    }
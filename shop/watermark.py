@@ -0,0 +1,199 @@
+# shop/watermark.py
+
+"""
+Per-purchase watermarked copies of paid PDFs.
+
+When a payment is verified, ``schedule`` queues one WatermarkedCopy per
+paper it covers. Stamping (a footer with the buyer's email and the payment
+reference on every page) is CPU-bound, so it runs in a pool of
+WATERMARK_PROCESSES worker processes rather than in a web worker or the
+shared background threads. Each job has a coordinating thread that copies
+the source PDF to local disk (through the media cache), waits for a worker
+process to stamp it, and stores the result under ``watermarked/`` in the
+storage backend; download_file serves that copy from then on.
+
+A copy is tied to the checksum of the PDF it was made from, so replacing a
+paper's file makes existing copies stale and they are stamped again on the
+next download. If stamping fails, download_file falls back to the original.
+
+``stamp_pdf`` only needs pypdf (with ``cryptography`` for AES-encrypted
+PDFs), so worker processes never set up Django. Paid PDFs are
+password-protected; they are opened with the paper's password and the
+stamped copy keeps that password.
+The benchmark_watermark command measures its throughput.
+"""
+
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+from . import background
+
+WATERMARK_FOLDER = 'watermarked/'
+
+FONT_SIZE = 7
+# Distance of the footer from the bottom-left corner of the page, in points
+MARGIN_X = 24
+MARGIN_Y = 12
+
+_pool_lock = threading.Lock()
+_process_pool = None
+_coordinators = None
+
+
+# ====================================================================
+# STAMPING (runs in the worker processes)
+# ====================================================================
+
+def footer_text(email, reference):
+    return f"Licensed to {email} · Ref {reference} · Not for redistribution"
+
+
+def _pdf_string(text):
+    """``text`` as a PDF literal string in WinAnsiEncoding."""
+    data = text.encode('cp1252', errors='replace')
+    return b'(' + data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+def _footer_page(text, box):
+    """A blank page holding only the footer, positioned for a page with ``box`` as its mediabox."""
+    from pypdf import PageObject
+    from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+    page = PageObject.create_blank_page(width=box.width, height=box.height)
+    font = DictionaryObject({
+        NameObject('/Type'): NameObject('/Font'),
+        NameObject('/Subtype'): NameObject('/Type1'),
+        NameObject('/BaseFont'): NameObject('/Helvetica'),
+        NameObject('/Encoding'): NameObject('/WinAnsiEncoding'),
+    })
+    page[NameObject('/Resources')] = DictionaryObject({
+        NameObject('/Font'): DictionaryObject({NameObject('/WmF1'): font}),
+    })
+    x = float(box.left) + MARGIN_X
+    y = float(box.bottom) + MARGIN_Y
+    content = DecodedStreamObject()
+    content.set_data(
+        b'q 0.4 g BT /WmF1 %d Tf %.2f %.2f Td %s Tj ET Q' % (FONT_SIZE, x, y, _pdf_string(text))
+    )
+    page[NameObject('/Contents')] = content
+    return page
+
+
+def stamp_pdf(source_path, output_path, text, password=''):
+    """
+    Write a copy of ``source_path`` to ``output_path`` with ``text`` in the
+    footer of every page. A password-protected source is opened with
+    ``password`` and the copy is protected with the same one (AES-256).
+    Returns ``(pages, cpu_seconds)``.
+    """
+    from pypdf import PasswordType, PdfReader, PdfWriter
+
+    started = time.process_time()
+    reader = PdfReader(source_path)
+    if reader.is_encrypted and reader.decrypt(password) == PasswordType.NOT_DECRYPTED:
+        raise ValueError("The PDF's password doesn't match the paper's password.")
+    writer = PdfWriter(clone_from=reader)
+    # One footer page per distinct page box, not per page
+    footers = {}
+    for page in writer.pages:
+        if page.rotation:
+            # Draw the footer along the bottom edge as the page is viewed
+            page.transfer_rotation_to_content()
+        box = page.mediabox
+        key = (float(box.left), float(box.bottom), float(box.width), float(box.height))
+        if key not in footers:
+            footers[key] = _footer_page(text, box)
+        page.merge_page(footers[key])
+    if reader.is_encrypted:
+        writer.encrypt(password, algorithm='AES-256')
+    with open(output_path, 'wb') as output:
+        writer.write(output)
+    return len(writer.pages), time.process_time() - started
+
+
+# ====================================================================
+# POOLS
+# ====================================================================
+
+def get_process_pool():
+    """The stamping processes (started on first use)."""
+    global _process_pool
+    with _pool_lock:
+        if _process_pool is None:
+            # Fresh interpreters rather than forks of a threaded web worker
+            _process_pool = ProcessPoolExecutor(
+                max_workers=settings.WATERMARK_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _process_pool
+
+
+def get_coordinators():
+    """Threads that move files to and from storage around each stamping job."""
+    global _coordinators
+    with _pool_lock:
+        if _coordinators is None:
+            _coordinators = ThreadPoolExecutor(
+                max_workers=settings.WATERMARK_PROCESSES,
+                thread_name_prefix='shop-watermark',
+            )
+        return _coordinators
+
+
+# ====================================================================
+# SCHEDULING
+# ====================================================================
+
+def storage():
+    # Copies are per buyer, so they skip the content-addressed blobs and cache
+    return getattr(default_storage, 'backend', default_storage)
+
+
+def schedule(payment):
+    """Queue a watermarked copy of every paid paper a verified payment covers."""
+    from .models import WatermarkedCopy
+
+    if not settings.WATERMARK_ENABLED:
+        return
+    for paper in payment.get_papers():
+        if paper.is_paid and paper.pdf_file:
+            WatermarkedCopy.request(payment.pk, paper)
+
+
+def submit(copy_id):
+    background.submit_to(get_coordinators, produce, copy_id)
+
+
+def produce(copy_id):
+    """Coordinator job: stamp and store one WatermarkedCopy."""
+    from .models import WatermarkedCopy
+    from .previews import local_copy
+
+    copy = WatermarkedCopy.objects.select_related('payment', 'paper').filter(pk=copy_id).first()
+    if copy is None or copy.is_current(copy.paper):
+        return
+    paper, payment = copy.paper, copy.payment
+    checksum = paper.checksum
+
+    try:
+        with local_copy(paper.pdf_file) as source, tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'stamped.pdf')
+            pages, _ = get_process_pool().submit(
+                stamp_pdf, source, output, footer_text(payment.email, payment.ref), paper.password
+            ).result()
+            name = f"{WATERMARK_FOLDER}{payment.ref}-{paper.pk}-{uuid.uuid4().hex}.pdf"
+            with open(output, 'rb') as f:
+                name = storage().save(name, File(f, name=os.path.basename(name)))
+    except Exception as e:
+        copy.mark_failed(e)
+        raise
+    copy.mark_ready(name, checksum, pages)
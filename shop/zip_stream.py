@@ -0,0 +1,96 @@
+# shop/zip_stream.py
+
+"""
+Streaming ZIP archives of several PDFs (a purchase or a term's free papers).
+
+``stream_zip`` yields the archive while it is being written: each PDF is
+read from storage in STREAM_CHUNK_SIZE pieces and copied into the archive
+uncompressed (PDFs are already compressed), and every piece is handed to
+the response as soon as it is written. Memory use stays at one chunk
+whatever the size of the archive. Entries use data descriptors, so sizes
+and CRCs follow the data and nothing needs to be read twice.
+
+The first entry, ``manifest.json``, lists every entry with its index, size,
+SHA-256 and a direct download link. A client whose download was cut off
+can read the manifest from the partial archive, keep the entries that
+arrived whole, and ask for the rest with ``?start=<index>``.
+"""
+
+import json
+import zipfile
+from collections import namedtuple
+
+MANIFEST_NAME = 'manifest.json'
+
+STREAM_CHUNK_SIZE = 256 * 1024
+
+# Fixed timestamp so the same files always produce the same archive bytes
+ENTRY_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+ArchiveEntry = namedtuple('ArchiveEntry', ['name', 'field_file', 'size', 'checksum', 'url'])
+
+
+class _Sink:
+    """Write-only file object that holds written bytes until they are drained."""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def build_manifest(title, entries, start=0):
+    return {
+        'title': title,
+        'entries': [
+            {
+                'index': index,
+                'name': entry.name,
+                'size': entry.size,
+                'sha256': entry.checksum,
+                'url': entry.url,
+                'included': index >= start,
+            }
+            for index, entry in enumerate(entries)
+        ],
+    }
+
+
+def _entry_info(name, size=None):
+    info = zipfile.ZipInfo(name, date_time=ENTRY_DATE_TIME)
+    info.compress_type = zipfile.ZIP_STORED
+    info.external_attr = 0o644 << 16
+    if size is not None:
+        info.file_size = size
+    return info
+
+
+def stream_zip(title, entries, start=0):
+    """Yield the bytes of a stored ZIP of ``entries[start:]``, led by the manifest."""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        manifest = json.dumps(build_manifest(title, entries, start), indent=2).encode()
+        archive.writestr(_entry_info(MANIFEST_NAME), manifest)
+        yield sink.drain()
+
+        for entry in entries[start:]:
+            # Sizes are known up front, so only large files pay for ZIP64 records
+            force_zip64 = entry.size is None or entry.size >= zipfile.ZIP64_LIMIT
+            with archive.open(_entry_info(entry.name, entry.size), 'w', force_zip64=force_zip64) as target:
+                with entry.field_file.open('rb') as source:
+                    for chunk in source.chunks(STREAM_CHUNK_SIZE):
+                        target.write(chunk)
+                        yield sink.drain()
+            yield sink.drain()
+    # Central directory
+    yield sink.drain()